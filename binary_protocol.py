@@ -0,0 +1,200 @@
+# Binary motion protocol
+# An opt-in alternative to ASCII G-code over USB, entered with '$B'. The
+# host sends fixed size records of step deltas which are read into a
+# preallocated buffer, checked and executed without parsing any text or
+# allocating, and acknowledged in batches instead of an 'ok' per line.
+#
+# Record, 12 bytes, little endian:
+#   0   sync   0xA5
+#   1   seq    sequence number, starts at 0 and wraps at 256
+#   2   flags  bits 0-1 pen (0 leave, 1 up, 2 down), bit 2 travel step
+#              mode (as G0), bit 7 end of stream
+#   3   reserved, 0
+#   4   dx     int16, steps
+#   6   dy     int16, steps
+#   8   delay  uint16, us per coil phase, 0 keeps the current delay; the
+#              delay from before the stream is put back when it ends
+#   10  crc    CRC-16/CCITT-FALSE of bytes 0-9
+#
+# Reply, 3 bytes: ACK or NAK, the sequence number of the last record
+# executed and a status. A host may have WINDOW records unacknowledged.
+# After a NAK records are dropped until the expected sequence number
+# arrives again, so the host resends from there (or ends the stream).
+# The end record is acknowledged once everything before it has run and
+# switches the controller back to ASCII.
+
+import array
+from gcode_interpreter import SoftLimitError
+
+SYNC = 0xA5
+ACK = 0xA6
+NAK = 0xA7
+RECORD_SIZE = 12
+ACK_EVERY = 4  # records executed per acknowledgement while more are waiting
+WINDOW = 8     # 96 bytes, inside UsbStream.rx_buffer
+
+PEN_MASK = 0x03
+PEN_UP = 1
+PEN_DOWN = 2
+TRAVEL = 0x04
+END = 0x80
+
+# reply statuses
+OK = 0
+BAD_CRC = 1
+BAD_SEQUENCE = 2
+SOFT_LIMIT = 3
+
+
+def _crc_table():
+    table = array.array('H', [0] * 256)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table[i] = crc & 0xFFFF
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data, length):
+    crc = 0xFFFF
+    table = _CRC_TABLE
+    for i in range(length):
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ data[i]) & 0xFF]
+    return crc
+
+
+def encode_record(buf, seq, dx=0, dy=0, flags=0, delay_us=0):
+    """Fill buf (RECORD_SIZE bytes) with a record, for tests and benchmarks."""
+    buf[0] = SYNC
+    buf[1] = seq & 0xFF
+    buf[2] = flags
+    buf[3] = 0
+    buf[4] = dx & 0xFF
+    buf[5] = (dx >> 8) & 0xFF
+    buf[6] = dy & 0xFF
+    buf[7] = (dy >> 8) & 0xFF
+    buf[8] = delay_us & 0xFF
+    buf[9] = (delay_us >> 8) & 0xFF
+    crc = crc16(buf, 10)
+    buf[10] = crc & 0xFF
+    buf[11] = crc >> 8
+
+
+class BinaryReceiver:
+    """Reads and executes records until the host ends the stream.
+
+    reader needs readinto() and writer write(), e.g. sys.stdin.buffer
+    and sys.stdout.buffer. ready() returns True when more input is
+    waiting; when it is not, the batch so far is acknowledged at once so
+    a host that has stopped sending is not left waiting.
+    """
+
+    def __init__(self, gcode, reader, writer, ready):
+        self.gcode = gcode
+        self.reader = reader
+        self.writer = writer
+        self.ready = ready
+        self.record = bytearray(RECORD_SIZE)
+        view = memoryview(self.record)
+        self._sync = view[:1]
+        self._rest = view[1:]
+        self._reply = bytearray(3)
+        self.last = 0xFF       # sequence number of the last record executed
+        self.records = 0
+        self.errors = 0
+
+    def _read_into(self, view):
+        got = self.reader.readinto(view)
+        while got is not None and got < len(view):
+            # only partial reads slice, a full read never allocates
+            more = self.reader.readinto(view[got:])
+            got += more or 0
+
+    def _read_record(self):
+        # hunt for the sync byte, then read the rest of the record
+        record = self.record
+        self._read_into(self._sync)
+        while record[0] != SYNC:
+            self._read_into(self._sync)
+        self._read_into(self._rest)
+
+    def _send(self, code, status):
+        reply = self._reply
+        reply[0] = code
+        reply[1] = self.last
+        reply[2] = status
+        self.writer.write(reply)
+
+    def run(self):
+        """Execute records until an end record, then return."""
+        gcode = self.gcode
+        # the records' delays last only as long as the stream
+        delays = (gcode.motor_x.delay_us, gcode.motor_y.delay_us)
+        try:
+            self._run()
+        finally:
+            gcode.motor_x.delay_us, gcode.motor_y.delay_us = delays
+
+    def _run(self):
+        gcode = self.gcode
+        record = self.record
+        self.last = 0xFF
+        pending = 0  # executed records not yet acknowledged
+        dropping = False  # after a NAK, until the expected record turns up
+        while True:
+            if pending and not self.ready():
+                self._send(ACK, OK)
+                pending = 0
+            self._read_record()
+
+            if crc16(record, 10) != record[10] | (record[11] << 8):
+                self.errors += 1
+                if not dropping:
+                    self._send(NAK, BAD_CRC)
+                    dropping = True
+                pending = 0
+                continue
+            if record[1] != (self.last + 1) & 0xFF:
+                if not dropping:
+                    self.errors += 1
+                    self._send(NAK, BAD_SEQUENCE)
+                    dropping = True
+                pending = 0
+                continue
+            dropping = False
+
+            flags = record[2]
+            if flags & END:
+                self.last = record[1]
+                self._send(ACK, OK)
+                return
+
+            dx = record[4] | (record[5] << 8)
+            if dx & 0x8000:
+                dx -= 0x10000
+            dy = record[6] | (record[7] << 8)
+            if dy & 0x8000:
+                dy -= 0x10000
+            delay = record[8] | (record[9] << 8)
+            if delay:
+                gcode.motor_x.delay_us = delay
+                gcode.motor_y.delay_us = delay
+            try:
+                gcode.move_steps(dx, dy, flags & PEN_MASK, flags & TRAVEL)
+            except SoftLimitError:
+                self.errors += 1
+                self._send(NAK, SOFT_LIMIT)
+                dropping = True
+                pending = 0
+                continue
+
+            self.last = record[1]
+            self.records += 1
+            pending += 1
+            if pending >= ACK_EVERY:
+                self._send(ACK, OK)
+                pending = 0
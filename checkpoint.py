@@ -0,0 +1,123 @@
+# Job checkpoints
+# Records how far a job has got (its file offset and line, the position
+# and pen, the positioning mode) so that a job interrupted by a power cut
+# or a watchdog reset can be resumed instead of started again.
+#
+# Records are 32 bytes and go in turn into the SLOTS slots of one
+# preallocated file, which is never truncated or recreated, and a record
+# is written at most once every interval_ms. The newest record with a
+# good CRC is the checkpoint, so a write cut short by a reset only loses
+# that record. A record with job 0 means no job was running.
+#
+# Record, little endian:
+#   0   seq     uint32, counts up with every record written
+#   4   job     uint16, job id, 0 for none
+#   6   flags   bit 0 relative positioning (G91)
+#   7   reserved, 0
+#   8   offset  uint32, bytes of the job file done
+#   12  line    uint32, lines of the job file done
+#   16  x, y, z int32 each, position in steps (z 1 is pen up)
+#   28  reserved, 0
+#   30  crc     CRC-16/CCITT-FALSE of bytes 0-29
+
+import os, struct, time
+from binary_protocol import crc16
+
+CHECKPOINT_FILE = "checkpoint.bin"
+RECORD_SIZE = 32
+SLOTS = 16
+INTERVAL_MS = 15000
+_FORMAT = "<IHBBIIiiiH"
+RELATIVE = 0x01
+
+
+class Checkpoint:
+    def __init__(self, path=CHECKPOINT_FILE, interval_ms=INTERVAL_MS, slots=SLOTS):
+        self.path = path
+        self.interval_ms = interval_ms
+        self.slots = slots
+        self.record = bytearray(RECORD_SIZE)
+        self._seq = 0
+        self._slot = 0
+        self._last_write = None
+        self._last_offset = None
+        latest = self._scan()
+        if latest is not None:
+            self._seq, self._slot = latest
+            self._slot = (self._slot + 1) % slots
+
+    def _scan(self):
+        """Find the newest good record, making the file if it is missing.
+
+        Returns (seq, slot) of that record, or None.
+        """
+        try:
+            size = os.stat(self.path)[6]
+        except OSError:
+            size = -1
+        if size != RECORD_SIZE * self.slots:
+            with open(self.path, "wb") as f:
+                f.write(bytes(RECORD_SIZE * self.slots))  # all bad CRCs
+            return None
+        latest = None
+        record = self.record
+        with open(self.path, "rb") as f:
+            for slot in range(self.slots):
+                f.readinto(record)
+                seq = struct.unpack_from("<I", record, 0)[0]
+                if crc16(record, 30) != struct.unpack_from("<H", record, 30)[0]:
+                    continue
+                if latest is None or seq > latest[0]:
+                    latest = (seq, slot)
+        return latest
+
+    def load(self):
+        """The newest checkpoint of a job, as a dict, or None."""
+        latest = self._scan()
+        if latest is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(latest[1] * RECORD_SIZE)
+            f.readinto(self.record)
+        seq, job, flags, _, offset, line, x, y, z, _ = struct.unpack_from(_FORMAT, self.record)
+        if not job:
+            return None
+        return {'job': job, 'offset': offset, 'line': line,
+                'position': {'X': x, 'Y': y, 'Z': z}, 'relative': bool(flags & RELATIVE)}
+
+    def save(self, job, offset, line, gcode, force=False):
+        """Record a job's progress and gcode's position, if it is time to.
+
+        Returns True if a record was written.
+        """
+        now = time.ticks_ms()
+        if not force:
+            if offset == self._last_offset:
+                return False  # nothing new, e.g. while paused
+            if self._last_write is not None and time.ticks_diff(now, self._last_write) < self.interval_ms:
+                return False
+        # let queued moves finish, so the position is where the pen is,
+        # and the second core is not stepping while flash is written
+        gcode.drain()
+        position = gcode.position
+        self._write(job, RELATIVE if gcode.relative_mode else 0, offset, line,
+                    position['X'], position['Y'], position['Z'])
+        self._last_write = now
+        self._last_offset = offset
+        return True
+
+    def clear(self):
+        """Record that no job is running."""
+        self._write(0, 0, 0, 0, 0, 0, 0)
+        self._last_write = None
+        self._last_offset = None
+
+    def _write(self, job, flags, offset, line, x, y, z):
+        self._seq += 1
+        record = self.record
+        struct.pack_into(_FORMAT, record, 0, self._seq, job, flags, 0, offset, line, x, y, z, 0)
+        struct.pack_into("<H", record, 30, crc16(record, 30))
+        with open(self.path, "r+b") as f:
+            f.seek(self._slot * RECORD_SIZE)
+            f.write(record)
+        self._slot = (self._slot + 1) % self.slots
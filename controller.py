@@ -0,0 +1,550 @@
+# GRBL style serial controller
+# The command loop test_usb.py and grbl.py run, as a class so that the
+# same code can talk over any stream: the USB console on the Pico, a UART
+# (UartStream), or a simulated port on a PC for replaying recorded
+# sessions.
+#
+# A stream needs any() (bytes waiting, without blocking), readinto() and
+# write() (str or bytes), plus name and rx_buffer attributes for '$I' and
+# a set_raw(on) hook called around binary mode.
+#
+# Motion lines go through without touching the heap: input is assembled
+# in a preallocated buffer, G0/G1 lines are tokenised in place by
+# GCodeInterpreter.parse_buffer and replies are built by reply.Reply.
+# The loop collects garbage once input has gone quiet, and between lines
+# when memory runs low, so an automatic collection is rarely needed and
+# never lands in the middle of a move, which allocates nothing to
+# trigger one. Automatic collection stays on for everything else: '$B'
+# streams, macros and the second core's loop can use up a lot in one
+# line. test_alloc.py checks the allocations on the Pico.
+#
+# Modules only some commands need (binary_protocol for '$B', profiler
+# for '$P', macros for '$M') are imported the first time they are used, to keep boot
+# short. run() announces "[MSG:Ready]" before it starts reading.
+#
+# With a motion.StepGenerator attached to the interpreter, moves are
+# queued for the second core and '?' reports where it has got to. If a
+# move fails there, the next command is answered with an error and a
+# soft reset (Ctrl-X) starts the generator again.
+
+import gc
+import sys
+from array import array
+from time import ticks_ms, ticks_diff
+from gcode_interpreter import SoftLimitError
+from reply import Reply
+
+# === Timing constants ===
+IDLE_RESET_MS      = 8000  # if no '?' for this long, treat as new session
+REQ_INTERVAL_MS    = 1500  # max gap between two '?' for banner trigger
+STATUS_INTERVAL_MS = 2000  # send idle status every 2s after banner
+GC_IDLE_MS         = 100   # collect garbage once input has been quiet this long
+GC_RESERVE         = 8192  # or between lines if free memory gets this low
+
+LINE_SIZE = 128  # longest line accepted, longer ones get GRBL's error:14
+
+# --- Settings with descriptions, as listed by '$$' ---
+DEFAULT_SETTINGS = {
+    0:  (10,   "Step pulse, usec"),
+    1:  (25,   "Step idle delay, msec"),
+    2:  (0,    "Step port invert mask"),
+    3:  (0,    "Dir port invert mask"),
+    4:  (0,    "Step enable invert, bool"),
+    5:  (0,    "Limit pins invert, bool"),
+    6:  (0,    "Probe pin invert, bool"),
+    10: (3,    "Status report mask"),
+    11: (0.010,"Junction deviation, mm"),
+    12: (0.002,"Arc tolerance, mm"),
+    13: (0,    "Report in inches, bool"),
+    20: (0,    "Soft limits enable, bool"),
+    21: (0,    "Hard limits enable, bool"),
+    22: (0,    "Homing cycle enable, bool"),
+    23: (0,    "Homing dir invert mask"),
+    24: (25.0, "Homing feed, mm/min"),
+    25: (500.0,"Homing seek, mm/min"),
+    26: (250,  "Homing debounce, msec"),
+    27: (1.000,"Homing pull-off, mm"),
+    30: (1000, "Max spindle speed, RPM"),
+    31: (0,    "Min spindle speed, RPM"),
+    32: (1,    "Laser-mode enable, bool"),
+    130: (80.0, "X max travel, mm"),
+    131: (80.0, "Y max travel, mm"),
+}
+
+
+class UsbStream:
+    """The USB serial console (sys.stdin / sys.stdout) as a controller stream."""
+
+    name = 'USB'
+    # Bytes of G-code a sender may have in flight, advertised by '$I' so
+    # that streaming clients can use character counting. Lines wait in the
+    # USB stdin buffer while a move runs; keep this below its size.
+    rx_buffer = 128
+
+    def __init__(self):
+        import select
+        self._poller = select.poll()
+        self._poller.register(sys.stdin, select.POLLIN)
+
+    def any(self):
+        # ipoll does not allocate, unlike poll
+        for _ in self._poller.ipoll(0):
+            return 1
+        return 0
+
+    def readinto(self, buf):
+        return sys.stdin.buffer.readinto(buf)
+
+    def write(self, data):
+        if isinstance(data, str):
+            sys.stdout.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+
+    def set_raw(self, raw):
+        # Ctrl-C must not interrupt raw binary bytes
+        import micropython
+        micropython.kbd_intr(-1 if raw else 3)
+
+
+XON = b"\x11"
+XOFF = b"\x13"
+
+
+class UartStream:
+    """A machine.UART as a controller stream, with flow control.
+
+    Received bytes are moved from the UART's FIFO into an rxbuf byte ring
+    buffer by the UART interrupt, so they keep arriving while a move
+    runs. With cts and rts pins the UART does hardware flow control: once
+    the ring buffer is full the FIFO fills and RTS tells the host to
+    stop. With xonxoff, XOFF is sent when the ring buffer is three
+    quarters full and XON once it is down to a quarter. That is checked
+    whenever the controller looks for input and, where the port has it,
+    from the UART's receive idle interrupt, so a host streaming without
+    a pause through a long move relies on RTS/CTS or on character
+    counting: '$I' advertises a receive buffer a line short of rxbuf.
+    """
+
+    name = 'UART'
+
+    def __init__(self, uart_id=0, baudrate=115200, tx=16, rx=17, cts=None, rts=None,
+                 rxbuf=2048, xonxoff=False):
+        from machine import UART, Pin
+        options = {}
+        flow = 0
+        if cts is not None:
+            options['cts'] = Pin(cts)
+            flow |= UART.CTS
+        if rts is not None:
+            options['rts'] = Pin(rts)
+            flow |= UART.RTS
+        self.uart = UART(uart_id, baudrate=baudrate, tx=Pin(tx), rx=Pin(rx), rxbuf=rxbuf,
+                         timeout=0, flow=flow, **options)
+        self.rx_buffer = rxbuf - LINE_SIZE
+        self.xonxoff = xonxoff
+        self._high = rxbuf * 3 // 4
+        self._low = rxbuf // 4
+        self._stopped = False  # XOFF sent
+        self._raw = False
+        if xonxoff:
+            self.uart.write(XON)  # in case an earlier run left the host stopped
+            trigger = getattr(UART, 'IRQ_RXIDLE', None)
+            if trigger is not None:
+                self.uart.irq(self._idle, trigger)
+
+    def _idle(self, uart):
+        self._flow(uart.any())
+
+    def _flow(self, waiting):
+        if self._raw:
+            return  # XON and XOFF would be taken for binary replies
+        if not self._stopped and waiting >= self._high:
+            self.uart.write(XOFF)
+            self._stopped = True
+        elif self._stopped and waiting <= self._low:
+            self.uart.write(XON)
+            self._stopped = False
+
+    def any(self):
+        waiting = self.uart.any()
+        if self.xonxoff:
+            self._flow(waiting)
+        return waiting
+
+    def readinto(self, buf):
+        # blocks until something arrives, as reading the USB console does;
+        # may read less than len(buf)
+        uart = self.uart
+        while not uart.any():
+            pass
+        got = uart.readinto(buf)
+        if self.xonxoff:
+            self._flow(uart.any())
+        return got
+
+    def write(self, data):
+        self.uart.write(data)
+
+    def set_raw(self, raw):
+        if raw and self._stopped:
+            self.uart.write(XON)
+            self._stopped = False
+        self._raw = raw
+
+
+class GrblController:
+    def __init__(self, gcode, stream, profiler=None, settings=None):
+        self.gcode = gcode
+        self.stream = stream
+        self.profiler = profiler
+        self.settings = dict(settings or DEFAULT_SETTINGS)
+        self.binary = None  # the '$B' receiver, made on first use
+        self.macros = None  # the '$M' macro store, likewise
+        self.recording = None  # name of the macro being defined
+        self._macro_lines = []
+        gcode.output = stream
+        self.reply = Reply(96)
+        self._snapshot = array('i', [0] * 6)  # for a stepper's snapshot()
+
+        # === Input ===
+        self.line = bytearray(LINE_SIZE)
+        self.length = 0         # bytes of the current line so far
+        self.overflow = False   # the current line did not fit
+        self._byte = bytearray(1)
+
+        # === State ===
+        self.banner_sent        = False
+        self.question_counter   = 0
+        self.last_question_time = 0
+        self.last_status_time   = ticks_ms()
+        self.last_line_time     = ticks_ms()
+        self.garbage            = False  # lines handled since the last collection
+        self.apply_settings()
+
+    def apply_settings(self):
+        """Push the settings the interpreter uses into it."""
+        settings = self.settings
+        self._settings_text = None  # the '$$' listing, made when first asked for
+        self.gcode.soft_limits = bool(settings[20][0])
+        self.gcode.set_travel(settings[130][0], settings[131][0])
+
+    # === Helpers ===
+    def send_status(self):
+        stepper = self.gcode.stepper
+        if stepper and not stepper.idle():
+            # where the second core has got to, not where the queue ends
+            state = stepper.snapshot(self._snapshot)
+            self.reply.text(b"<Run|MPos:").fixed3(state[1]).text(b",").fixed3(state[2]) \
+                .text(b",").fixed3(state[3]).text(b"|FS:0,0>\r\n").send(self.stream)
+            return
+        pos = self.gcode.position
+        self.reply.text(b"<Idle|MPos:").fixed3(pos['X']).text(b",").fixed3(pos['Y']) \
+            .text(b",").fixed3(pos['Z']).text(b"|FS:0,0>\r\n").send(self.stream)
+
+    def send_banner(self):
+        """Send GRBL banner + a few idle status lines."""
+        write = self.stream.write
+        write(b"Grbl 1.1f ['$' for help]\r\n")
+        write(b"<Idle|MPos:0.000,0.000,0.000|FS:0,0>\r\n")
+        write(b"[MSG:'$H'|'$X' to unlock]\r\n")
+        for _ in range(3):
+            self.send_status()
+        self.banner_sent    = True
+        self.last_status_time = ticks_ms()
+
+    def ready(self):
+        """Tell a host waiting after a reset that input is being read."""
+        self.stream.write(b"[MSG:Ready]\r\n")
+
+    def run(self):
+        """The main loop, never returns."""
+        self.ready()
+        while True:
+            self.step()
+
+    def step(self):
+        """One pass of the loop: the periodic status, then the input waiting.
+
+        Handles at most one line. Returns True if it did.
+        """
+        try:
+            now = ticks_ms()
+
+            # If no '?' for a while, assume UGS reconnected → reset banner logic
+#             if self.banner_sent and ticks_diff(now, self.last_question_time) > IDLE_RESET_MS:
+#                 self.banner_sent      = False
+#                 self.question_counter = 0
+
+            # Periodic idle status after banner
+            if self.banner_sent and ticks_diff(now, self.last_status_time) > STATUS_INTERVAL_MS:
+                self.send_status()
+                self.last_status_time = now
+
+            # Check for incoming data
+            if not self.read_line():
+                if self.garbage and ticks_diff(now, self.last_line_time) > GC_IDLE_MS:
+                    gc.collect()
+                    self.garbage = False
+                return False
+
+            self.last_line_time = now
+            self.garbage = True
+            if gc.mem_free() < GC_RESERVE:
+                gc.collect()  # between moves, rather than in one
+            self.handle_buffer(now)
+            return True
+
+        except SoftLimitError as e:
+            # like GRBL, report the refused move as a soft limit alarm
+            self.stream.write("[MSG:Soft limit {}]\r\n".format(e))
+            self.stream.write("ALARM:2\r\n")
+
+        except Exception as e:
+            self.stream.write("error: {}\r\n".format(e))
+
+    def read_line(self):
+        """Move waiting input into the line buffer; True once a line is complete.
+
+        Carriage returns at either end of the line are dropped, as
+        strip("\r\n") would.
+        """
+        stream = self.stream
+        byte = self._byte
+        line = self.line
+        while stream.any():
+            stream.readinto(byte)
+            c = byte[0]
+            if c == 10:  # '\n'
+                n = self.length
+                while n and line[n - 1] == 13:
+                    n -= 1
+                self.length = n
+                return True
+            if c == 13 and not self.length:
+                continue
+            if self.length < LINE_SIZE:
+                line[self.length] = c
+                self.length += 1
+            else:
+                self.overflow = True
+        return False
+
+    def handle_buffer(self, now):
+        """Handle the line in the buffer: motion in place, the rest as a str."""
+        n = self.length
+        self.length = 0
+        if self.overflow:
+            self.overflow = False
+            self.stream.write(b"error:14\r\n")
+            return
+        if not n:
+            return
+        line = self.line
+        if n == 1 and line[0] == 63:  # '?'
+            self.question(now)
+        elif n == 1 and line[0] == 24:  # Ctrl-X
+            self.soft_reset()
+        elif line[0] != 36 and self.recording is None and self.gcode.parse_buffer(line, n):  # not '$'
+            self.stream.write(b"ok\r\n")
+        else:
+            self.handle(str(line[:n], 'utf-8'), now)
+
+    def question(self, now):
+        # Count and time-stamp the `?`
+        if ticks_diff(now, self.last_question_time) < REQ_INTERVAL_MS:
+            self.question_counter += 1
+        else:
+            self.question_counter = 1
+        self.last_question_time = now
+
+        # On the second quick `?`, fire the banner if needed
+        if not self.banner_sent and self.question_counter >= 2:
+            self.send_banner()
+            self.question_counter = 0
+            return  # skip status this round
+
+        # After banner’s shown, always reply with status
+        if self.banner_sent:
+            self.send_status()
+            self.last_status_time = now
+
+    def soft_reset(self):
+        self.banner_sent      = False
+        self.question_counter = 0
+        stepper = self.gcode.stepper
+        if stepper and not stepper.running():
+            stepper.start()  # a move failed on the second core
+
+    def macro(self, arg):
+        """Handle '$M' commands, arg being what follows the '$M'.
+
+        '$M' lists the macros, '$M=name' starts defining one from the
+        lines that follow and '$M=' saves it, '$M name' runs one and
+        '$M-name' deletes one.
+        """
+        write = self.stream.write
+        if self.macros is None:
+            from macros import MacroStore, valid_name
+            self.macros = MacroStore()
+            self._valid_name = valid_name
+        macros = self.macros
+        if arg == '=':
+            if self.recording is None:
+                raise ValueError("no macro being defined")
+            name, self.recording = self.recording, None
+            lines, self._macro_lines = self._macro_lines, []
+            count = macros.define(name, lines, self.gcode.steps_per_mm)
+            write("[MSG:Macro {}, {} segments]\r\n".format(name, count))
+        elif arg.startswith('='):
+            if not self._valid_name(arg[1:]):
+                raise ValueError("bad macro name")
+            self.recording = arg[1:]
+            self._macro_lines = []
+        elif arg.startswith('-'):
+            if not macros.delete(arg[1:]):
+                raise ValueError("no macro {}".format(arg[1:]))
+        elif arg.strip():
+            macros.run(arg.strip(), self.gcode)
+        else:
+            for name in macros.names():
+                write("[MACRO:{}]\r\n".format(name))
+
+    def handle(self, line, now):
+        write = self.stream.write
+        gcode = self.gcode
+
+        # ——— Handle `?` probes ———
+        if line == '?':
+            self.question(now)
+            return
+
+        # ——— Soft reset (Ctrl-X) ———
+        if line == '\x18':
+            self.soft_reset()
+            return
+
+        # ——— Lines of a macro being defined are stored, not run ———
+        if self.recording is not None and line != '$M=':
+            self._macro_lines.append(line)
+            write("ok\r\n")
+            return
+
+        # ——— Ensure banner before any '$' command ———
+        if not self.banner_sent and line.startswith('$'):
+            self.send_banner()
+
+        # ——— GRBL-style commands ———
+        if line == '$I':
+            write("[VER:MicroPythonGRBL:1.1]\r\n")
+            # GRBL puts the block and receive buffer sizes last
+            write("[OPT:MPY,{},3AXIS,BIN,1,{}]\r\n".format(self.stream.name, self.stream.rx_buffer))
+            write("ok\r\n")
+
+        elif line == '$X':
+            write("[MSG:Caution: Unlocked]\r\n")
+            write("ok\r\n")
+
+        elif line == '$B':
+            # Switch to binary motion records until the host sends an end
+            # record. The [MSG] chatter would only get in the way of the
+            # replies.
+            write("[MSG:Binary mode]\r\n")
+            write("ok\r\n")
+            if self.binary is None:
+                from binary_protocol import BinaryReceiver
+                self.binary = BinaryReceiver(gcode, self.stream, self.stream, self.stream.any)
+            self.stream.set_raw(True)
+            verbose = gcode.verbose
+            gcode.verbose = False
+            try:
+                self.binary.run()
+            finally:
+                gcode.verbose = verbose
+                self.stream.set_raw(False)
+
+        elif line.startswith('$P'):
+            # Step timing profiler: '$P' report, '$P=1' on, '$P=0' off, '$P=R' reset
+            profiler = self.profiler
+            if profiler is None:
+                from profiler import StepProfiler
+                profiler = self.profiler = StepProfiler()
+            arg = line[3:] if line.startswith('$P=') else ''
+            if arg in ('0', '1'):
+                for motor in (gcode.motor_x, gcode.motor_y, gcode.motor_z):
+                    motor.profiler = profiler if arg == '1' else None
+            elif arg == 'R':
+                profiler.reset()
+            write(profiler.format_summary() + "\r\n")
+            write("ok\r\n")
+
+        elif line == '$$':
+            # Proper GRBL-style settings dump, formatted once per change
+            if self._settings_text is None:
+                self._settings_text = "".join(
+                    "${}={} ({})\r\n".format(key, *self.settings[key]) for key in sorted(self.settings)
+                ).encode()
+            write(self._settings_text)
+            write("ok\r\n")
+
+        elif line.startswith('$M'):
+            self.macro(line[2:])
+            write("ok\r\n")
+
+        elif line.startswith('$') and line[1:2].isdigit() and '=' in line:
+            # '$N=value' changes a setting, e.g. '$20=1' for soft limits
+            key, value = line[1:].split('=', 1)
+            key = int(key)
+            if key not in self.settings:
+                write("error:3\r\n")
+            else:
+                old, desc = self.settings[key]
+                self.settings[key] = (type(old)(float(value)), desc)
+                self.apply_settings()
+                write("ok\r\n")
+
+        elif line in ['$G','??$G','?$G']:
+            # G90 means absolute positioning
+            # G91 means relative positioning
+            # G21 means?
+            # G93 means?
+            mode = "G91" if gcode.relative_mode else "G90"
+            write(f"[{mode} G21 G94]\r\n")
+            write("ok\r\n")
+
+        elif line.startswith('G92'):
+            # Set position
+            new_pos = {}
+            for tok in line.split()[1:]:
+                axis, val = tok[0], float(tok[1:])
+                if axis in 'XYZ':
+                    new_pos[axis] = val
+            gcode.set_position(**new_pos)
+            write("ok\r\n")
+
+        elif line.startswith('$J='):
+            # Jog (relative) only
+            jog = line[3:].strip()
+            if not jog.startswith("G91"):
+                write("error: Only G91 (relative) jogs supported\r\n")
+            else:
+                dx = dy = dz = 0
+                for tok in jog.split():
+                    if tok[0] == 'X':
+                        dx = float(tok[1:]) * gcode.steps_per_mm
+                    elif tok[0] == 'Y':
+                        dy = float(tok[1:]) * gcode.steps_per_mm
+                    elif tok[0] == 'Z':
+                        dz = float(tok[1:]) * gcode.steps_per_mm
+                gcode.jog(dx, dy, dz)
+                write("ok\r\n")
+
+        elif line == '$H':
+            write("[MSG:Homing...]\r\n")
+            gcode.home()
+            write("ok\r\n")
+
+        else:
+            # All other G-code (motion)
+            gcode.parse_line(line)
+            write("ok\r\n")
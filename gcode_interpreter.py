@@ -1,4 +1,65 @@
 import sys
+from reply import Reply
+
+
+class SoftLimitError(Exception):
+    pass
+
+
+_POWERS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _space(c):
+    # what str.split() splits on
+    return c == 32 or 9 <= c <= 13
+
+
+def _steps(buf, i, end, scale):
+    """int(float(buf[i:end]) * scale) for a plain decimal, without allocating.
+
+    Returns None if the text is not a plain decimal of up to 7 digits, or
+    if float rounding could give a different answer: when the product
+    is within a few float32 ulps of a whole step.
+    """
+    negative = False
+    if i < end and (buf[i] == 45 or buf[i] == 43):  # '-', '+'
+        negative = buf[i] == 45
+        i += 1
+    mantissa = 0
+    digits = 0
+    places = -1
+    while i < end:
+        c = buf[i]
+        if 48 <= c <= 57:
+            if digits == 7:
+                return None
+            mantissa = mantissa * 10 + c - 48
+            digits += 1
+            if places >= 0:
+                places += 1
+        elif c == 46 and places < 0:  # '.'
+            places = 0
+        else:
+            return None
+        i += 1
+    if not digits:
+        return None
+    unit = _POWERS[places] if places > 0 else 1
+    product = mantissa * scale
+    if product >= 1 << 24:
+        return None
+    steps = product // unit
+    rest = product - steps * unit
+    if rest:
+        if unit - rest < rest:
+            rest = unit - rest
+        if rest <= product >> 20:
+            return None
+    elif mantissa % unit:
+        return None  # a whole number of steps from a fraction, float may fall short
+    return -steps if negative else steps
+
+
 class GCodeInterpreter:
     def __init__(self, motor_x, motor_y, motor_z):
         self.motor_x = motor_x
@@ -7,12 +68,116 @@ class GCodeInterpreter:
         self.position = {'X': 0, 'Y': 0, 'Z': 0}
         self.steps_per_mm = 10
         self.relative_mode = True  # G91 by default
+        self.state = 'Idle'  # 'Run' while a move is in progress
+        # Step modes for X/Y: fast full steps for G0 travel, smoother half
+        # steps for G1 drawing
+        self.travel_mode = 'full'
+        self.draw_mode = 'half'
+        # the way home() runs X and Y, towards their endstops
+        self.home_x = getattr(motor_x, 'end_stop_direction', -1)
+        self.home_y = getattr(motor_y, 'end_stop_direction', 1)
+        # Soft limits ($20): moves that would leave the envelope are refused
+        # before anything moves
+        self.soft_limits = False
+        self.set_travel(80, 80)
+        self.verbose = True  # write [MSG] lines describing each command
+        self.output = None   # where they go, sys.stdout if None
+        self.stepper = None  # a motion.StepGenerator to queue moves for, None to make them here
+        self._reply = Reply(64)
+
+    def _out(self):
+        return self.output or sys.stdout.buffer
 
     def parse_line(self, line):
+        move = self.plan(line)
+        if move:
+            self.execute(*move)
+
+    def parse_buffer(self, buf, length):
+        """parse_line for a line in a bytearray, without allocating.
+
+        Handles bare G90/G91 and G0/G1 lines whose X, Y and Z words are
+        plain decimals. Returns False, having done nothing, for any other
+        line and for numbers _steps() will not convert; parse_line gives
+        the same result for those, just with a few allocations.
+        """
+        scale = self.steps_per_mm
+        if type(scale) is not int or not 0 < scale < 100:
+            return False  # keeps mantissa * scale a small int
+        start = 0
+        while start < length and _space(buf[start]):
+            start += 1
+        end = length
+        while end > start and _space(buf[end - 1]):
+            end -= 1
+        i = start
+        while i < end and not _space(buf[i]):
+            i += 1
+        word = i - start
+        if word < 2 or buf[start] | 0x20 != 103:  # 'g'
+            return False
+        kind = buf[start + 1]
+        if kind == 57:  # '9': only a bare G90 or G91
+            if word != 3 or i != end or not 48 <= buf[start + 2] <= 49:
+                return False
+            self.relative_mode = buf[start + 2] == 49
+            if self.verbose:
+                if self.relative_mode:
+                    self._out().write(b"[MSG: Setting positioning mode to Relative]\r\n")
+                else:
+                    self._out().write(b"[MSG: Setting positioning mode to Absolute]\r\n")
+            return True
+        if kind != 48 and kind != 49:
+            return False
+        # G0 and G00 travel, any other G0x/G1x word draws
+        travel = kind == 48 and (word == 2 or (word == 3 and buf[start + 2] == 48))
+
+        position = self.position
+        relative = self.relative_mode
+        x = position['X']
+        y = position['Y']
+        z = position['Z']
+        moved = False
+        while True:
+            while i < end and _space(buf[i]):
+                i += 1
+            if i >= end:
+                break
+            first = i
+            while i < end and not _space(buf[i]):
+                i += 1
+            axis = buf[first] & 0xDF  # upper case
+            if 88 <= axis <= 90:  # 'X', 'Y', 'Z'
+                value = _steps(buf, first + 1, i, 1 if axis == 90 else scale)
+                if value is None:
+                    return False
+                if axis == 88:
+                    x = position['X'] + value if relative else value
+                elif axis == 89:
+                    y = position['Y'] + value if relative else value
+                else:
+                    z = position['Z'] + value if relative else value
+                moved = True
+        if not moved:
+            return True
+        if self.soft_limits:
+            self.check_limits(x, y)
+        self.execute('G0' if travel else 'G1', x - position['X'], y - position['Y'], z - position['Z'])
+        return True
+
+    def plan(self, line):
+        """Work out the move for a line without making it.
+
+        G90/G91 take effect here. Returns None for lines that do not move,
+        otherwise (cmd, dx, dy, dz) for execute(). Raises
+        SoftLimitError if soft limits are on and the target is outside
+        the envelope.
+        """
         line = line.strip().upper()
         if not line or not line.startswith(('G0', 'G1','G90','G91')):
-            sys.stdout.write("[MSG]:Unsupported commands {}\r\n".format(line))
-            return  # Ignore unsupported commands
+            if self.verbose:
+                self._out().write("[MSG]:Unsupported commands {}\r\n".format(line).encode())
+            return None  # Ignore unsupported commands
 
         parts = line.split() # ['G0' ,'X1', 'Y2', 'Z3']
         cmd = parts[0] #G0
@@ -20,14 +185,14 @@ class GCodeInterpreter:
 
         if line == 'G90':
             self.relative_mode = False
-            sys.stdout.write("[MSG: Setting positioning mode to Absolute]\r\n")
-           
-            return
+            if self.verbose:
+                self._out().write(b"[MSG: Setting positioning mode to Absolute]\r\n")
+            return None
         elif line == 'G91':
             self.relative_mode = True
-            sys.stdout.write("[MSG: Setting positioning mode to Relative]\r\n")
-          
-            return
+            if self.verbose:
+                self._out().write(b"[MSG: Setting positioning mode to Relative]\r\n")
+            return None
 
         moved_axes = set() 
         for part in parts[1:]:
@@ -43,51 +208,174 @@ class GCodeInterpreter:
                         target[axis] = step_value
                     moved_axes.add(axis)
                 except ValueError:
-                    sys.stdout.write("[MSG]: Invalid value '{}'\r\n".format(value_str))
+                    if self.verbose:
+                        self._out().write("[MSG]: Invalid value '{}'\r\n".format(value_str).encode())
                     continue
 
-        
-        dx = target['X'] - self.position['X'] if 'X' in moved_axes else 0
-        dy = target['Y'] - self.position['Y'] if 'Y' in moved_axes else 0
-        dz = target['Z'] - self.position['Z'] if 'Z' in moved_axes else 0
+        if not moved_axes:
+            return None
+        if self.soft_limits:
+            self.check_limits(target['X'], target['Y'])
+
+        dx = target['X'] - self.position['X']
+        dy = target['Y'] - self.position['Y']
+        dz = target['Z'] - self.position['Z']
+        return cmd, dx, dy, dz
+
+    def execute(self, cmd, dx, dy, dz):
+        """Make a move returned by plan(), dx/dy in steps."""
 #         print("Computed target:", target)
 #         print("Position before move:", self.position)
 #         print("dx:", dx, " dy:", dy)
 
 #         print(f"dx:'{dx}', dy:'{dy}', dz:'{dz}'")
-        sys.stdout.write("[MSG:X:{}, Y:{}, Z:{}]\r\n".format(dx, dy, dz))
-        
-        # Perform movement
+        verbose = self.verbose
+        if verbose:
+            out = self._out()
+            self._reply.text(b"[MSG:X:").number(dx).text(b", Y:").number(dy).text(b", Z:").number(dz).text(b"]\r\n").send(out)
+
+        travel = cmd in ('G0', 'G00')
+        position = self.position
+        stepper = self.stepper
+        if stepper:
+            # the second core makes the move, from the position it ends at
+            stepper.push(travel, dx, dy, dz, position['X'] + dx, position['Y'] + dy, position['Z'] + dz)
+        else:
+            self.state = 'Run'
+            self.move_motors(travel, dx, dy, dz, out if verbose else None)
+            self.state = 'Idle'
+
+        # Update current position
+        position['X'] += dx
+        position['Y'] += dy
+        position['Z'] += dz
+
+    def move_motors(self, travel, dx, dy, dz, out=None):
+        """Step the motors through a move, describing it to out if given.
+
+        execute() calls this, or with a stepper attached the second core
+        does, without out.
+        """
+        mode = self.travel_mode if travel else self.draw_mode
+        say = self._reply
         if dx:
-            self.motor_x.move(abs(dx), direction=1 if dx > 0 else -1)
-            sys.stdout.write("[MSG:Moving X:{}]\r\n".format(dx))
+            self.motor_x.move(abs(dx), direction=1 if dx > 0 else -1, mode=mode)
+            if out:
+                say.text(b"[MSG:Moving X:").number(dx).text(b"]\r\n").send(out)
         if dy:
-            self.motor_y.move(abs(dy), direction=1 if dy > 0 else -1)
-            sys.stdout.write("[MSG:Moving Y:{}]\r\n".format(dy))
+            self.motor_y.move(abs(dy), direction=1 if dy > 0 else -1, mode=mode)
+            if out:
+                say.text(b"[MSG:Moving Y:").number(dy).text(b"]\r\n").send(out)
         if dz:
          
 #             print(f"dz is a {type(dz)}, value is {dz}")
-            sys.stdout.write("[MSG:Moving Pen, dz is {}]\r\n".format(dz))
+            if out:
+                say.text(b"[MSG:Moving Pen, dz is ").number(dz).text(b"]\r\n").send(out)
             # move pen either up or down - Z1 is up, Z0 is down
             if dz == 1: # up
-                sys.stdout.write("[MSG:Moving pen up]\r\n")
+                if out:
+                    out.write(b"[MSG:Moving pen up]\r\n")
                 self.motor_z.move(50,direction=-1) # pen up
             else: # down
-                sys.stdout.write("[MSG:Moving pen down]\r\n")
+                if out:
+                    out.write(b"[MSG:Moving pen down]\r\n")
                 self.motor_z.move(50,direction=1) # pen down
                 
 #             print("done moving")
-        
-        # Update current position
-        for axis in moved_axes:
-            self.position[axis] = target[axis]
+
+    def drain(self):
+        """Wait for queued moves to finish, before driving the motors directly."""
+        if self.stepper:
+            self.stepper.wait()
+
+    def move_steps(self, dx, dy, pen=0, travel=False):
+        """Move by whole steps with no G-code to parse, for binary_protocol.
+
+        pen 1 lifts the pen (Z1) and 2 lowers it (Z0) after the X/Y move,
+        0 leaves it alone. Soft limits apply as they do to G-code.
+        """
+        position = self.position
+        if self.soft_limits:
+            self.check_limits(position['X'] + dx, position['Y'] + dy)
+        dz = 0
+        if pen:
+            dz = (1 if pen == 1 else 0) - position['Z']
+        self.execute('G0' if travel else 'G1', dx, dy, dz)
+
+    def set_travel(self, x_mm, y_mm):
+        """Set the soft limit envelope: x_mm and y_mm of travel from the origin.
+
+        home() puts the origin at the endstops, so each axis travels away
+        from its endstop: 0 to x_mm for an endstop at the -X end, -x_mm to
+        0 for one at the +X end, and the same for Y.
+        """
+        self.travel_mm = (x_mm, y_mm)
+        self._limits_for = None
+
+    def limits(self):
+        """The envelope in mm, as (x_min, x_max, y_min, y_max)."""
+        x_mm, y_mm = self.travel_mm
+        x = (-x_mm, 0) if self.home_x > 0 else (0, x_mm)
+        y = (-y_mm, 0) if self.home_y > 0 else (0, y_mm)
+        return x + y
+
+    def check_limits(self, x, y):
+        """Raise SoftLimitError if x, y (in steps) is outside the envelope."""
+        spm = self.steps_per_mm
+        if self._limits_for != spm:
+            # cache the envelope in steps, steps_per_mm is often set
+            # after the interpreter is created
+            x_min, x_max, y_min, y_max = self.limits()
+            self._x_min = int(x_min * spm)
+            self._x_max = int(x_max * spm)
+            self._y_min = int(y_min * spm)
+            self._y_max = int(y_max * spm)
+            self._limits_for = spm
+        if x < self._x_min or x > self._x_max:
+            low, high = self.limits()[:2]
+            raise SoftLimitError("X{:.3f} outside {} to {}mm".format(x / spm, low, high))
+        if y < self._y_min or y > self._y_max:
+            low, high = self.limits()[2:]
+            raise SoftLimitError("Y{:.3f} outside {} to {}mm".format(y / spm, low, high))
+
+    def copy(self):
+        """A quiet interpreter with this one's state and no motors, for dry runs."""
+        shadow = GCodeInterpreter(None, None, None)
+        shadow.position = self.position.copy()
+        shadow.steps_per_mm = self.steps_per_mm
+        shadow.relative_mode = self.relative_mode
+        shadow.soft_limits = self.soft_limits
+        shadow.home_x = self.home_x
+        shadow.home_y = self.home_y
+        shadow.set_travel(*self.travel_mm)
+        shadow.verbose = False
+        return shadow
         
     def set_position(self, **kwargs): # x=1,y=2, z =3
         for axis in ('X', 'Y', 'Z'):
             if axis in kwargs:
                 self.position[axis] = kwargs[axis]
 
+    def home(self):
+        """Run X and Y to their endstops, one coil cycle at a time, and make that the origin."""
+        self.drain()
+        motor_x = self.motor_x
+        motor_y = self.motor_y
+        out = self._out() if self.verbose else None
+        while not motor_x.is_endstop_triggered():
+            motor_x.move(1, direction=self.home_x)  # move slowly towards the stop
+            if out:
+                out.write(b"[MSG: Moving X]\r\n")
+        while not motor_y.is_endstop_triggered():
+            motor_y.move(1, direction=self.home_y)
+            if out:
+                out.write(b"[MSG: Moving Y]\r\n")
+        motor_x.stop()
+        motor_y.stop()
+        self.set_position(X=0, Y=0)
+
     def jog(self, dx=0, dy=0, dz=0):
+        self.drain()
         if dx:
             self.motor_x.move(abs(dx), direction=1 if dx > 0 else -1)
         if dy:
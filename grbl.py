@@ -1,48 +1,35 @@
 # GRBL controller for a simple plotter machine using MicroPython
+# Step/direction drivers on GP2-GP7, G-code over a hardware UART instead
+# of the USB console. The command loop, parsing and replies are the same
+# as test_usb.py's (controller.GrblController); only the stream and the
+# motors differ.
+#
+# UART0 on GP16 (TX) and GP17 (RX). For hardware flow control wire the
+# host's RTS to GP18 (CTS) and its CTS to GP19 (RTS) and keep FLOW as
+# "rtscts"; "xonxoff" needs only TX and RX. On the host:
+#
+#   python host/sender.py /dev/ttyUSB0 drawing.gcode --flow rtscts
 
-from machine import Pin, UART
-import time
+from stepper import StepDirMotor
+from gcode_interpreter import GCodeInterpreter
+from controller import GrblController, UartStream
 
-# Configure UART for receiving G-code
-uart = UART(1, baudrate=115200, tx=17, rx=16)
+BAUD_RATE = 115200
+FLOW = "rtscts"  # "rtscts", "xonxoff" or None
+RX_BUFFER = 2048  # bytes buffered by the UART interrupt
 
-# Define stepper motor pins
-X_STEP = Pin(2, Pin.OUT)
-X_DIR = Pin(3, Pin.OUT)
+if FLOW == "rtscts":
+    uart = UartStream(0, BAUD_RATE, tx=16, rx=17, cts=18, rts=19, rxbuf=RX_BUFFER)
+else:
+    uart = UartStream(0, BAUD_RATE, tx=16, rx=17, rxbuf=RX_BUFFER, xonxoff=FLOW == "xonxoff")
 
-Y_STEP = Pin(4, Pin.OUT)
-Y_DIR = Pin(5, Pin.OUT)
+# Define stepper motor pins: step, direction
+motor_x = StepDirMotor(2, 3)
+motor_y = StepDirMotor(4, 5)
+motor_z = StepDirMotor(6, 7)
 
-Z_STEP = Pin(6, Pin.OUT)
-Z_DIR = Pin(7, Pin.OUT)
+gcode = GCodeInterpreter(motor_x, motor_y, motor_z)
+gcode.steps_per_mm = 10  # one pulse per step, 10 to the mm
 
-def step(pin, steps, direction):
-    pin_dir, pin_step = direction
-    pin_dir.value(steps >= 0)
-    for _ in range(abs(steps)):
-        pin_step.value(1)
-        time.sleep_us(500)
-        pin_step.value(0)
-        time.sleep_us(500)
-
-while True:
-    if uart.any():
-        line = uart.readline().decode().strip()
-        print("Received:", line)
-        
-        # Parse very basic G1 movement
-        if line.startswith('G1'):
-            x = y = z = 0
-            parts = line.split()
-            for p in parts:
-                if p.startswith('X'):
-                    x = float(p[1:])
-                elif p.startswith('Y'):
-                    y = float(p[1:])
-                elif p.startswith('Z'):
-                    z = float(p[1:])
-            
-            # Basic fixed scaling to steps
-            step(x * 10, (X_DIR, X_STEP))
-            step(y * 10, (Y_DIR, Y_STEP))
-            step(z * 10, (Z_DIR, Z_STEP))
+controller = GrblController(gcode, uart)
+controller.run()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Binary motion protocol client for the MicroPlotter
+# Encodes a G-code file as the fixed size step records binary_protocol.py
+# executes, switches the firmware over with '$B' and streams them with a
+# sliding window, resending from the last acknowledged record after a NAK
+# or a timeout. The record layout must match binary_protocol.py.
+#
+#   python host/binary.py /dev/ttyACM0 drawing.gcode
+#   python host/binary.py /dev/ttyACM0 drawing.gcode --ascii   # same file as G-code, to compare
+#   python host/binary.py --dry drawing.gcode                   # sizes only, no plotter
+#
+# Requires numpy.
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import gcode
+import plotter
+import sender
+
+SYNC = 0xA5
+ACK = 0xA6
+NAK = 0xA7
+RECORD_SIZE = 12
+WINDOW = 8
+
+PEN_UP = 1
+PEN_DOWN = 2
+TRAVEL = 0x04
+END = 0x80
+
+OK, BAD_CRC, BAD_SEQUENCE, SOFT_LIMIT = 0, 1, 2, 3
+
+# a single record can be a long move, so only resend after a real stall
+REPLY_TIMEOUT_S = 30.0
+
+
+def _crc_table():
+    table = np.zeros(256, np.int32)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table[i] = crc & 0xFFFF
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(rows):
+    """CRC-16/CCITT-FALSE of every row of a 2D uint8 array."""
+    crc = np.full(len(rows), 0xFFFF, np.int32)
+    for column in range(rows.shape[1]):
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[((crc >> 8) ^ rows[:, column]) & 0xFF]
+    return crc
+
+
+def pack(dx, dy, flags, delay_us, first_seq=0):
+    """Build records from arrays of fields, numbering them from first_seq."""
+    count = len(dx)
+    records = np.zeros((count, RECORD_SIZE), np.uint8)
+    records[:, 0] = SYNC
+    records[:, 1] = (np.arange(count) + first_seq) & 0xFF
+    records[:, 2] = flags
+    records[:, 4:6] = np.asarray(dx, '<i2').reshape(-1, 1).view(np.uint8)
+    records[:, 6:8] = np.asarray(dy, '<i2').reshape(-1, 1).view(np.uint8)
+    records[:, 8:10] = np.asarray(delay_us, '<u2').reshape(-1, 1).view(np.uint8)
+    crc = crc16(records[:, :10])
+    records[:, 10] = crc & 0xFF
+    records[:, 11] = crc >> 8
+    return records
+
+
+def encode(program, delay_us=0):
+    """Encode a gcode.Program as records, ending with an end record.
+
+    Returns (records, lines): lines holds the G-code line number of each
+    record. Pen moves become pen up (Z1) or pen down (Z0) flags, so Z
+    values other than 0 and 1 are not reproduced. delay_us, if given, is
+    set by the first record.
+    """
+    if np.any(program.kind == gcode.SET_POSITION):
+        line = program.line[np.argmax(program.kind == gcode.SET_POSITION)]
+        raise ValueError("line {}: G92 and $H cannot be sent as binary records".format(line))
+    moves = (program.dx != 0) | (program.dy != 0) | (program.dz != 0)
+    dx = program.dx[moves].astype(np.int64)
+    dy = program.dy[moves].astype(np.int64)
+    too_long = (np.abs(dx) > 32767) | (np.abs(dy) > 32767)
+    if np.any(too_long):
+        raise ValueError("line {}: move too long for one record".format(program.line[moves][np.argmax(too_long)]))
+
+    dz = program.dz[moves]
+    flags = np.where(dz == 1, PEN_UP, np.where(dz != 0, PEN_DOWN, 0))
+    flags |= np.where(program.kind[moves] == gcode.TRAVEL, TRAVEL, 0)
+    delays = np.zeros(len(dx), np.int64)
+    if len(delays):
+        delays[0] = delay_us
+
+    dx = np.append(dx, 0)
+    dy = np.append(dy, 0)
+    flags = np.append(flags, END)
+    delays = np.append(delays, 0)
+    lines = np.append(program.line[moves], program.lines)
+    return pack(dx, dy, flags, delays), lines
+
+
+class BinarySender:
+    """Streams records through an open sender.Sender after its handshake."""
+
+    def __init__(self, link, timeout=REPLY_TIMEOUT_S):
+        self.link = link
+        self.timeout = timeout
+        self.resent = 0  # records sent more than once
+        self.naks = 0
+
+    def negotiate(self):
+        options = self.link.options or []
+        if 'BIN' not in options:
+            raise sender.SenderError("the firmware does not offer binary mode")
+        self.link.command('$B')
+
+    def _end(self, seq):
+        """Leave binary mode early with an end record numbered seq."""
+        end = pack([0], [0], [END], [0], seq)
+        self.link.port.write(end.tobytes())
+        self._replies(self.timeout)
+
+    def _replies(self, timeout):
+        """Return (code, last seq, status) for each reply that has arrived."""
+        data = self._buffer + self.link.read_raw(timeout)
+        replies = []
+        i = 0
+        while i + 3 <= len(data):
+            if data[i] in (ACK, NAK):
+                replies.append((data[i], data[i + 1], data[i + 2]))
+                i += 3
+            else:
+                i += 1  # stray text from before the switch
+        self._buffer = data[i:]
+        return replies
+
+    def stream(self, records, lines=None, progress=None):
+        """Send every record and wait for the end record's acknowledgement.
+
+        Returns sender.Stats counting records as lines. CRC and sequence
+        NAKs are recovered from by resending; a soft limit NAK ends the
+        stream and raises SenderError.
+        """
+        stats = sender.Stats()
+        self._buffer = b''
+        count = len(records)
+        sent_at = np.zeros(count)
+        base = 0   # first record not acknowledged
+        ahead = 0  # next record to send
+        last_progress = stats.started
+        while base < count:
+            while ahead < count and ahead - base < WINDOW:
+                sent_at[ahead] = time.perf_counter()
+                self.link.port.write(records[ahead].tobytes())
+                ahead += 1
+
+            replies = self._replies(self.timeout)
+            if not replies:
+                # lost record or reply, go back to the first unacknowledged one
+                self.resent += ahead - base
+                ahead = base
+                continue
+
+            now = time.perf_counter()
+            for code, last, status in replies:
+                # the reply names the last record executed; find it in the window
+                through = base - 1 + ((last - (base - 1)) & 0xFF)
+                if through < ahead:
+                    stats.latencies.extend((now - sent_at[base:through + 1]).tolist())
+                    base = through + 1
+                if code == NAK:
+                    self.naks += 1
+                    if status == SOFT_LIMIT:
+                        number = int(lines[base]) if lines is not None else base
+                        self._end(base)
+                        raise sender.SenderError("line {}: soft limit".format(number))
+                    self.resent += ahead - base
+                    ahead = base
+
+            stats.lines = base
+            stats.bytes = base * RECORD_SIZE
+            if progress and now - last_progress >= 1.0:
+                progress(stats)
+                last_progress = now
+
+        stats.finished = time.perf_counter()
+        return stats
+
+
+def ascii_bytes(path):
+    """Bytes the ASCII sender would put on the wire for a file."""
+    with open(path) as f:
+        return sum(len(line) + 1 for line in map(sender.clean_line, f) if line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream G-code to the MicroPlotter as binary step records")
+    parser.add_argument('port', nargs='?', help="serial port or pty, not needed with --dry")
+    parser.add_argument('gcode')
+    parser.add_argument('--baud', type=int, default=sender.BAUD_RATE)
+    parser.add_argument('--steps-per-mm', type=float, default=plotter.STEPS_PER_MM)
+    parser.add_argument('--delay-us', type=int, default=0, help="phase delay to set, 0 to keep the firmware's")
+    parser.add_argument('--ascii', action='store_true', help="stream the file as G-code instead, to compare")
+    parser.add_argument('--dry', action='store_true', help="only encode and compare sizes")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    program = gcode.load(args.gcode, args.steps_per_mm)
+    records, lines = encode(program, args.delay_us)
+    encoded = time.perf_counter() - started
+    text = ascii_bytes(args.gcode)
+    print("{} lines, {} bytes as G-code; {} records, {} bytes binary ({:.0f}%), encoded in {:.2f}s".format(
+        program.sent_lines, text, len(records), records.nbytes, records.nbytes * 100 / max(text, 1), encoded),
+        file=sys.stderr)
+    if args.dry:
+        return 0
+    if not args.port:
+        parser.error("a port is needed unless --dry is given")
+
+    port = sender.open_port(args.port, args.baud)
+    try:
+        link = sender.Sender(port)
+        link.handshake()
+        if args.ascii:
+            with open(args.gcode) as f:
+                stats = link.stream(f)
+        else:
+            binary = BinarySender(link)
+            binary.negotiate()
+            stats = binary.stream(records, lines)
+            if binary.naks or binary.resent:
+                print("{} NAKs, {} records resent".format(binary.naks, binary.resent), file=sys.stderr)
+    except sender.SenderError as e:
+        print("error:", e, file=sys.stderr)
+        return 1
+    finally:
+        port.close()
+
+    for number, what, reply in stats.errors:
+        print("line {}: {} -> {}".format(number, what, reply), file=sys.stderr)
+    for key, value in stats.summary().items():
+        print("{}: {}".format(key, value))
+    return 1 if stats.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Measure how long the firmware takes to boot, from a reset to its first 'ok'
+# Resets the Pico over its serial port, then sends '$I' every few
+# milliseconds until one is answered. Two times are reported for each
+# run: when "[MSG:Ready]" arrived (the controller loop started) and when
+# the first 'ok' did. Probing stops once the firmware says it is ready,
+# so older firmware without the message is measured too.
+#
+#   python host/boottime.py /dev/ttyACM0               # soft resets (Ctrl-C, Ctrl-D)
+#   python host/boottime.py /dev/ttyACM0 --hard        # machine.reset(), USB re-enumerates
+#   python host/boottime.py /tmp/plotter --launch "python host/sim.py --link /tmp/plotter"
+#
+# A soft reset keeps the port open and times MicroPython's own start:
+# importing and compiling the modules and setting up the motors, which is
+# what host/build.py shortens. A hard reset adds the USB enumeration and
+# the host reopening the port. --launch restarts a command, such as the
+# simulator, instead of resetting a Pico. Opening a port discards what
+# is waiting in it, so "[MSG:Ready]" can be missed when the port is
+# opened after the reset; the first 'ok' is measured either way.
+
+import argparse
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+
+import sender
+
+PROBE = b'$I\n'
+
+
+class Run:
+    def __init__(self):
+        self.ready_s = None
+        self.ok_s = None
+
+
+def wait_for_port(path, baud, timeout):
+    """Open path as soon as it appears, returning the port."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            if os.path.exists(path):
+                return sender.open_port(path, baud)
+        except OSError:
+            pass  # there, but not ready yet
+        if time.perf_counter() > deadline:
+            raise sender.SenderError("{} did not come back".format(path))
+        time.sleep(0.01)
+
+
+def measure(link, started, interval, timeout):
+    """Probe until the first 'ok'; returns a Run with times from started."""
+    run = Run()
+    probing = True
+    next_probe = time.perf_counter()
+    while run.ok_s is None:
+        now = time.perf_counter()
+        if now - started > timeout:
+            raise sender.SenderError("no 'ok' within {}s of the reset".format(timeout))
+        if probing and now >= next_probe:
+            link.port.write(PROBE)
+            next_probe = now + interval
+        line = link.read_line(min(interval, 0.01))
+        if line is None:
+            continue
+        if line == '[MSG:Ready]' and run.ready_s is None:
+            run.ready_s = time.perf_counter() - started
+            if probing:
+                probing = False
+                link.port.write(PROBE)
+        elif line == 'ok':
+            run.ok_s = time.perf_counter() - started
+    # let the answers to any other probes arrive, so they are not taken
+    # for the next run's
+    while link.read_line(0.2) is not None:
+        pass
+    return run
+
+
+def soft_reset(port):
+    """Stop the main loop with Ctrl-C and soft reboot from the REPL; returns the time."""
+    port.write(b'\x03\x03')
+    time.sleep(0.2)
+    started = time.perf_counter()
+    port.write(b'\x04')
+    return started
+
+
+def hard_reset(port):
+    """Reset the Pico from the REPL; the port goes away. Returns the time."""
+    port.write(b'\x03\x03')
+    time.sleep(0.2)
+    started = time.perf_counter()
+    port.write(b'import machine; machine.reset()\r')
+    time.sleep(0.05)
+    port.close()
+    return started
+
+
+def summary(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {'min_ms': round(values[0] * 1000, 1),
+            'p50_ms': round(sender.percentile(values, 50) * 1000, 1),
+            'max_ms': round(values[-1] * 1000, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the firmware's time from reset to first 'ok'")
+    parser.add_argument('port', help="serial port, e.g. /dev/ttyACM0")
+    parser.add_argument('--baud', type=int, default=sender.BAUD_RATE)
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--hard', action='store_true', help="hard reset, including USB enumeration")
+    parser.add_argument('--launch', metavar='COMMAND', help="restart this command instead of resetting a Pico")
+    parser.add_argument('--interval', type=float, default=0.05, help="seconds between probes")
+    parser.add_argument('--timeout', type=float, default=20.0, help="seconds to wait for each boot")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    runs = []
+    process = None
+    port = None
+    try:
+        for number in range(args.runs):
+            if args.launch:
+                if process:
+                    process.send_signal(signal.SIGINT)  # lets it clean up, like Ctrl-C
+                    process.wait()
+                    port.close()
+                    while os.path.exists(args.port):
+                        time.sleep(0.01)
+                started = time.perf_counter()
+                process = subprocess.Popen(shlex.split(args.launch))
+                port = wait_for_port(args.port, args.baud, args.timeout)
+            else:
+                if port is None:
+                    port = sender.open_port(args.port, args.baud)
+                if args.hard:
+                    started = hard_reset(port)
+                    port = wait_for_port(args.port, args.baud, args.timeout)
+                else:
+                    started = soft_reset(port)
+            run = measure(sender.Sender(port), started, args.interval, args.timeout)
+            runs.append(run)
+            if not args.json:
+                ready = "-" if run.ready_s is None else "{:.0f} ms".format(run.ready_s * 1000)
+                print("run {}: ready {}, first ok {:.0f} ms".format(number + 1, ready, run.ok_s * 1000))
+    except sender.SenderError as e:
+        print("error:", e, file=sys.stderr)
+        return 1
+    finally:
+        if process:
+            process.send_signal(signal.SIGINT)
+            process.wait()
+        if port:
+            port.close()
+
+    result = {'runs': len(runs),
+              'reset': 'launch' if args.launch else 'hard' if args.hard else 'soft',
+              'ready': summary(r.ready_s for r in runs),
+              'first_ok': summary(r.ok_s for r in runs)}
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        for key in ('ready', 'first_ok'):
+            if result[key]:
+                print("{:<9} min {min_ms} ms, p50 {p50_ms} ms, max {max_ms} ms".format(key, **result[key]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Precompile the firmware to .mpy for a faster boot
+# Starting from an entry script (test_usb.py by default), finds the local
+# modules it imports, directly or through other modules, including
+# imports made inside functions, and compiles each with mpy-cross into a
+# build directory. The entry script is copied as main.py, which the Pico
+# runs at boot and which has to stay source. Importing a .mpy skips
+# compiling on the Pico, the largest part of the controller's boot.
+#
+#   python host/build.py                          # build/ from test_usb.py
+#   python host/build.py test_wifi2.py -o build-web
+#   python host/build.py --deploy /dev/ttyACM0    # and copy it with mpremote
+#
+# The .mpy format follows the MicroPython version: use an mpy-cross from
+# the same release as the firmware on the Pico (pip install mpy-cross==X).
+# A .py left on the Pico is imported in preference to the .mpy, so
+# --deploy removes the sources it replaces.
+
+import argparse
+import ast
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def local_imports(path):
+    """Names of the modules a source file imports, anywhere in it."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    return names
+
+
+def modules(entry, root=ROOT):
+    """Paths, relative to root, of the local modules entry needs.
+
+    A package is taken whole, every .py file in it.
+    """
+    found = []
+    queue = [entry]
+    seen = set()
+    while queue:
+        for name in sorted(local_imports(queue.pop(0))):
+            if name in seen:
+                continue
+            seen.add(name)
+            if os.path.isfile(os.path.join(root, name + '.py')):
+                found.append(name + '.py')
+                queue.append(os.path.join(root, name + '.py'))
+            elif os.path.isfile(os.path.join(root, name, '__init__.py')):
+                for filename in sorted(os.listdir(os.path.join(root, name))):
+                    if filename.endswith('.py'):
+                        found.append(name + '/' + filename)
+                        queue.append(os.path.join(root, name, filename))
+            # anything else is built into the firmware (machine, time, ...)
+    return found
+
+
+def mpy_cross():
+    """The mpy-cross command: the executable, or the pip package's."""
+    path = shutil.which('mpy-cross')
+    if path:
+        return [path]
+    try:
+        import mpy_cross
+    except ImportError:
+        sys.exit("mpy-cross not found: pip install mpy-cross")
+    return [mpy_cross.mpy_cross]
+
+
+def build(entry, out, march='armv6m', root=ROOT):
+    """Compile entry's modules into out; returns [(source, output)] paths."""
+    command = mpy_cross()
+    if os.path.isdir(out):
+        shutil.rmtree(out)
+    os.makedirs(out)
+    built = [(entry, os.path.join(out, 'main.py'))]
+    shutil.copyfile(entry, built[0][1])
+    for module in modules(entry, root):
+        source = os.path.join(root, module)
+        target = os.path.join(out, module[:-3] + '.mpy')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        args = command + ['-o', target, '-s', module]
+        if march:
+            args.append('-march=' + march)
+        result = subprocess.run(args + [source], capture_output=True, text=True)
+        if result.returncode:
+            sys.exit("{}: {}".format(module, result.stderr.strip()))
+        built.append((source, target))
+    return built
+
+
+def deploy(port, out, built):
+    """Copy a build to the Pico with mpremote, replacing sources, then reset it."""
+    mpremote = shutil.which('mpremote')
+    if not mpremote:
+        sys.exit("mpremote not found: pip install mpremote")
+    targets = [os.path.relpath(target, out).replace(os.sep, '/') for _, target in built]
+    directories = sorted(set(os.path.dirname(t) for t in targets if os.path.dirname(t)))
+    stale = [t[:-4] + '.py' for t in targets if t.endswith('.mpy')]
+    prepare = ("import os\n"
+               "for d in {!r}:\n"
+               "    try: os.mkdir(d)\n"
+               "    except OSError: pass\n"
+               "for f in {!r}:\n"
+               "    try: os.remove(f)\n"
+               "    except OSError: pass\n").format(directories, stale)
+    args = [mpremote, 'connect', port, 'exec', prepare]
+    for (_, target), name in zip(built, targets):
+        args += ['+', 'fs', 'cp', target, ':' + name]
+    args += ['+', 'reset']
+    subprocess.run(args, check=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompile the firmware to .mpy")
+    parser.add_argument('entry', nargs='?', default=os.path.join(ROOT, 'test_usb.py'),
+                        help="script to run at boot, copied as main.py (default test_usb.py)")
+    parser.add_argument('-o', '--out', default=os.path.join(ROOT, 'build'), help="build directory")
+    parser.add_argument('--march', default='armv6m',
+                        help="mpy-cross architecture, '' for bytecode only (default armv6m, the RP2040)")
+    parser.add_argument('--deploy', metavar='PORT', help="copy the build to the Pico on this port")
+    args = parser.parse_args(argv)
+
+    built = build(args.entry, args.out, args.march)
+    source_total = built_total = 0
+    for source, target in built:
+        size = os.path.getsize(source)
+        built_size = os.path.getsize(target)
+        source_total += size
+        built_total += built_size
+        print("{:<28} {:>7} -> {:>7}".format(os.path.relpath(target, args.out), size, built_size))
+    print("{:<28} {:>7} -> {:>7}".format('total', source_total, built_total))
+    if args.deploy:
+        deploy(args.deploy, args.out, built)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Job time estimator for the MicroPlotter
+# Works out how long a G-code file will take from the firmware's motion
+# model rather than by timing a run:
+#
+# - every step is a coil cycle of 4 (full) or 8 (half) phases, each
+#   held for delay_us; G0 moves use the travel mode and G1 moves the
+#   draw mode (GCodeInterpreter.travel_mode / draw_mode)
+# - X, then Y, then Z move one after the other, never together
+# - a pen move is a fixed 50 cycles of the Z motor, in its own mode
+#
+# The whole file is evaluated with NumPy array arithmetic. Moves are
+# timed by a move_time function so that an acceleration profile can
+# replace the constant rate model without touching anything else.
+#
+#   python host/estimate.py drawing.gcode
+#
+# Requires numpy.
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import gcode
+import plotter
+
+
+def constant_rate(cycles, phases, delay_us):
+    """Time in microseconds for moves of cycles coil cycles, as arrays.
+
+    This is what StepperMotor.move does today: every phase is held for
+    the same delay. A model with acceleration takes the same arguments.
+    """
+    return cycles * phases * delay_us
+
+
+class RampedRate:
+    """Example acceleration model: a linear ramp in phase delay.
+
+    The first and last ramp_cycles of every move run from start_delay_us
+    down to (and back up from) the cruise delay. Moves too short to reach
+    the cruise delay spend half their cycles ramping each way.
+    """
+
+    def __init__(self, start_delay_us, ramp_cycles):
+        self.start_delay_us = start_delay_us
+        self.ramp_cycles = ramp_cycles
+
+    def __call__(self, cycles, phases, delay_us):
+        cycles = np.asarray(cycles, dtype=np.float64)
+        ramp = np.minimum(cycles / 2, self.ramp_cycles)
+        # delay falls linearly across the ramp, so each ramp cycle takes
+        # the mean of the delays it passes through
+        slope = (self.start_delay_us - delay_us) / max(self.ramp_cycles, 1)
+        ramp_delay = self.start_delay_us - slope * ramp / 2
+        return (2 * ramp * ramp_delay + (cycles - 2 * ramp) * delay_us) * phases
+
+
+class Estimate:
+    """Breakdown of a job's time in seconds."""
+
+    def __init__(self, drawing_s, travel_s, pen_s, overhead_s, drawing_mm, travel_mm, pen_moves, lines):
+        self.drawing_s = drawing_s
+        self.travel_s = travel_s
+        self.pen_s = pen_s
+        self.overhead_s = overhead_s  # per line costs: serial round trip, parsing
+        self.drawing_mm = drawing_mm
+        self.travel_mm = travel_mm
+        self.pen_moves = pen_moves
+        self.lines = lines
+
+    @property
+    def total_s(self):
+        return self.drawing_s + self.travel_s + self.pen_s + self.overhead_s
+
+    def as_dict(self):
+        return {
+            'total_s': round(self.total_s, 1),
+            'drawing_s': round(self.drawing_s, 1),
+            'travel_s': round(self.travel_s, 1),
+            'pen_s': round(self.pen_s, 1),
+            'overhead_s': round(self.overhead_s, 1),
+            'drawing_mm': round(self.drawing_mm, 1),
+            'travel_mm': round(self.travel_mm, 1),
+            'pen_moves': self.pen_moves,
+            'lines': self.lines,
+        }
+
+
+def estimate(program, steps_per_mm=plotter.STEPS_PER_MM, delay_us=plotter.DELAY_US,
+             travel_mode=plotter.TRAVEL_MODE, draw_mode=plotter.DRAW_MODE,
+             pen_mode='full', pen_steps=plotter.PEN_STEPS, move_time=constant_rate,
+             overhead_pct=0.0, line_overhead_ms=0.0):
+    """Estimate the run time of a gcode.Program.
+
+    X/Y moves made with the pen down count as drawing, moves with the pen
+    up as travel. overhead_pct stretches every phase by the overhead a
+    StepProfiler measured ('$P'); line_overhead_ms is added per line sent.
+    """
+    phases = np.where(program.kind == gcode.TRAVEL, plotter.PHASES[travel_mode], plotter.PHASES[draw_mode])
+    delay = delay_us * (1 + overhead_pct / 100)
+
+    xy_us = move_time(np.abs(program.dx), phases, delay) + move_time(np.abs(program.dy), phases, delay)
+    xy_mm = (np.abs(program.dx) + np.abs(program.dy)) / steps_per_mm
+    up = program.pen_up
+    pen_moves = int(np.count_nonzero(program.dz))
+    pen_us = pen_moves * float(move_time(pen_steps, plotter.PHASES[pen_mode], delay))
+
+    return Estimate(
+        drawing_s=float(xy_us[~up].sum()) / 1e6,
+        travel_s=float(xy_us[up].sum()) / 1e6,
+        pen_s=pen_us / 1e6,
+        overhead_s=program.sent_lines * line_overhead_ms / 1e3,
+        drawing_mm=float(xy_mm[~up].sum()),
+        travel_mm=float(xy_mm[up].sum()),
+        pen_moves=pen_moves,
+        lines=program.sent_lines,
+    )
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds) if hours else "{}:{:02d}".format(minutes, seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate how long a G-code job will take on the MicroPlotter")
+    parser.add_argument('gcode', nargs='+')
+    parser.add_argument('--steps-per-mm', type=float, default=plotter.STEPS_PER_MM)
+    parser.add_argument('--delay-us', type=float, default=plotter.DELAY_US, help="delay per coil phase")
+    parser.add_argument('--travel-mode', choices=('full', 'half'), default=plotter.TRAVEL_MODE)
+    parser.add_argument('--draw-mode', choices=('full', 'half'), default=plotter.DRAW_MODE)
+    parser.add_argument('--overhead-pct', type=float, default=0.0,
+                        help="phase timing overhead, as reported by the '$P' profiler")
+    parser.add_argument('--line-ms', type=float, default=0.0, help="fixed cost per line sent")
+    parser.add_argument('--ramp', type=float, nargs=2, metavar=('START_DELAY_US', 'CYCLES'),
+                        help="model a linear acceleration ramp")
+    args = parser.parse_args(argv)
+
+    move_time = RampedRate(*args.ramp) if args.ramp else constant_rate
+    for path in args.gcode:
+        started = time.perf_counter()
+        program = gcode.load(path, args.steps_per_mm)
+        result = estimate(program, args.steps_per_mm, args.delay_us, args.travel_mode, args.draw_mode,
+                          move_time=move_time, overhead_pct=args.overhead_pct, line_overhead_ms=args.line_ms)
+        print("{}: {} ({} drawing, {} travel, {} pen, {} line overhead)".format(
+            path, format_duration(result.total_s), format_duration(result.drawing_s),
+            format_duration(result.travel_s), format_duration(result.pen_s), format_duration(result.overhead_s)))
+        print("  {} lines, {:.0f} mm drawn, {:.0f} mm travelled, {} pen moves".format(
+            result.lines, result.drawing_mm, result.travel_mm, result.pen_moves))
+        print("  estimated in {:.2f}s".format(time.perf_counter() - started), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+# Region fills for the MicroPlotter
+# Runs on the host, not the Pico. Takes closed outlines, with holes, from
+# an SVG (every subpath, as SVG fills them) or from G-code (pen down runs
+# that end where they started) and fills them with pen strokes:
+#
+#   hatch       parallel lines --spacing apart at --angle
+#   crosshatch  hatch, then hatch again at right angles
+#   concentric  the outline offset inwards again and again
+#
+# The outlines of one SVG element combine by the fill rule (--rule,
+# nonzero by default as in SVG, or evenodd) and separate elements are
+# filled as their union. G-code has no elements: contours combine by
+# even-odd, so one inside another is a hole.
+#
+# Every polygon is handled at once with NumPy: hatching finds where all
+# edges cross all scanlines and pairs up the crossings, concentric rings
+# offset every vertex together and keep the points far enough inside.
+# Strokes stay half the pen width (--pen) inside the outline and the
+# spacing is a whole number of motor steps, so horizontal and vertical
+# hatch lines sit on the step grid. Hatching is horizontal unless told
+# otherwise: the firmware moves X and then Y, so a sloping line is drawn
+# as a staircase. Hatch lines are split into cells,
+# runs of lines that each overlap one line above and below, and each
+# cell is drawn boustrophedon, back and forth without lifting the pen
+# where the turn is short. Cells and rings are then ordered to keep
+# pen-up travel short, and written as G-code inside the firmware's soft
+# limits as svg2gcode.py does.
+#
+#   python host/fill.py drawing.svg -o fill.gcode --fill crosshatch
+#   python host/fill.py outlines.gcode -o fill.gcode --fill concentric --outline
+#
+# Requires numpy.
+
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+import gcode
+import plotter
+import svg2gcode
+
+FILLS = ('hatch', 'crosshatch', 'concentric')
+RULES = ('nonzero', 'evenodd')
+MAX_PAIRS = 1 << 22  # point and edge pairs tested at once by Outlines.sides
+ORDER_LIMIT = 5000   # stroke groups ordered greedily, beyond this in bands
+BAND_MM = 5.0        # height of those bands
+
+
+def _runs(starts):
+    """First index and length of each run marked by starts."""
+    first = np.flatnonzero(starts)
+    return first, np.diff(np.append(first, len(starts)))
+
+
+def _expand(counts):
+    """For counts (c0, c1, ...): the owner of each of their sum items, and its place in its run."""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    place = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, place
+
+
+def _components(low, high):
+    """Label boxes, given by their low and high corners, joined by overlaps."""
+    n = len(low)
+    by_x = np.argsort(low[:, 0], kind='stable')
+    x_low = low[by_x, 0]
+    # every box starting before this one ends, from the next one on
+    stop = np.searchsorted(x_low, high[by_x, 0], 'right')
+    counts = np.maximum(stop - np.arange(1, n + 1), 0)
+    owner, place = _expand(counts)
+    a = by_x[owner]
+    b = by_x[owner + 1 + place]
+    overlap = (low[b, 1] <= high[a, 1]) & (low[a, 1] <= high[b, 1])
+    a, b = a[overlap], b[overlap]
+    label = np.arange(n)
+    while True:
+        lowest = np.minimum(label[a], label[b])
+        new = label.copy()
+        np.minimum.at(new, a, lowest)
+        np.minimum.at(new, b, lowest)
+        new = new[new]
+        if np.array_equal(new, label):
+            break
+        label = new
+    return np.unique(label, return_inverse=True)[1]
+
+
+class Outlines:
+    """Closed polygons to fill, in millimetres.
+
+    points and starts hold the rings the way svg2gcode.flatten() returns
+    polylines; each ring is closed back to its first point. elements
+    gives each ring's SVG element, rings of one element combining by the
+    rule; without it the rings that overlap combine.
+    """
+
+    def __init__(self, points, starts, elements=None, rule='nonzero'):
+        if rule not in RULES:
+            raise ValueError("rule is one of {}".format(", ".join(RULES)))
+        self.rule = rule
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        starts = np.asarray(starts, dtype=bool)
+        ring = np.cumsum(starts) - 1
+        if elements is None:
+            elements = np.zeros(int(starts.sum()), dtype=np.int64)
+        elements = np.asarray(elements, dtype=np.int64)
+
+        # drop repeated points, then a last point back on the first
+        keep = starts.copy()
+        keep[1:] |= np.any(points[1:] != points[:-1], axis=1)
+        points, starts, ring = points[keep], starts[keep], ring[keep]
+        first, count = _runs(starts)
+        last = first + count - 1
+        closing = np.all(points[last] == points[first], axis=1) & (count > 1)
+        keep = np.ones(len(points), dtype=bool)
+        keep[last[closing]] = False
+        points, starts, ring = points[keep], starts[keep], ring[keep]
+
+        # a ring needs three corners to hold anything
+        first, count = _runs(starts)
+        keep = np.repeat(count >= 3, count)
+        self.points, ring = points[keep], ring[keep]
+        self.first, self.count = _runs(starts[keep])
+        n = len(self.first)
+        self.rings = n
+
+        # rings whose boxes overlap may share holes, the rest are independent
+        if n:
+            low = np.stack((np.minimum.reduceat(self.points[:, 0], self.first),
+                            np.minimum.reduceat(self.points[:, 1], self.first)), axis=1)
+            high = np.stack((np.maximum.reduceat(self.points[:, 0], self.first),
+                             np.maximum.reduceat(self.points[:, 1], self.first)), axis=1)
+            self.ring_component = _components(low, high)
+        else:
+            low = high = np.zeros((0, 2))
+            self.ring_component = np.zeros(0, dtype=np.int64)
+        self.ring_low, self.ring_high = low, high
+        self.ring_element = elements[ring[self.first]] if n else np.zeros(0, dtype=np.int64)
+        components = int(self.ring_component.max()) + 1 if n else 0
+        self.component_low = np.full((components, 2), np.inf)
+        self.component_high = np.full((components, 2), -np.inf)
+        np.minimum.at(self.component_low, self.ring_component, low)
+        np.maximum.at(self.component_high, self.ring_component, high)
+
+        # an edge from every corner to the next, grouped by component, then element
+        ring_of = np.repeat(np.arange(n), self.count)
+        following = np.arange(len(self.points)) + 1
+        following[self.first + self.count - 1] = self.first
+        self.following = following
+        self.ring_of = ring_of
+        a, b = self.points, self.points[following]
+        # twice the area each ring encloses, positive anticlockwise
+        cross = a[:, 0] * b[:, 1] - b[:, 0] * a[:, 1]
+        self.ring_area2 = np.add.reduceat(cross, self.first) if n else np.zeros(0)
+        edge_component = self.ring_component[ring_of]
+        edge_element = self.ring_element[ring_of]
+        by = np.lexsort((edge_element, edge_component))
+        self.a = a[by]
+        self.b = b[by]
+        self.edge_component = edge_component[by]
+        self.edge_element = edge_element[by]
+        self.edge_ring = ring_of[by]
+        self.edge_order = by
+        # the edges of each element within a component, a run each
+        group = np.ones(len(by), dtype=bool)
+        group[1:] = (self.edge_component[1:] != self.edge_component[:-1]) | \
+            (self.edge_element[1:] != self.edge_element[:-1])
+        self.group_first, group_count = _runs(group)
+        self.group_stop = self.group_first + group_count
+        self.ring_group = np.zeros(n, dtype=np.int64)
+        self.ring_group[self.edge_ring] = np.cumsum(group) - 1
+
+    def _inside(self, winding, crossings):
+        if self.rule == 'nonzero':
+            return winding != 0
+        return crossings % 2 == 1
+
+    def spans(self, angle, spacing):
+        """The parts of scanlines inside the outlines.
+
+        Scanlines run at angle (radians) to the X axis, spacing apart,
+        with line k at distance k * spacing from the origin. Returns
+        (component, k, u0, u1): u along the line, in a frame rotated by
+        angle, sorted by component, line and u0.
+        """
+        c, s = math.cos(angle), math.sin(angle)
+        a, b = self.a, self.b
+        au = a[:, 0] * c + a[:, 1] * s
+        av = a[:, 1] * c - a[:, 0] * s
+        bu = b[:, 0] * c + b[:, 1] * s
+        bv = b[:, 1] * c - b[:, 0] * s
+        # lines with v in [min, max), so a line through a corner is crossed once
+        low = np.ceil(np.minimum(av, bv) / spacing)
+        high = np.ceil(np.maximum(av, bv) / spacing)
+        edge, place = _expand((high - low).astype(np.int64))
+        k = low[edge].astype(np.int64) + place
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (k * spacing - av[edge]) / (bv[edge] - av[edge])
+        u = au[edge] + t * (bu[edge] - au[edge])
+        weight = np.where(bv[edge] > av[edge], 1, -1)
+        component = self.edge_component[edge]
+        element = self.edge_element[edge]
+
+        # inside each element: the crossings on a line balance out, so
+        # the running totals start again from zero on every line
+        by = np.lexsort((u, element, k, component))
+        u, weight, k, component = u[by], weight[by], k[by], component[by]
+        inside = self._inside(np.cumsum(weight), np.arange(1, len(u) + 1))
+        before = np.concatenate(([False], inside[:-1]))
+        enter = inside & ~before
+        leave = ~inside & before
+
+        # then the union of the elements' spans
+        x = np.concatenate((u[enter], u[leave]))
+        delta = np.concatenate((np.ones(int(enter.sum()), np.int64), -np.ones(int(leave.sum()), np.int64)))
+        k = np.concatenate((k[enter], k[leave]))
+        component = np.concatenate((component[enter], component[leave]))
+        by = np.lexsort((-delta, x, k, component))
+        x, k, component = x[by], k[by], component[by]
+        cover = np.cumsum(delta[by])
+        before = np.concatenate(([0], cover[:-1]))
+        start = (cover > 0) & (before == 0)
+        stop = (cover == 0) & (before > 0)
+        return component[start], k[start], x[start], x[stop]
+
+    def _pairs(self):
+        """Every edge against every edge of its element, a chunk at a time.
+
+        Yields (chunk, end, owner, own, edge) for the edges chunk to end,
+        in the edges' sorted order: own is one edge of each pair, owner
+        its place in the chunk, and edge the other.
+        """
+        group = self.ring_group[self.edge_ring]
+        counts = self.group_stop[group] - self.group_first[group]
+        totals = np.cumsum(counts)
+        chunk = 0
+        while chunk < len(counts):
+            # as many edges as keep the pairs under MAX_PAIRS
+            done = totals[chunk - 1] if chunk else 0
+            end = max(int(np.searchsorted(totals, done + MAX_PAIRS, 'right')), chunk + 1)
+            owner, place = _expand(counts[chunk:end])
+            own = chunk + owner
+            yield chunk, end, owner, own, self.group_first[group[own]] + place
+            chunk = end
+
+    def split(self):
+        """These outlines with a corner wherever an edge crosses another of its element."""
+        ax, ay = self.a[:, 0], self.a[:, 1]
+        dx, dy = self.b[:, 0] - ax, self.b[:, 1] - ay
+        corners, where = [], []
+        for _, _, _, own, edge in self._pairs():
+            gx = ax[edge] - ax[own]
+            gy = ay[edge] - ay[own]
+            qx, qy = dx[edge], dy[edge]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                across = dx[own] * qy - dy[own] * qx
+                t = (gx * qy - gy * qx) / across
+            # strictly inside both, so edges meeting at a corner do not count
+            hit = np.flatnonzero((t > 1e-9) & (t < 1 - 1e-9))
+            own, t = own[hit], t[hit]
+            u = (gx[hit] * dy[own] - gy[hit] * dx[own]) / across[hit]
+            hit = (u > 1e-9) & (u < 1 - 1e-9)
+            # the new corner goes after the point the edge starts from
+            corners.append(self.edge_order[own[hit]])
+            where.append(t[hit])
+        corner = np.concatenate(corners) if corners else np.zeros(0, dtype=np.int64)
+        if not len(corner):
+            return self
+        t = np.concatenate(where)
+        extra = self.points[corner] + t[:, None] * (self.points[self.following[corner]] - self.points[corner])
+        n = len(self.points)
+        order = np.lexsort((np.append(np.zeros(n), t), np.append(np.arange(n), corner)))
+        points = np.concatenate((self.points, extra))[order]
+        starts = np.zeros(n + len(corner), dtype=bool)
+        starts[self.first] = True
+        starts = starts[order]
+        return Outlines(points, starts, self.ring_element, self.rule)
+
+    def sides(self):
+        """Which side of each edge the region is on: 1 left, -1 right, 0 neither.
+
+        Edges are in the order of points, from each point to the next.
+        The winding just left of an edge's middle is counted along a ray
+        out of its left side, over the other edges of its element; just
+        right of it the ray crosses the edge itself as well. An edge that
+        crosses another has different sides either side of the crossing:
+        split() them first.
+        """
+        n = len(self.a)
+        side = np.zeros(n, dtype=np.int64)
+        ax, ay = self.a[:, 0], self.a[:, 1]
+        bx, by = self.b[:, 0], self.b[:, 1]
+        middle = (self.a + self.b) / 2
+        d = self.b - self.a
+        for chunk, end, owner, own, edge in self._pairs():
+            mx, my = middle[own, 0], middle[own, 1]
+            dx, dy = d[own, 0], d[own, 1]
+            # v back along the edge: the ray is where v is zero
+            av = (mx - ax[edge]) * dx + (my - ay[edge]) * dy
+            bv = (mx - bx[edge]) * dx + (my - by[edge]) * dy
+            up = bv > 0
+            cross = np.flatnonzero(((av <= 0) == up) & (edge != own))
+            owner, edge, up = owner[cross], edge[cross], up[cross]
+            av, bv = av[cross], bv[cross]
+            mx, my, dx, dy = mx[cross], my[cross], dx[cross], dy[cross]
+            # u along the ray, where it crosses the other edge
+            au = (ay[edge] - my) * dx - (ax[edge] - mx) * dy
+            bu = (by[edge] - my) * dx - (bx[edge] - mx) * dy
+            ahead = au - av * (bu - au) / (bv - av) > 0
+            weight = np.where(up, 1, -1)[ahead]
+            owner = owner[ahead]
+            winding = np.bincount(owner, weights=weight, minlength=end - chunk).astype(np.int64)
+            crossings = np.bincount(owner, minlength=end - chunk)
+            left = self._inside(winding, crossings)
+            right = self._inside(winding - 1, crossings + 1)
+            side[chunk:end] = left.astype(np.int64) - right
+        in_order = np.empty_like(side)
+        in_order[self.edge_order] = side
+        return in_order
+
+    def clear(self, points, component, radius):
+        """Whether each point is at least radius from every edge of its component.
+
+        Edges are cut into pieces no longer than half a grid cell, a
+        little over radius across, and each piece binned by its middle,
+        so each point is only measured against the pieces in the cells
+        around it.
+        """
+        size = radius * 4 / 3
+        a, b = self.a, self.b
+        length = np.hypot(b[:, 0] - a[:, 0], b[:, 1] - a[:, 1])
+        pieces = np.ceil(length / (size / 2)).astype(np.int64)
+        edge, place = _expand(pieces)
+        t0 = place / pieces[edge]
+        t1 = (place + 1) / pieces[edge]
+        ax = a[edge, 0] + t0 * (b[edge, 0] - a[edge, 0])
+        ay = a[edge, 1] + t0 * (b[edge, 1] - a[edge, 1])
+        dx = (t1 - t0) * (b[edge, 0] - a[edge, 0])
+        dy = (t1 - t0) * (b[edge, 1] - a[edge, 1])
+        piece_component = self.edge_component[edge]
+        # a piece within radius of a point has its middle within a cell
+        cx = np.floor((ax + dx / 2) / size).astype(np.int64)
+        cy = np.floor((ay + dy / 2) / size).astype(np.int64)
+        # a margin of two cells, the points beyond it are clear
+        x_low, y_low = cx.min() - 2, cy.min() - 2
+        columns = cx.max() + 3 - x_low
+        rows = cy.max() + 3 - y_low
+        cells = columns * rows
+        key = (cx - x_low) * rows + (cy - y_low)
+        by = np.argsort(key, kind='stable')
+        key = key[by]
+        # one row per piece, gathered in one go: start, direction, 1 / length squared
+        piece = np.stack((ax, ay, dx, dy, 1 / (dx * dx + dy * dy)), axis=1)[by]
+        piece_component = piece_component[by]
+        if cells <= 4 * len(key) + (1 << 20):
+            cell_first = np.searchsorted(key, np.arange(cells + 1))
+        else:
+            cell_first = None  # too sparse for a table, search instead
+
+        px, py = points[:, 0], points[:, 1]
+        blocked = np.zeros(len(points), dtype=bool)
+        qx = np.floor(px / size).astype(np.int64) - x_low
+        qy = np.floor(py / size).astype(np.int64) - y_low
+        # only the points not yet found to be close are looked at again,
+        # starting from their own cell
+        pending = np.flatnonzero((qx >= 1) & (qx < columns - 1) & (qy >= 1) & (qy < rows - 1))
+        for step_x, step_y in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+            near = (qx[pending] + step_x) * rows + qy[pending] + step_y
+            if cell_first is None:
+                first = np.searchsorted(key, near)
+                stop = np.searchsorted(key, near, 'right')
+            else:
+                first = cell_first[near]
+                stop = cell_first[near + 1]
+            owner, place = _expand(stop - first)
+            e = first[owner] + place
+            point = pending[owner]
+            ex, ey, edx, edy, inverse = piece[e].T
+            ox = px[point] - ex
+            oy = py[point] - ey
+            t = np.clip((ox * edx + oy * edy) * inverse, 0, 1)
+            gx = ox - t * edx
+            gy = oy - t * edy
+            close = (gx * gx + gy * gy < radius * radius) & (piece_component[e] == component[point])
+            blocked[point[close]] = True
+            pending = pending[~blocked[pending]]
+        return ~blocked
+
+    def strokes(self):
+        """The outlines themselves as closed strokes, a group each."""
+        points = np.insert(self.points, self.first + self.count, self.points[self.first], axis=0)
+        counts = self.count + 1
+        starts = np.zeros(len(points), dtype=bool)
+        starts[np.cumsum(counts) - counts] = True
+        return Strokes(points, starts, np.repeat(np.arange(self.rings), counts))
+
+
+class Strokes:
+    """Pen-down polylines in millimetres, in groups that are drawn as a unit.
+
+    points and starts as svg2gcode.flatten() returns them; group numbers
+    each point's group, groups being contiguous.
+    """
+
+    def __init__(self, points, starts, group):
+        self.points = points
+        self.starts = starts
+        self.group = group
+
+    def __len__(self):
+        return int(self.starts.sum())
+
+    @classmethod
+    def join(cls, parts):
+        parts = [part for part in parts if len(part.points)]
+        if not parts:
+            return cls(np.zeros((0, 2)), np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64))
+        groups = []
+        offset = 0
+        for part in parts:
+            groups.append(part.group + offset)
+            offset += int(part.group.max()) + 1
+        return cls(np.concatenate([part.points for part in parts]),
+                   np.concatenate([part.starts for part in parts]), np.concatenate(groups))
+
+    def ordered(self, start=(0.0, 0.0), limit=ORDER_LIMIT):
+        """The strokes with their groups reordered, and reversed where it helps.
+
+        Groups are toured nearest first up to limit of them, beyond that
+        swept in bands BAND_MM high, alternately left to right and back.
+        """
+        n = len(self.points)
+        if not n:
+            return self
+        new_group = np.ones(n, dtype=bool)
+        new_group[1:] = self.group[1:] != self.group[:-1]
+        first, count = _runs(new_group)
+        last = first + count - 1
+        heads, tails = self.points[first], self.points[last]
+        if len(first) <= limit:
+            sequence, flipped = svg2gcode.nearest(heads, tails, start)
+            sequence, flipped = np.asarray(sequence, np.int64), np.asarray(flipped, bool)
+        else:
+            band = np.floor(heads[:, 1] / BAND_MM).astype(np.int64)
+            sequence = np.lexsort((np.where(band % 2, -heads[:, 0], heads[:, 0]), band))
+            flipped = np.zeros(len(first), dtype=bool)
+
+        owner, place = _expand(count[sequence])
+        flip = flipped[owner]
+        g = sequence[owner]
+        source = np.where(flip, last[g] - place, first[g] + place)
+        # drawn backwards, a polyline starts where it used to end
+        ends = np.append(self.starts[1:], True) | np.append(new_group[1:], True)
+        starts = np.where(flip, ends[source], self.starts[source])
+        return Strokes(self.points[source], starts, owner)
+
+
+def hatch(outlines, spacing, pen=plotter.PEN_MM, angle=0.0, join=None):
+    """Hatch the outlines with lines spacing mm apart at angle degrees.
+
+    Lines stop pen / 2 short of the outline. Each cell is a group, drawn
+    back and forth, and the pen stays down across a turn no longer than
+    join (twice the spacing by default).
+    """
+    join = 2 * spacing if join is None else join
+    theta = math.radians(angle)
+    component, k, u0, u1 = outlines.spans(theta, spacing)
+    u0 = u0 + pen / 2
+    u1 = u1 - pen / 2
+    keep = u1 > u0
+    component, k, u0, u1 = component[keep], k[keep], u0[keep], u1[keep]
+    n = len(k)
+    if not n:
+        return Strokes.join([])
+
+    # link a span to the one span it overlaps on the next line, when that
+    # overlaps no other span on this one
+    k_low = int(k.min())
+    line = component * (int(k.max()) - k_low + 3) + (k - k_low + 1)
+    u_low = float(u0.min())
+    width = float(u1.max()) - u_low + 1
+    key0 = line * width + (u0 - u_low)
+    key1 = line * width + (u1 - u_low)
+
+    def overlapping(offset):
+        target = (line + offset) * width
+        first = np.searchsorted(key1, target + (u0 - u_low), 'right')
+        stop = np.searchsorted(key0, target + (u1 - u_low), 'left')
+        return first, np.maximum(stop - first, 0)
+
+    below, below_count = overlapping(1)
+    _, above_count = overlapping(-1)
+    link = below_count == 1
+    link[link] = above_count[below[link]] == 1
+    previous = np.full(n, -1)
+    previous[below[link]] = np.flatnonzero(link)
+
+    # the first span of each cell, by pointer jumping
+    head = np.where(previous >= 0, previous, np.arange(n))
+    while True:
+        jumped = head[head]
+        if np.array_equal(jumped, head):
+            break
+        head = jumped
+    by = np.lexsort((k, head))
+    head, k, u0, u1 = head[by], k[by], u0[by], u1[by]
+    forward = (k - k[np.searchsorted(head, head)]) % 2 == 0
+    begin = np.where(forward, u0, u1)
+    end = np.where(forward, u1, u0)
+    same_cell = np.zeros(n, dtype=bool)
+    same_cell[1:] = head[1:] == head[:-1]
+    joined = same_cell.copy()
+    joined[1:] &= np.abs(begin[1:] - end[:-1]) <= join
+
+    u = np.stack((begin, end), axis=1).ravel()
+    v = np.repeat(k * spacing, 2)
+    c, s = math.cos(theta), math.sin(theta)
+    points = np.stack((u * c - v * s, u * s + v * c), axis=1)
+    starts = np.zeros(2 * n, dtype=bool)
+    starts[0::2] = ~joined
+    group = np.repeat(np.cumsum(~same_cell) - 1, 2)
+    return Strokes(points, starts, group)
+
+
+def crosshatch(outlines, spacing, pen=plotter.PEN_MM, angle=0.0, join=None):
+    """hatch() at angle and again at angle + 90."""
+    return Strokes.join([hatch(outlines, spacing, pen, angle, join),
+                         hatch(outlines, spacing, pen, angle + 90, join)])
+
+
+def concentric(outlines, spacing, pen=plotter.PEN_MM, step=None):
+    """Rings inside the outlines, the first pen / 2 in and then spacing apart.
+
+    Every corner is moved inwards along its bisector, the ring sampled
+    every step mm (spacing by default), and the samples closer to an
+    outline than the ring's distance dropped, which cuts the ring where
+    the region is too narrow for it. Each piece is a group. Which way is
+    inwards is worked out per edge, with the outlines split where they
+    cross, so a path that crosses itself fills the way hatch() fills it.
+    """
+    step = spacing if step is None else step
+    outlines = outlines.split()
+    points = outlines.points
+    if not len(points):
+        return Strokes.join([])
+    following = outlines.following
+    ring_of = outlines.ring_of
+    d = points[following] - points
+    length = np.hypot(d[:, 0], d[:, 1])
+    normal = np.stack((-d[:, 1], d[:, 0]), axis=1) / length[:, None]  # to the left
+    previous = np.empty_like(following)
+    previous[following] = np.arange(len(points))
+
+    # which side of each edge is inside, and so which way each corner
+    # moves; an edge with the region on neither side or on both bounds
+    # nothing, and its samples are dropped
+    side = outlines.sides()
+    bounds = side != 0
+
+    # corner offsets for a distance of one, mitred
+    inwards = normal * side[:, None]
+    n0, n1 = inwards[previous], inwards
+    mitre = (n0 + n1) / np.maximum(1 + np.sum(n0 * n1, axis=1), 0.1)[:, None]
+
+    # no ring goes further in than half the box it is inside: its own when
+    # it encloses the region all the way round, otherwise the component's
+    component = outlines.ring_component
+    turn = np.sign(outlines.ring_area2).astype(np.int64)
+    enclosing = np.minimum.reduceat(side * turn[ring_of], outlines.first) == 1
+    size = np.where(enclosing[:, None], outlines.ring_high - outlines.ring_low,
+                    (outlines.component_high - outlines.component_low)[component])
+    reach = size.min(axis=1) / 2
+    low = outlines.component_low
+    high = outlines.component_high
+
+    parts = []
+    alive = np.zeros(outlines.rings, dtype=bool)
+    alive[ring_of[bounds]] = True
+    distance = pen / 2
+    while True:
+        alive &= distance * 0.98 <= reach
+        if not alive.any():
+            break
+        corner = alive[ring_of]
+        q = points + distance * mitre
+        edge = np.flatnonzero(corner)
+        e = q[following[edge]] - q[edge]
+        samples = np.maximum(np.ceil(np.hypot(e[:, 0], e[:, 1]) / step), 1).astype(np.int64)
+        owner, place = _expand(samples)
+        t = (place / samples[owner])[:, None]
+        sample = q[edge][owner] + t * e[owner]
+        ring = ring_of[edge][owner]
+        # a sample that far from every edge is inside too: it is that far
+        # in from the edge it was offset from, and would be closer to any
+        # edge between the two. It is as far inside the component's box.
+        sample_component = component[ring]
+        margin = distance * 0.98
+        valid = bounds[edge][owner] & np.all((sample >= low[sample_component] + margin) &
+                                             (sample <= high[sample_component] - margin), axis=1)
+        valid[valid] = outlines.clear(sample[valid], sample_component[valid], margin)
+
+        # pieces of a ring: rotate each ring to start at a dropped sample,
+        # so a piece never wraps around; whole rings are closed up
+        ring_start, ring_count = _runs(np.append(True, ring[1:] != ring[:-1]))
+        index = np.arange(len(sample)) - np.repeat(ring_start, ring_count)
+        dropped = np.where(valid, np.iinfo(np.int64).max, index)
+        shift = np.minimum.reduceat(dropped, ring_start)
+        whole = shift == np.iinfo(np.int64).max
+        shift[whole] = 0
+        ring_n = np.repeat(np.arange(len(ring_start)), ring_count)
+        source = np.repeat(ring_start, ring_count) + (index + shift[ring_n]) % np.repeat(ring_count, ring_count)
+        sample, valid = sample[source], valid[source]
+        begins = valid & np.append(True, ~valid[:-1] | (index[1:] == 0))
+        kept = np.flatnonzero(valid)
+        piece_points = sample[kept]
+        piece_starts = begins[kept]
+        closing = np.flatnonzero(whole)
+        at = np.searchsorted(kept, ring_start[closing] + ring_count[closing])
+        piece_points = np.insert(piece_points, at, sample[ring_start[closing]], axis=0)
+        piece_starts = np.insert(piece_starts, at, False)
+        parts.append(Strokes(piece_points, piece_starts, np.cumsum(piece_starts) - 1))
+
+        # a ring with nothing left will not come back further in
+        live = np.zeros(outlines.rings, dtype=bool)
+        live[ring[valid]] = True
+        alive &= live
+        distance += spacing
+    return Strokes.join(parts)
+
+
+def load_svg(path, tolerance=0.05, scale=1.0, flip_y=True, offset=(0.0, 0.0), rule='nonzero',
+             work_area=plotter.WORK_AREA_MM, home=plotter.HOME):
+    """The outlines of every subpath in an SVG file, as svg2gcode reads it.
+
+    Shapes with fill none are left out, SVG paints nothing inside them.
+    """
+    points, starts, elements, filled = svg2gcode.load(path, tolerance, scale, flip_y, offset,
+                                                      elements=True, work_area=work_area, home=home)
+    if not filled.all():
+        keep = np.repeat(filled, _runs(starts)[1])
+        points, starts, elements = points[keep], starts[keep], elements[filled]
+    return Outlines(points, starts, elements, rule)
+
+
+def load_gcode(path, steps_per_mm=plotter.STEPS_PER_MM, rule='evenodd'):
+    """The closed contours drawn by a G-code file; returns (outlines, open contours)."""
+    program = gcode.load(path, steps_per_mm)
+    draw = (program.kind != gcode.SET_POSITION) & ~program.pen_up & ((program.dx != 0) | (program.dy != 0))
+    begins = draw & ~np.append(False, draw[:-1])
+    index = np.flatnonzero(draw)
+    ends = np.stack((program.x[index], program.y[index]), axis=1)
+    origins = np.stack((program.x - program.dx, program.y - program.dy), axis=1)[begins]
+    at = np.searchsorted(index, np.flatnonzero(begins))
+    points = np.insert(ends, at, origins, axis=0)
+    starts = np.zeros(len(points), dtype=bool)
+    starts[at + np.arange(len(at))] = True
+    first, count = _runs(starts)
+    closed = np.all(points[first] == points[first + count - 1], axis=1)
+    keep = np.repeat(closed, count)
+    outlines = Outlines(points[keep] / steps_per_mm, starts[keep], rule=rule)
+    return outlines, int(np.count_nonzero(~closed))
+
+
+def fill(outlines, kind='hatch', spacing=plotter.PEN_MM, pen=plotter.PEN_MM, angle=0.0,
+         join=None, outline=False, steps_per_mm=plotter.STEPS_PER_MM):
+    """Fill outlines, returning ordered Strokes in millimetres.
+
+    spacing is rounded to a whole number of motor steps.
+    """
+    if kind not in FILLS:
+        raise ValueError("fill is one of {}".format(", ".join(FILLS)))
+    spacing = max(round(spacing * steps_per_mm), 1) / steps_per_mm
+    if kind == 'hatch':
+        strokes = hatch(outlines, spacing, pen, angle, join)
+    elif kind == 'crosshatch':
+        strokes = crosshatch(outlines, spacing, pen, angle, join)
+    else:
+        strokes = concentric(outlines, spacing, pen)
+    strokes = strokes.ordered()
+    if outline:
+        # drawn last, over the ends of the fill
+        ends = strokes.points[-1] if len(strokes.points) else (0.0, 0.0)
+        strokes = Strokes.join([strokes, outlines.strokes().ordered(ends)])
+    return strokes
+
+
+def to_polylines(strokes, work_area=plotter.WORK_AREA_MM, steps_per_mm=plotter.STEPS_PER_MM,
+                 home=plotter.HOME):
+    """Clip strokes to the work area and snap them to whole steps, for svg2gcode.to_gcode().
+
+    The work area is placed as the firmware's soft limits place it, see
+    plotter.envelope().
+    """
+    points, starts = svg2gcode.clip(strokes.points, strokes.starts, *plotter.envelope(work_area, home))
+    steps, starts = svg2gcode.quantise(points, starts, steps_per_mm)
+    return svg2gcode.split(steps, starts) if len(steps) else []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill SVG shapes or G-code contours for the MicroPlotter")
+    parser.add_argument('input', help=".svg, or G-code whose closed contours are filled")
+    parser.add_argument('-o', '--output', help="output file, default stdout")
+    parser.add_argument('--fill', choices=FILLS, default='hatch')
+    parser.add_argument('--pen', type=float, default=plotter.PEN_MM, help="pen width, mm")
+    parser.add_argument('--spacing', type=float, help="between strokes, mm (default the pen width)")
+    parser.add_argument('--angle', type=float, default=0.0,
+                        help="hatch angle, degrees; other than 0 or 90 the lines are staircases")
+    parser.add_argument('--join', type=float, help="longest turn drawn without lifting the pen, mm")
+    parser.add_argument('--rule', choices=RULES,
+                        help="fill rule (default nonzero for SVG, evenodd for G-code)")
+    parser.add_argument('--outline', action='store_true', help="draw the outlines too")
+    parser.add_argument('--tolerance', type=float, default=0.05, help="curve flattening tolerance, mm")
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--offset', type=float, nargs=2, default=(0.0, 0.0), metavar=('X', 'Y'), help="mm")
+    parser.add_argument('--no-flip-y', dest='flip_y', action='store_false')
+    parser.add_argument('--width', type=float, default=plotter.WORK_AREA_MM[0], help="work area, mm")
+    parser.add_argument('--height', type=float, default=plotter.WORK_AREA_MM[1], help="work area, mm")
+    parser.add_argument('--endstops', type=int, nargs=2, choices=(-1, 1), default=plotter.HOME, metavar=('X', 'Y'),
+                        help="endstop_direction of the X and Y motors, default %(default)s")
+    parser.add_argument('--steps-per-mm', type=float, default=plotter.STEPS_PER_MM)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.input.lower().endswith('.svg'):
+        outlines = load_svg(args.input, args.tolerance, args.scale, args.flip_y, args.offset,
+                            args.rule or 'nonzero', (args.width, args.height), args.endstops)
+    else:
+        outlines, open_contours = load_gcode(args.input, args.steps_per_mm, args.rule or 'evenodd')
+        if open_contours:
+            print("{} contours that do not close were left out".format(open_contours), file=sys.stderr)
+    strokes = fill(outlines, args.fill, args.spacing or args.pen, args.pen, args.angle, args.join,
+                   args.outline, args.steps_per_mm)
+    polylines = to_polylines(strokes, (args.width, args.height), args.steps_per_mm, args.endstops)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        lines = 0
+        for line in svg2gcode.to_gcode(polylines, args.steps_per_mm):
+            out.write(line + '\n')
+            lines += 1
+    finally:
+        if args.output:
+            out.close()
+    print("{} outlines, {} strokes, {} lines of G-code in {:.2f}s".format(
+        outlines.rings, len(polylines), lines, time.perf_counter() - started), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# Vectorised G-code reader for the host tools
+# Parses a whole file with NumPy and replays it the way the firmware
+# does, so the estimator, validator and renderer see the same motion the
+# plotter will make:
+#
+# - only lines starting G0/G1 (or G90/G91) move anything, and only a
+#   line that is exactly G90 or G91 changes the positioning mode
+# - positioning is relative (G91) until a G90 line
+# - X and Y are converted to steps with int(value * steps_per_mm), Z is
+#   int(value) and any Z change is a fixed pen move, up when dz == 1
+# - G92 sets the position to the raw values, as test_usb.py does, and
+#   $H leaves the machine at X0 Y0
+# - comments (';' and '(...)') are stripped, as the senders do
+#
+# Requires numpy.
+
+import numpy as np
+
+TRAVEL, DRAW, SET_POSITION = 0, 1, 2
+
+_WORD = np.zeros(256, bool)
+_WORD[[ord(c) for c in 'GXYZ']] = True
+_AXES = b'XYZ'
+
+# widest number parsed in bulk, longer ones go through float()
+_MAX_WIDTH = 24
+
+
+class Program:
+    """Motion of a G-code file, one entry per line that moves or sets position.
+
+    line        1-based line number in the file
+    kind        TRAVEL (G0), DRAW (any other G0/G1 line) or SET_POSITION
+    x, y, z     position after the line: steps for X/Y, Z as the firmware
+                stores it (G92 values are stored as given)
+    dx, dy, dz  distance each axis moved, in steps (0 for SET_POSITION)
+    pen_up      pen state while the line's X/Y move ran
+    """
+
+    def __init__(self, line, kind, x, y, z, dx, dy, dz, pen_up, lines, sent_lines):
+        self.line = line
+        self.kind = kind
+        self.x, self.y, self.z = x, y, z
+        self.dx, self.dy, self.dz = dx, dy, dz
+        self.pen_up = pen_up
+        self.lines = lines            # lines in the file
+        self.sent_lines = sent_lines  # lines left once comments and blanks are dropped
+
+    def __len__(self):
+        return len(self.line)
+
+
+def _skip_space(a, space, positions):
+    """Advance each position past spaces, stopping at a newline."""
+    positions = positions.copy()
+    pending = np.flatnonzero(space[positions] & (a[positions] != 10))
+    while len(pending):
+        positions[pending] += 1
+        pending = pending[space[positions[pending]] & (a[positions[pending]] != 10)]
+    return positions
+
+
+def _strip_comments(a, newlines):
+    """Blank ';' comments to the end of the line and '(...)' comments in place."""
+    n = len(a)
+    ranges = np.zeros(n + 1, np.int32)
+    semis = np.flatnonzero(a == ord(';'))
+    if len(semis):
+        line_ends = newlines[np.searchsorted(newlines, semis)]
+        ranges[semis] += 1
+        ranges[line_ends] -= 1
+    opens = np.flatnonzero(a == ord('('))
+    if len(opens):
+        closes = np.flatnonzero(a == ord(')'))
+        line_ends = newlines[np.searchsorted(newlines, opens)]
+        close = np.append(closes, n)[np.searchsorted(closes, opens)]
+        ranges[opens] += 1
+        ranges[np.minimum(close + 1, line_ends)] -= 1
+    a[np.cumsum(ranges[:n]) > 0] = 32
+
+
+def _numbers(a, starts, ends):
+    """Parse the numeric runs a[starts[i]:ends[i]] as floats.
+
+    Returns (values, valid), valid being False where float() would
+    raise. The runs are gathered into a fixed width bytes array so NumPy
+    can convert them all at once.
+    """
+    count = len(starts)
+    values = np.zeros(count)
+    if not count:
+        return values, np.zeros(0, bool)
+    lengths = ends - starts
+    width = int(min(lengths.max(), _MAX_WIDTH))
+    columns = np.arange(width)
+    inside = columns < lengths[:, None]
+    chars = np.where(inside, a[np.minimum(starts[:, None] + columns, len(a) - 1)], 0).astype(np.uint8, copy=False)
+    text = chars.view('S{}'.format(width)).ravel()
+    valid = lengths <= width
+    try:
+        values[valid] = text[valid].astype(np.float64)
+    except ValueError:
+        # a stray sign or dot somewhere: find the runs float() would reject
+        digits = np.count_nonzero((chars >= 48) & (chars <= 57), axis=1)
+        dots = np.count_nonzero(chars == ord('.'), axis=1)
+        signs = np.count_nonzero((chars == ord('-')) | (chars == ord('+')), axis=1)
+        leading_sign = (chars[:, 0] == ord('-')) | (chars[:, 0] == ord('+'))
+        valid &= (digits > 0) & (dots <= 1) & (signs == leading_sign)
+        values[valid] = text[valid].astype(np.float64)
+
+    # numbers too long for the table are rare, let Python parse them
+    for i in np.flatnonzero(lengths > width):
+        try:
+            values[i] = float(bytes(a[starts[i]:ends[i]]))
+            valid[i] = True
+        except ValueError:
+            pass
+    return values, valid
+
+
+def parse(data, steps_per_mm=10):
+    """Parse G-code text (str or bytes) into a Program."""
+    if isinstance(data, str):
+        data = data.encode()
+    data = data.upper()
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    a = np.frombuffer(data, np.uint8)
+    n = len(a)
+
+    newlines = np.flatnonzero(a == 10)
+    line_count = len(newlines)
+    if b';' in data or b'(' in data:
+        a = a.copy()
+        _strip_comments(a, newlines)
+    space = (a == 32) | (a == 10) | (a == 13) | (a == 9)
+
+    # first non-space byte of every line, -1 for blank ones
+    line_first = _skip_space(a, space, np.concatenate(([0], newlines[:-1] + 1)))
+    line_first[a[line_first] == 10] = -1
+
+    # numeric runs, and the words ending in them: a letter at a token
+    # start followed by a number that runs to the end of the token
+    numeric = ((a - 43) <= 14) & (a != 44) & (a != 47)  # 0-9 . + -
+    starts = np.flatnonzero(numeric[1:] & ~numeric[:-1]) + 1
+    ends = np.flatnonzero(numeric[:-1] & ~numeric[1:]) + 1
+    letters = starts - 1
+    keep = space[ends]
+    letters, starts, ends = letters[keep], starts[keep], ends[keep]
+    keep = _WORD[a[letters]] & ((letters == 0) | space[letters - 1])
+    letters, starts, ends = letters[keep], starts[keep], ends[keep]
+    values, valid = _numbers(a, starts, ends)
+    letters, starts, ends, values = letters[valid], starts[valid], ends[valid], values[valid]
+    letter = a[letters]
+    word_line = np.searchsorted(newlines, letters)
+    leading = line_first[word_line] == letters
+
+    # classify lines by their first token, as test_usb.py and parse_line do
+    kind = np.full(line_count, -1, np.int8)
+    g = leading & (letter == ord('G'))
+    g_line = word_line[g]
+    first_digit = a[starts[g]]
+    length = ends[g] - starts[g]
+    second = np.where(length > 1, a[np.minimum(starts[g] + 1, n - 1)], 0)
+    motion = (first_digit == ord('0')) | (first_digit == ord('1'))
+    travel = (first_digit == ord('0')) & ((length == 1) | ((length == 2) & (second == ord('0'))))
+    kind[g_line[motion]] = np.where(travel[motion], TRAVEL, DRAW)
+
+    nineties = (first_digit == ord('9')) & (length == 2)
+    alone = a[_skip_space(a, space, ends[g])] == 10
+    set_mode = nineties & ((second == ord('0')) | (second == ord('1'))) & alone
+    mode_line = g_line[set_mode]
+    mode_value = second[set_mode] == ord('0')  # True for G90 absolute
+    # 'G90 X..' is not a mode change but parse_line still moves for it
+    mode_motion = nineties & ((second == ord('0')) | (second == ord('1'))) & ~set_mode
+    kind[g_line[mode_motion]] = DRAW
+    kind[g_line[nineties & (second == ord('2'))]] = SET_POSITION
+
+    home = np.flatnonzero((line_first >= 0) & (a[np.maximum(line_first, 0)] == ord('$')))
+    home = home[a[np.minimum(line_first[home] + 1, n - 1)] == ord('H')]
+    home = home[a[_skip_space(a, space, line_first[home] + 2)] == 10]
+    kind[home] = SET_POSITION
+
+    # absolute mode in force on each line
+    mode_at = np.full(line_count, -1, np.int8)
+    mode_at[mode_line] = mode_value
+    set_idx = np.where(mode_at >= 0, np.arange(line_count), -1)
+    last_set = np.maximum.accumulate(set_idx) if line_count else set_idx
+    absolute = np.where(last_set >= 0, mode_at[np.maximum(last_set, 0)] == 1, False)
+
+    moving = np.flatnonzero(kind >= 0)
+    index_of = np.full(line_count, -1, np.int64)
+    index_of[moving] = np.arange(len(moving))
+    count = len(moving)
+    moving_kind = kind[moving]
+    is_set = moving_kind == SET_POSITION
+    is_home = np.isin(moving, home)
+
+    positions = []
+    deltas = []
+    for axis in _AXES:
+        word = (letter == axis) & ~leading & (kind[word_line] >= 0)
+        at = index_of[word_line[word]]
+        raw = values[word]
+        # the last word for an axis on a line wins, as in parse_line
+        present = np.zeros(count, bool)
+        value = np.zeros(count)
+        present[at] = True
+        value[at] = raw
+        if axis == ord('Z'):
+            steps = np.trunc(value)
+        else:
+            steps = np.trunc(value * steps_per_mm)
+        steps = np.where(is_set, value, steps)
+        if axis != ord('Z'):
+            present |= is_home
+            steps = np.where(is_home, 0, steps)
+
+        anchor = present & (is_set | absolute[moving])
+        relative = present & ~anchor
+        step_sum = np.cumsum(np.where(relative, steps, 0))
+        anchor_idx = np.maximum.accumulate(np.where(anchor, np.arange(count), -1)) if count else np.zeros(0, np.int64)
+        base = np.where(anchor_idx >= 0, steps[np.maximum(anchor_idx, 0)], 0)
+        base_sum = np.where(anchor_idx >= 0, step_sum[np.maximum(anchor_idx, 0)], 0)
+        position = base + step_sum - base_sum
+        previous = np.concatenate(([0.0], position[:-1]))
+        delta = np.where(present & ~is_set, position - previous, 0)
+        positions.append(position)
+        deltas.append(delta)
+
+    x, y, z = positions
+    dx, dy, dz = deltas
+    # the pen is lifted by a dz of exactly 1 and lowered by any other
+    # change; assume it starts up
+    pen_moves = dz != 0
+    state = np.where(pen_moves, dz == 1, True)
+    last_move = np.maximum.accumulate(np.where(pen_moves, np.arange(count), -1)) if count else np.zeros(0, np.int64)
+    after = np.where(last_move >= 0, state[np.maximum(last_move, 0)], True)
+    pen_up = np.concatenate(([True], after[:-1])) if count else after
+
+    return Program(moving + 1, moving_kind, x, y, z, dx, dy, dz, pen_up,
+                   line_count, int(np.count_nonzero(line_first >= 0)))
+
+
+def load(path, steps_per_mm=10):
+    with open(path, 'rb') as f:
+        return parse(f.read(), steps_per_mm)
@@ -0,0 +1,42 @@
+# Machine description shared by the host-side tools
+# These mirror the firmware defaults in test_usb.py, stepper.py and
+# gcode_interpreter.py; override them on the command line of each tool
+# if your plotter is set up differently.
+
+STEPS_PER_MM = 11         # test_usb.py STEPS_PER_MM (1000 steps ~ 9cm)
+WORK_AREA_MM = (80, 80)   # usable X, Y travel from the homed origin
+HOME = (-1, 1)            # test_usb.py endstop_direction: X homes to -X, Y to +Y
+DELAY_US = 1500           # StepperMotor delay per coil phase
+TRAVEL_MODE = 'full'      # GCodeInterpreter.travel_mode, used for G0
+DRAW_MODE = 'half'        # GCodeInterpreter.draw_mode, used for G1
+PEN_STEPS = 50            # coil cycles the pen motor turns per Z move
+PEN_UP_Z = 1              # Z1 lifts the pen
+PEN_DOWN_Z = 0            # Z0 lowers it
+PEN_MM = 0.5              # width of the line the pen draws, for fills
+
+# coil phases per step (one coil cycle) in each step mode
+PHASES = {'full': 4, 'half': 8}
+
+
+def envelope(work_area=WORK_AREA_MM, home=HOME):
+    """The soft limit envelope in mm, (x_min, x_max, y_min, y_max).
+
+    As GCodeInterpreter.limits(): home() puts the origin at the endstops
+    and each axis travels away from its endstop, so with the Y endstop at
+    the +Y end the work area is at negative Y.
+    """
+    x_mm, y_mm = work_area
+    x = (-x_mm, 0) if home[0] > 0 else (0, x_mm)
+    y = (-y_mm, 0) if home[1] > 0 else (0, y_mm)
+    return x + y
+
+
+def steps_to_gcode(steps, steps_per_mm=STEPS_PER_MM):
+    """Format a whole step count as a coordinate the firmware maps back to it.
+
+    GCodeInterpreter truncates value * steps_per_mm towards zero, so the
+    value is written half a step past the target to survive the rounding
+    of the decimal representation.
+    """
+    bias = 0.5 if steps >= 0 else -0.5
+    return "{:.4f}".format((steps + bias) / steps_per_mm) if steps else "0"
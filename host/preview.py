@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# Dry-run preview of a G-code job for the MicroPlotter
+# Runs the file through the firmware's own GCodeInterpreter, line by line
+# as jobs.py does, with motors that record their moves instead of
+# turning. The moves are drawn as the plotter makes them: the X move of
+# each line and then its Y move, with the pen wherever the last Z move
+# left it (up to begin with). Relative mode, step truncation and the Z
+# quirks all come out as they would on paper.
+#
+#   python host/preview.py drawing.gcode -o drawing.png
+#   python host/preview.py drawing.gcode -o drawing.svg --travel
+#
+# Lines whose achieved position is a step or more from the position the
+# G-code asked for (truncation piles up in relative mode) are listed and
+# marked in red. The work area is drawn where the firmware's soft limits
+# put it (see plotter.envelope), and moves that leave it are counted.
+#
+# Requires numpy.
+
+import argparse
+import array
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+import plotter
+import sim  # noqa: F401, puts the firmware modules on the path
+from gcode_interpreter import GCodeInterpreter
+
+X, Y, Z = 0, 1, 2
+MARGIN_MM = 2.0
+CHUNK_POINTS = 1 << 22  # pixels rasterised per batch, to bound memory
+
+WHITE = (255, 255, 255)
+INK = (0, 0, 0)
+TRAVEL = (170, 200, 255)
+AREA = (225, 225, 225)
+DRIFT = (230, 0, 0)
+
+
+class Trace:
+    """Every axis move the interpreter made, in order, with its G-code line."""
+
+    def __init__(self):
+        self.axis = array.array('b')
+        self.steps = array.array('l')
+        self.line = array.array('l')
+        self.current = 0
+
+
+class NullMotor:
+    """Motor backend that records moves in a Trace instead of stepping."""
+
+    delay_us = plotter.DELAY_US
+    profiler = None
+
+    def __init__(self, trace, axis):
+        self.trace = trace
+        self.axis = axis
+
+    def move(self, steps, direction=1, mode=None):
+        trace = self.trace
+        trace.axis.append(self.axis)
+        trace.steps.append(int(steps) * direction)
+        trace.line.append(trace.current)
+
+    def stop(self):
+        pass
+
+    def is_endstop_triggered(self):
+        return False
+
+
+class Preview:
+    """The result of a dry run, in steps.
+
+    x0, y0, x1, y1, line  every X or Y move; pen_down says which drew
+    drift                 (line, commanded x, y, achieved x, y) in mm for
+                          every line that moved
+    odd_z                 lines whose Z change was not 1 or -1 (all of
+                          them lower the pen)
+    """
+
+    def __init__(self, trace, drift, odd_z, lines, steps_per_mm):
+        axis = np.frombuffer(trace.axis, np.int8)
+        steps = np.frombuffer(trace.steps, np.dtype('l')).astype(np.int64)
+        line = np.frombuffer(trace.line, np.dtype('l'))
+
+        # pen state: the direction of the last Z move before each move
+        last_z = np.where(axis == Z, np.arange(len(axis)), -1)
+        np.maximum.accumulate(last_z, out=last_z)
+        pen_down = (last_z >= 0) & (steps[np.maximum(last_z, 0)] > 0)
+
+        dx = np.where(axis == X, steps, 0)
+        dy = np.where(axis == Y, steps, 0)
+        x1 = np.cumsum(dx)
+        y1 = np.cumsum(dy)
+        xy = axis != Z
+        self.x1, self.y1 = x1[xy], y1[xy]
+        self.x0, self.y0 = self.x1 - dx[xy], self.y1 - dy[xy]
+        self.line = line[xy]
+        self.pen_down = pen_down[xy]
+        self.drift = np.array(drift, np.float64).reshape(-1, 5)
+        self.odd_z = odd_z
+        self.lines = lines
+        self.steps_per_mm = steps_per_mm
+
+    def length_mm(self, drawn=True):
+        select = self.pen_down == drawn
+        return float(np.abs(self.x1 - self.x0)[select].sum() + np.abs(self.y1 - self.y0)[select].sum()) / self.steps_per_mm
+
+    def drifted(self, limit_mm):
+        """Rows of drift where either axis is off by limit_mm or more."""
+        drift = self.drift
+        off = np.abs(drift[:, 1:3] - drift[:, 3:5]).max(axis=1) if len(drift) else np.zeros(0)
+        return drift[off >= limit_mm]
+
+    def outside(self, envelope=plotter.envelope()):
+        """G-code line numbers of the moves ending outside envelope, the soft limits refuse them."""
+        s = self.steps_per_mm
+        x_min, x_max, y_min, y_max = (int(limit * s) for limit in envelope)
+        out = (self.x1 < x_min) | (self.x1 > x_max) | (self.y1 < y_min) | (self.y1 > y_max)
+        return np.unique(self.line[out])
+
+    def extent_mm(self, envelope=plotter.envelope()):
+        """(left, bottom, right, top) covering the work area and every move."""
+        s = self.steps_per_mm
+        left, right, bottom, top = (float(limit) for limit in envelope)
+        if len(self.x1):
+            left = min(left, self.x0.min() / s, self.x1.min() / s)
+            right = max(right, self.x0.max() / s, self.x1.max() / s)
+            bottom = min(bottom, self.y0.min() / s, self.y1.min() / s)
+            top = max(top, self.y0.max() / s, self.y1.max() / s)
+        return left - MARGIN_MM, bottom - MARGIN_MM, right + MARGIN_MM, top + MARGIN_MM
+
+
+def _commanded(command, target, relative):
+    """Move target (mm) as the line asks, without rounding to steps.
+
+    Words are read the way GCodeInterpreter.plan reads them.
+    """
+    line = command.upper()
+    if not line.startswith(('G0', 'G1')):
+        return False
+    for part in line.split()[1:]:
+        axis = 'XY'.find(part[0])
+        if axis >= 0:
+            try:
+                value = float(part[1:])
+            except ValueError:
+                continue
+            target[axis] = target[axis] + value if relative else value
+    return True
+
+
+def run(lines, steps_per_mm=plotter.STEPS_PER_MM):
+    """Dry-run G-code lines through the firmware's interpreter."""
+    trace = Trace()
+    gcode = GCodeInterpreter(NullMotor(trace, X), NullMotor(trace, Y), NullMotor(trace, Z))
+    gcode.steps_per_mm = steps_per_mm
+    gcode.verbose = False
+    position = gcode.position
+    target = [0.0, 0.0]
+    drift = []
+    odd_z = []
+    number = 0
+    for number, line in enumerate(lines, 1):
+        # as jobs.py sends them
+        command = line.split(';', 1)[0].strip()
+        if not command:
+            continue
+        trace.current = number
+        relative = gcode.relative_mode
+        z = position['Z']
+        gcode.parse_line(command)
+        if _commanded(command, target, relative):
+            drift.append((number, target[0], target[1],
+                          position['X'] / steps_per_mm, position['Y'] / steps_per_mm))
+        if position['Z'] - z not in (0, 1, -1):
+            odd_z.append(number)
+    return Preview(trace, drift, odd_z, number, steps_per_mm)
+
+
+def load(path, steps_per_mm=plotter.STEPS_PER_MM):
+    with open(path) as f:
+        return run(f, steps_per_mm)
+
+
+# --- drawing ----------------------------------------------------------------
+
+def rasterise(image, x0, y0, x1, y1, colour):
+    """Draw line segments (pixel coordinates, y down) into an RGB image."""
+    height, width = image.shape[:2]
+    lengths = np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(np.int64) + 1
+    ends = np.cumsum(lengths)
+    first = 0
+    while first < len(lengths):
+        # whole segments, up to CHUNK_POINTS pixels at a time
+        last = max(int(np.searchsorted(ends, (ends[first - 1] if first else 0) + CHUNK_POINTS)), first + 1)
+        count = lengths[first:last]
+        segment = np.repeat(np.arange(first, last), count)
+        offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        t = offset / np.maximum(count - 1, 1)[segment - first]
+        px = np.rint(x0[segment] + (x1 - x0)[segment] * t).astype(np.int64)
+        py = np.rint(y0[segment] + (y1 - y0)[segment] * t).astype(np.int64)
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        image[py[inside], px[inside]] = colour
+        first = last
+
+
+def render_png(preview, scale=10.0, travel=False, limit_mm=None, envelope=plotter.envelope()):
+    """Render a preview as an RGB array, scale pixels per mm."""
+    left, bottom, right, top = preview.extent_mm(envelope)
+    width = int(np.ceil((right - left) * scale)) + 1
+    height = int(np.ceil((top - bottom) * scale)) + 1
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = WHITE
+
+    def px(x_mm):
+        return (x_mm - left) * scale
+
+    def py(y_mm):
+        return (top - y_mm) * scale
+
+    # the work area outline
+    x_min, x_max, y_min, y_max = envelope
+    corners = np.array([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max], [x_min, y_min]],
+                       np.float64)
+    rasterise(image, px(corners[:-1, 0]), py(corners[:-1, 1]), px(corners[1:, 0]), py(corners[1:, 1]), AREA)
+
+    s = preview.steps_per_mm
+    for drawn, colour in ((False, TRAVEL), (True, INK)):
+        if not drawn and not travel:
+            continue
+        select = preview.pen_down == drawn
+        rasterise(image, px(preview.x0[select] / s), py(preview.y0[select] / s),
+                  px(preview.x1[select] / s), py(preview.y1[select] / s), colour)
+
+    if limit_mm is not None:
+        # a small cross where each drifted line ended up
+        drifted = preview.drifted(limit_mm)
+        cx, cy = px(drifted[:, 3]), py(drifted[:, 4])
+        arm = max(2.0, scale * 0.3)
+        rasterise(image, cx - arm, cy - arm, cx + arm, cy + arm, DRIFT)
+        rasterise(image, cx - arm, cy + arm, cx + arm, cy - arm, DRIFT)
+    return image
+
+
+def write_png(path, image):
+    """Write an RGB uint8 array as a PNG file."""
+    height, width = image.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), np.uint8)  # filter byte 0 per row
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def _path_data(preview, select, top):
+    """SVG path data for the selected moves, one subpath per run of them."""
+    s = preview.steps_per_mm
+    index = np.flatnonzero(select)
+    if not len(index):
+        return ''
+    starts = np.ones(len(index), bool)
+    starts[1:] = np.diff(index) != 1
+    x0 = preview.x0[index] / s
+    y0 = top - preview.y0[index] / s
+    dx = (preview.x1 - preview.x0)[index] / s
+    dy = -(preview.y1 - preview.y0)[index] / s
+    words = []
+    for i, start in enumerate(starts.tolist()):
+        if start:
+            words.append('M{:.3f} {:.3f}'.format(x0[i], y0[i]))
+        words.append('h{:.3f}'.format(dx[i]) if dx[i] else 'v{:.3f}'.format(dy[i]))
+    return ''.join(words)
+
+
+def write_svg(path, preview, travel=False, limit_mm=None, max_marks=1000, envelope=plotter.envelope()):
+    """Write a preview as SVG in millimetres, y up as on the plotter."""
+    left, bottom, right, top = preview.extent_mm(envelope)
+    width, height = right - left, top - bottom
+    x_min, x_max, y_min, y_max = envelope
+    with open(path, 'w') as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="{0:.3f}mm" height="{1:.3f}mm" '
+                'viewBox="{2:.3f} 0 {0:.3f} {1:.3f}">\n'.format(width, height, left))
+        f.write('<rect x="{}" y="{:.3f}" width="{}" height="{}" fill="none" stroke="#e1e1e1" '
+                'stroke-width="0.2"/>\n'.format(x_min, top - y_max, x_max - x_min, y_max - y_min))
+        if travel:
+            f.write('<path d="{}" fill="none" stroke="#aac8ff" stroke-width="0.1"/>\n'.format(
+                _path_data(preview, ~preview.pen_down, top)))
+        f.write('<path d="{}" fill="none" stroke="black" stroke-width="0.2" '
+                'stroke-linejoin="round" stroke-linecap="round"/>\n'.format(_path_data(preview, preview.pen_down, top)))
+        if limit_mm is not None:
+            for number, cx, cy, ax, ay in preview.drifted(limit_mm)[:max_marks].tolist():
+                f.write('<circle cx="{:.3f}" cy="{:.3f}" r="0.4" fill="none" stroke="red" stroke-width="0.1">'
+                        '<title>line {}: asked for X{:.3f} Y{:.3f}, reached X{:.3f} Y{:.3f}</title></circle>\n'.format(
+                            ax, top - ay, int(number), cx, cy, ax, ay))
+        f.write('</svg>\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preview what the MicroPlotter will draw for a G-code file")
+    parser.add_argument('gcode')
+    parser.add_argument('-o', '--output', help="PNG or SVG file to write, by extension")
+    parser.add_argument('--steps-per-mm', type=float, default=plotter.STEPS_PER_MM)
+    parser.add_argument('--scale', type=float, default=10.0, help="PNG pixels per mm")
+    parser.add_argument('--travel', action='store_true', help="draw pen-up moves too")
+    parser.add_argument('--drift-steps', type=float, default=1.0,
+                        help="flag lines this many steps or more from where they asked to go")
+    parser.add_argument('--show', type=int, default=10, help="drifted lines to list")
+    parser.add_argument('--width', type=float, default=plotter.WORK_AREA_MM[0], help="work area, mm")
+    parser.add_argument('--height', type=float, default=plotter.WORK_AREA_MM[1], help="work area, mm")
+    parser.add_argument('--endstops', type=int, nargs=2, choices=(-1, 1), default=plotter.HOME, metavar=('X', 'Y'),
+                        help="endstop_direction of the X and Y motors, default %(default)s")
+    args = parser.parse_args(argv)
+    envelope = plotter.envelope((args.width, args.height), args.endstops)
+
+    started = time.perf_counter()
+    preview = load(args.gcode, args.steps_per_mm)
+    ran = time.perf_counter() - started
+    limit_mm = args.drift_steps / args.steps_per_mm
+    if args.output:
+        if args.output.lower().endswith('.svg'):
+            write_svg(args.output, preview, args.travel, limit_mm, envelope=envelope)
+        else:
+            write_png(args.output, render_png(preview, args.scale, args.travel, limit_mm, envelope))
+    elapsed = time.perf_counter() - started
+
+    print("{}: {} lines, {} X/Y moves, {:.0f} mm drawn, {:.0f} mm travelled".format(
+        args.gcode, preview.lines, len(preview.line), preview.length_mm(True), preview.length_mm(False)))
+    drift = preview.drift
+    if len(drift):
+        off = np.abs(drift[:, 1:3] - drift[:, 3:5])
+        print("  rounding drift: up to X {:.3f} mm, Y {:.3f} mm; {:.3f}, {:.3f} mm at the end".format(
+            off[:, 0].max(), off[:, 1].max(), drift[-1, 1] - drift[-1, 3], drift[-1, 2] - drift[-1, 4]))
+    drifted = preview.drifted(limit_mm)
+    if len(drifted):
+        print("  {} lines end {:g} step(s) or more from where they asked to go, first at:".format(
+            len(drifted), args.drift_steps))
+        for number, cx, cy, ax, ay in drifted[:args.show].tolist():
+            print("    line {}: asked for X{:.3f} Y{:.3f}, reached X{:.3f} Y{:.3f}".format(int(number), cx, cy, ax, ay))
+    outside = preview.outside(envelope)
+    if len(outside):
+        print("  {} lines move outside X {:g} to {:g}, Y {:g} to {:g} mm and would be refused, first line {}".format(
+            len(outside), *envelope, int(outside[0])))
+    if preview.odd_z:
+        print("  {} Z moves other than 1 up or down lower the pen, first on line {}".format(
+            len(preview.odd_z), preview.odd_z[0]))
+    print("  dry run {:.2f}s, {:.2f}s in all".format(ran, elapsed), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
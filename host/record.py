@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Serial session recorder for the MicroPlotter
+# Sits between a sender (UGS, host/sender.py, a terminal) and the plotter:
+# it opens a pty for the sender to connect to, passes bytes both ways and
+# logs every chunk with the time it arrived. host/replay.py plays the
+# recording back against the simulated firmware.
+#
+#   python host/record.py /dev/ttyACM0 session.jsonl --link /tmp/plotter
+#
+# then point the sender at /tmp/plotter. Ctrl-C ends the recording.
+#
+# A session file has one JSON object per line: "t" seconds since the
+# recording started, "dir" "in" (to the plotter) or "out" (from it) and
+# "data" the bytes as a latin-1 string.
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import sender
+
+
+def load(path):
+    """Read a session file as a list of (seconds, dir, bytes)."""
+    events = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                events.append((event['t'], event['dir'], event['data'].encode('latin-1')))
+    return events
+
+
+class Recorder:
+    """Writes timestamped chunks to a session file, from either direction."""
+
+    def __init__(self, f):
+        self.f = f
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.chunks = {'in': 0, 'out': 0}
+        self.bytes = {'in': 0, 'out': 0}
+
+    def log(self, direction, data):
+        t = time.perf_counter() - self.started
+        event = {'t': round(t, 6), 'dir': direction, 'data': data.decode('latin-1')}
+        with self.lock:
+            self.f.write(json.dumps(event) + '\n')
+            self.f.flush()  # keep what was recorded if the recorder is killed
+            self.chunks[direction] += 1
+            self.bytes[direction] += len(data)
+
+
+def _from_plotter(port, master, recorder, stop):
+    while not stop.is_set():
+        data = port.read(getattr(port, 'in_waiting', 0) or 1)
+        if data:
+            recorder.log('out', data)
+            os.write(master, data)
+
+
+def _to_plotter(port, master, recorder, stop):
+    import select
+    while not stop.is_set():
+        if not select.select([master], [], [], 0.05)[0]:
+            continue
+        try:
+            data = os.read(master, 4096)
+        except OSError:  # the sender closed its end
+            time.sleep(0.05)
+            continue
+        if data:
+            recorder.log('in', data)
+            port.write(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record a serial session with the MicroPlotter")
+    parser.add_argument('port', help="the plotter's serial port")
+    parser.add_argument('session', help="session file to write")
+    parser.add_argument('--baud', type=int, default=sender.BAUD_RATE)
+    parser.add_argument('--link', help="also make a symlink to the pty here")
+    args = parser.parse_args(argv)
+
+    import pty
+    import tty
+    port = sender.open_port(args.port, args.baud)
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(path, args.link)
+    print("recording; connect the sender to", args.link or path, file=sys.stderr)
+
+    stop = threading.Event()
+    with open(args.session, 'w') as f:
+        recorder = Recorder(f)
+        threads = [threading.Thread(target=pump, args=(port, master, recorder, stop), daemon=True)
+                   for pump in (_from_plotter, _to_plotter)]
+        for thread in threads:
+            thread.start()
+        try:
+            while all(thread.is_alive() for thread in threads):
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            pass
+        stop.set()
+        for thread in threads:
+            thread.join(1.0)
+
+    port.close()
+    if args.link and os.path.islink(args.link):
+        os.unlink(args.link)
+    print("{} chunks ({} bytes) in, {} chunks ({} bytes) out".format(
+        recorder.chunks['in'], recorder.bytes['in'], recorder.chunks['out'], recorder.bytes['out']),
+        file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
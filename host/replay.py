@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Replay recorded serial sessions against the simulated firmware
+# Feeds the input of a session recorded with host/record.py into the real
+# controller code (see host/sim.py), each chunk at the time it arrived in
+# the recording, and compares what the firmware answers now with what it
+# answered then. A directory of sessions makes a regression suite: the
+# exit status is 1 if any replay differs. Per-command latency, from a
+# line arriving to its 'ok', 'error' or 'ALARM', is reported for the
+# recording and the replay side by side. Replayed times count the
+# firmware's step delays but not the Pico's processing time.
+#
+#   python host/replay.py session.jsonl
+#   python host/replay.py host/sessions/
+#   python host/replay.py session.jsonl --strict    # status reports must match too
+#
+# Record sessions from a freshly reset plotter (host/sender.py sends the
+# reset itself); the simulator always starts at power on.
+
+import argparse
+import collections
+import difflib
+import json
+import os
+import re
+import sys
+import time
+
+import plotter
+import record
+import sender
+import sim
+
+REPLIES = ('ok', 'error', 'ALARM')
+STATUS = re.compile(r'<[^<>\r\n]*>')
+
+
+def text_lines(events, direction):
+    """The lines sent one way in a session, without line endings."""
+    data = b''.join(chunk for _, d, chunk in events if d == direction)
+    return [line.rstrip('\r') for line in data.decode('latin-1').split('\n')]
+
+
+def comparable(lines, strict=False):
+    """Lines worth comparing: status reports depend on timing unless strict.
+
+    Binary mode replies have no line endings, so a report can follow them
+    on the same line.
+    """
+    if not strict:
+        lines = [STATUS.sub('', line) for line in lines]
+    return [line for line in lines if line]
+
+
+def kind(line):
+    """Group a command for the latency table: 'G1', '$J', '$N=' and so on."""
+    if line.startswith('$'):
+        return '$N=' if line[1:2].isdigit() else line[:2]
+    words = line.split()
+    return words[0].upper() if words else line
+
+
+def latencies(events):
+    """(kind, seconds) for every acknowledged command, in order.
+
+    Commands are paired with replies first in, first out, as GRBL answers
+    them. Pairing stops at '$B': binary records are not lines.
+    """
+    pending = collections.deque()
+    buffers = {'in': bytearray(), 'out': bytearray()}
+    binary = False
+    result = []
+    for t, direction, data in sorted(events, key=lambda e: (e[0], e[1] != 'in')):
+        buffer = buffers[direction]
+        buffer += data
+        while b'\n' in buffer:
+            end = buffer.index(b'\n') + 1
+            line = buffer[:end].decode('latin-1').strip('\r\n')
+            del buffer[:end]
+            if direction == 'in':
+                if binary or line in ('', '?', '\x18'):
+                    continue
+                pending.append((t, line))
+                binary = line == '$B'
+            elif line.startswith(REPLIES) and pending:
+                sent, command = pending.popleft()
+                result.append((kind(command), t - sent))
+    return result
+
+
+def home_cycles(events, default=sim.HOME_CYCLES):
+    """Endstop distances that reproduce the first homing in a recording.
+
+    $H reports every coil cycle it moves towards each endstop.
+    """
+    lines = text_lines(events, 'out')
+    if '[MSG:Homing...]' not in lines:
+        return default
+    start = lines.index('[MSG:Homing...]')
+    end = lines.index('ok', start) if 'ok' in lines[start:] else len(lines)
+    homing = lines[start:end]
+    return homing.count('[MSG: Moving X]'), homing.count('[MSG: Moving Y]')
+
+
+def replay(events, steps_per_mm=plotter.STEPS_PER_MM, home=None):
+    """Run a session's input through the simulator; returns its output events."""
+    sim.clock.us = 0
+    chunks = [(int(round(t * 1e6)), data) for t, direction, data in events if direction == 'in']
+    stream = sim.ScheduledStream(chunks)
+    simulator = sim.Simulator(stream, steps_per_mm, home or home_cycles(events))
+    try:
+        while not stream.finished:
+            simulator.step()
+    except sim.EndOfSession:
+        pass  # the session ended in the middle of a line or a binary record
+    return [(us / 1e6, 'out', data) for us, data in stream.output]
+
+
+def latency_table(recorded, replayed):
+    """Rows of per-kind latency statistics in ms, recorded then replayed."""
+    rows = []
+    kinds = sorted(set(k for k, _ in recorded) | set(k for k, _ in replayed))
+    for name in kinds:
+        row = [name]
+        for pairs in (recorded, replayed):
+            values = sorted(s * 1000 for k, s in pairs if k == name)
+            row += [len(values), sender.percentile(values, 50), sender.percentile(values, 95),
+                    values[-1] if values else 0.0]
+        rows.append(row)
+    return rows
+
+
+def sessions(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.jsonl'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded sessions against the simulated firmware")
+    parser.add_argument('sessions', nargs='+', help="session files or directories of them")
+    parser.add_argument('--strict', action='store_true', help="compare status reports as well")
+    parser.add_argument('--steps-per-mm', type=float, default=plotter.STEPS_PER_MM)
+    parser.add_argument('--home', type=int, nargs=2, metavar=('X', 'Y'),
+                        help="coil cycles to the endstops, default from the recording's first $H")
+    parser.add_argument('--context', type=int, default=40, help="diff lines to show per session")
+    parser.add_argument('--json', action='store_true', help="print the latency table as JSON")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    recorded_latency = []
+    replayed_latency = []
+    for path in sessions(args.sessions):
+        events = record.load(path)
+        started = time.perf_counter()
+        output = replay(events, args.steps_per_mm, args.home)
+        elapsed = time.perf_counter() - started
+
+        expected = comparable(text_lines(events, 'out'), args.strict)
+        got = comparable(text_lines(output, 'out'), args.strict)
+        duration = max((t for t, _, _ in events), default=0.0)
+        status = "ok" if got == expected else "DIFFERS"
+        print("{}: {} ({} lines, {:.1f}s session replayed in {:.2f}s)".format(
+            path, status, len(expected), duration, elapsed))
+        if got != expected:
+            failed += 1
+            diff = list(difflib.unified_diff(expected, got, 'recorded', 'replayed', lineterm=''))
+            for line in diff[:args.context]:
+                print("    " + line)
+            if len(diff) > args.context:
+                print("    ... {} more diff lines".format(len(diff) - args.context))
+
+        recorded_latency += latencies(events)
+        replayed_latency += latencies([e for e in events if e[1] == 'in'] + output)
+
+    rows = latency_table(recorded_latency, replayed_latency)
+    if args.json:
+        keys = ('count', 'p50_ms', 'p95_ms', 'max_ms')
+        print(json.dumps({row[0]: {'recorded': dict(zip(keys, row[1:5])), 'replayed': dict(zip(keys, row[5:]))}
+                          for row in rows}, indent=1))
+    elif rows:
+        print("{:<6} {:>6} {:>9} {:>9} {:>9}   {:>6} {:>9} {:>9} {:>9}".format(
+            'ms', 'rec n', 'p50', 'p95', 'max', 'sim n', 'p50', 'p95', 'max'))
+        for row in rows:
+            print("{:<6} {:>6} {:>9.2f} {:>9.2f} {:>9.2f}   {:>6} {:>9.2f} {:>9.2f} {:>9.2f}".format(*row))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
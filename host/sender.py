@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# G-code streaming client for the MicroPlotter serial firmware (test_usb.py)
+# Wakes the firmware with the '?' handshake it expects, asks for its
+# receive buffer size with '$I' and then streams a file. When a buffer is
+# advertised the sender keeps as many lines in flight as fit in it
+# (GRBL's character counting protocol), otherwise it sends one line and
+# waits for its 'ok'.
+#
+#   python host/sender.py /dev/ttyACM0 drawing.gcode
+#   python host/sender.py /dev/ttyUSB0 drawing.gcode --flow rtscts   # grbl.py's UART
+#
+# Uses pyserial when it is installed. Without it, POSIX serial ports and
+# ptys (such as a simulator's) are opened directly.
+
+import argparse
+import collections
+import os
+import sys
+import time
+
+BAUD_RATE = 115200
+HANDSHAKE_TIMEOUT_S = 5.0
+
+
+class SenderError(Exception):
+    pass
+
+
+class _PosixPort:
+    """Minimal pyserial stand-in for a tty or pty on POSIX systems."""
+
+    def __init__(self, path, baud, flow=None):
+        import termios
+        import tty
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, 'B{}'.format(baud), None)
+        if speed is not None:
+            attrs[4] = attrs[5] = speed
+        if flow == 'rtscts':
+            attrs[2] |= termios.CRTSCTS
+        elif flow == 'xonxoff':
+            attrs[0] |= termios.IXON  # the firmware's XOFF stops our output
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+    def read(self, size=1, timeout=0.05):
+        import select
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return b''
+        try:
+            return os.read(self.fd, max(size, 1024))
+        except BlockingIOError:
+            return b''
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                import select
+                select.select([], [self.fd], [], 1.0)
+        return len(data)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_port(path, baud=BAUD_RATE, flow=None):
+    """Open a serial port; flow is None, 'rtscts' or 'xonxoff'."""
+    try:
+        import serial
+    except ImportError:
+        return _PosixPort(path, baud, flow)
+    return serial.Serial(path, baud, timeout=0.05, write_timeout=5,
+                         rtscts=flow == 'rtscts', xonxoff=flow == 'xonxoff')
+
+
+def clean_line(line):
+    """Strip comments and whitespace, returning '' for lines not worth sending."""
+    line = line.split(';', 1)[0]
+    while '(' in line:
+        start = line.index('(')
+        end = line.find(')', start)
+        line = line[:start] + (line[end + 1:] if end >= 0 else '')
+    return line.strip()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Stats:
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.latencies = []  # seconds from write to 'ok'/'error', per line
+        self.errors = []     # (line number, line, response)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self):
+        elapsed = self.elapsed or 1e-9
+        latencies = sorted(self.latencies)
+        return {
+            'lines': self.lines,
+            'errors': len(self.errors),
+            'elapsed_s': round(self.elapsed, 3),
+            'lines_per_s': round(self.lines / elapsed, 1),
+            'bytes_per_s': round(self.bytes / elapsed, 1),
+            'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'latency_p90_ms': round(percentile(latencies, 90) * 1000, 2),
+            'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'latency_max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        }
+
+
+class Sender:
+    """Streams G-code to the firmware over an open serial port.
+
+    port needs read(size) and write(data), as pyserial's Serial has.
+    rx_buffer overrides what the firmware advertises; 0 forces
+    send-and-wait.
+    """
+
+    def __init__(self, port, rx_buffer=None, timeout=None, echo=None):
+        self.port = port
+        self.rx_buffer = rx_buffer
+        self.timeout = timeout  # seconds without a response before giving up
+        self.echo = echo        # called with every line the firmware sends
+        self.banner = None
+        self.options = None
+        self._pending = b''
+
+    # --- line level I/O -------------------------------------------------
+
+    def write_line(self, line):
+        data = (line + '\n').encode()
+        self.port.write(data)
+        return len(data)
+
+    def read_line(self, timeout=None):
+        """Return the next response line, or None if timeout expires."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            newline = self._pending.find(b'\n')
+            if newline >= 0:
+                line = self._pending[:newline].decode('utf-8', 'replace').strip('\r')
+                self._pending = self._pending[newline + 1:]
+                if self.echo:
+                    self.echo(line)
+                return line
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            # read what has arrived, or block briefly for the next byte
+            chunk = self.port.read(getattr(self.port, 'in_waiting', 0) or 1)
+            if chunk:
+                self._pending += chunk
+
+    def read_raw(self, timeout=None):
+        """Return the bytes received so far, waiting up to timeout for some."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self._pending:
+            if deadline is not None and time.perf_counter() > deadline:
+                return b''
+            self._pending = self.port.read(getattr(self.port, 'in_waiting', 0) or 1)
+        data, self._pending = self._pending, b''
+        return data
+
+    def command(self, line, timeout=HANDSHAKE_TIMEOUT_S):
+        """Send a line and return the responses before its 'ok'."""
+        self.write_line(line)
+        replies = []
+        while True:
+            reply = self.read_line(timeout)
+            if reply is None:
+                raise SenderError("no response to {!r}".format(line))
+            if reply == 'ok':
+                return replies
+            if reply.startswith(('error', 'ALARM')):
+                raise SenderError("{!r}: {}".format(line, reply))
+            replies.append(reply)
+
+    # --- session --------------------------------------------------------
+
+    def handshake(self, timeout=HANDSHAKE_TIMEOUT_S):
+        """Wake the firmware and learn its receive buffer size.
+
+        test_usb.py only prints its banner after two '?' in quick
+        succession, and a soft reset line makes it forget any earlier
+        session, so both are sent before waiting for the banner.
+        """
+        self._pending = b''
+        self.port.write(b'\x18\n?\n?\n')
+        deadline = time.perf_counter() + timeout
+        while self.banner is None:
+            reply = self.read_line(max(0.0, deadline - time.perf_counter()))
+            if reply is None:
+                raise SenderError("no banner from the firmware")
+            if reply.startswith('Grbl'):
+                self.banner = reply
+
+        # '$I' reports '[OPT:...,<blocks>,<rx buffer>]' like GRBL does;
+        # the 'ok' also shows the status lines after the banner are done
+        for reply in self.command('$I', timeout):
+            if reply.startswith('[OPT:'):
+                self.options = reply[5:].rstrip(']').split(',')
+        if self.rx_buffer is None:
+            self.rx_buffer = 0
+            if self.options and len(self.options) >= 2 and self.options[-1].isdigit():
+                self.rx_buffer = int(self.options[-1])
+        return self.banner
+
+    def stream(self, lines, progress=None):
+        """Send every line and wait for all of them to be acknowledged.
+
+        lines is any iterable of G-code lines. progress, if given, is
+        called with the Stats object about once a second. Returns Stats.
+        """
+        stats = Stats()
+        in_flight = collections.deque()  # (bytes, sent time, line number, line)
+        buffered = 0
+        limit = self.rx_buffer or 0
+        last_progress = stats.started
+
+        def acknowledge():
+            nonlocal buffered
+            reply = self.read_line(self.timeout)
+            if reply is None:
+                raise SenderError("timed out waiting for line {}".format(in_flight[0][2]))
+            if reply == 'ok' or reply.startswith(('error', 'ALARM')):
+                size, sent, number, line = in_flight.popleft()
+                buffered -= size
+                stats.latencies.append(time.perf_counter() - sent)
+                if reply != 'ok':
+                    stats.errors.append((number, line, reply))
+                    if reply.startswith('ALARM'):
+                        raise SenderError("line {}: {}".format(number, reply))
+            # status reports and [MSG...] lines need no action
+
+        for number, raw in enumerate(lines, 1):
+            line = clean_line(raw)
+            if not line:
+                continue
+            size = len(line) + 1
+            # keep the firmware's buffer full but never overflow it; with
+            # no buffer (or a line longer than it) wait for every 'ok'
+            while in_flight and buffered + size > limit:
+                acknowledge()
+            sent = time.perf_counter()
+            self.write_line(line)
+            in_flight.append((size, sent, number, line))
+            buffered += size
+            stats.lines += 1
+            stats.bytes += size
+            if progress and sent - last_progress >= 1.0:
+                progress(stats)
+                last_progress = sent
+
+        while in_flight:
+            acknowledge()
+        stats.finished = time.perf_counter()
+        return stats
+
+
+def _format_progress(stats):
+    s = stats.summary()
+    return "{} lines, {} lines/s, p50 {} ms, {} errors".format(
+        s['lines'], s['lines_per_s'], s['latency_p50_ms'], s['errors'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream G-code to the MicroPlotter")
+    parser.add_argument('port', help="serial port or pty, e.g. /dev/ttyACM0")
+    parser.add_argument('gcode', help="G-code file, '-' for stdin")
+    parser.add_argument('--baud', type=int, default=BAUD_RATE)
+    parser.add_argument('--flow', choices=('rtscts', 'xonxoff'),
+                        help="flow control, for a UART rather than the Pico's USB port")
+    parser.add_argument('--rx-buffer', type=int, default=None,
+                        help="override the advertised receive buffer, 0 to send and wait")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="give up after this many seconds without a response")
+    parser.add_argument('-v', '--verbose', action='store_true', help="echo firmware output")
+    parser.add_argument('-q', '--quiet', action='store_true', help="no progress output")
+    args = parser.parse_args(argv)
+
+    echo = (lambda line: print("<", line, file=sys.stderr)) if args.verbose else None
+    port = open_port(args.port, args.baud, args.flow)
+    source = sys.stdin if args.gcode == '-' else open(args.gcode)
+    try:
+        sender = Sender(port, args.rx_buffer, args.timeout, echo)
+        banner = sender.handshake()
+        if not args.quiet:
+            mode = "{} byte buffer".format(sender.rx_buffer) if sender.rx_buffer else "send and wait"
+            print("{} ({})".format(banner, mode), file=sys.stderr)
+        progress = None if args.quiet else (lambda stats: print(_format_progress(stats), file=sys.stderr))
+        stats = sender.stream(source, progress)
+    except SenderError as e:
+        print("error:", e, file=sys.stderr)
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        port.close()
+
+    for number, line, reply in stats.errors:
+        print("line {}: {} -> {}".format(number, line, reply), file=sys.stderr)
+    for key, value in stats.summary().items():
+        print("{}: {}".format(key, value))
+    return 1 if stats.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# Simulated MicroPlotter serial firmware
+# Runs the real firmware modules (controller.py, gcode_interpreter.py,
+# stepper.py, binary_protocol.py) under CPython. time, machine and
+# micropython are replaced with stand-ins: the firmware's sleep_us calls
+# advance a virtual clock instead of waiting, coil patterns are counted
+# to track where each motor is, and the endstops close a set number of
+# steps from where the motors start.
+#
+#   python host/sim.py                  # serve a simulated plotter on a pty
+#   python host/sim.py --link /tmp/plotter
+#   python host/sim.py --dual-core      # step on a thread, as test_usb.py does
+#
+# The pty mode runs in real time so that UGS or host/sender.py can talk
+# to it; host/replay.py drives the same simulator on the virtual clock.
+# Import this module before any firmware module.
+
+import argparse
+import collections
+import gc
+import os
+import select
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IDLE_US = 1000         # virtual time an idle pass of the main loop takes
+HOME_CYCLES = (100, 100)  # coil cycles from the start position to the X and Y endstops
+
+
+class EndOfSession(BaseException):
+    """Raised by a stream with no input left, past the firmware's error handling."""
+
+
+class Clock:
+    """Microsecond clock behind ticks_us, ticks_ms and sleep_us.
+
+    Virtual by default: sleeping advances it and nothing else does. A
+    real time clock follows time.perf_counter and really sleeps.
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.us = 0
+        self._started = time.perf_counter()
+
+    def now(self):
+        if self.realtime:
+            return int((time.perf_counter() - self._started) * 1e6)
+        return self.us
+
+    def sleep_us(self, us):
+        if self.realtime:
+            time.sleep(us / 1e6)
+        else:
+            self.us += int(us)
+
+    def advance_to(self, us):
+        if us > self.us:
+            self.us = us
+
+
+clock = Clock()
+
+
+class Pin:
+    """machine.Pin stand-in. An input's level can come from a function."""
+
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+
+    def __init__(self, id, mode=-1, pull=-1):
+        self.id = id
+        self.level = 0
+        self.source = None
+
+    def value(self, level=None):
+        if level is None:
+            return self.source() if self.source else self.level
+        self.level = level
+
+
+def _install():
+    time.ticks_us = lambda: clock.now()
+    time.ticks_ms = lambda: clock.now() // 1000
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, b: a + b
+    time.sleep_us = lambda us: clock.sleep_us(us)
+    time.sleep_ms = lambda ms: clock.sleep_us(ms * 1000)
+    if not hasattr(gc, 'mem_free'):
+        # plenty, so the controller only collects when idle
+        gc.mem_free = lambda: 1 << 20
+        gc.mem_alloc = lambda: 0
+
+    machine = types.ModuleType('machine')
+    machine.Pin = Pin
+    sys.modules.setdefault('machine', machine)
+    micropython = types.ModuleType('micropython')
+    micropython.kbd_intr = lambda chr: None
+    micropython.const = lambda value: value
+    sys.modules.setdefault('micropython', micropython)
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+_install()
+
+from stepper import StepperMotor  # noqa: E402
+from gcode_interpreter import GCodeInterpreter  # noqa: E402
+from profiler import StepProfiler  # noqa: E402
+from controller import GrblController  # noqa: E402
+
+
+class SimMotor(StepperMotor):
+    """A stepper that counts the coil patterns it drives.
+
+    half_steps is the distance moved from the start. With home_cycles the
+    endstop closes once the motor has gone that many coil cycles in its
+    endstop direction.
+    """
+
+    _index = {pattern: i for i, pattern in enumerate(StepperMotor.half_sequence)}
+
+    def __init__(self, *pins, home_cycles=None, **kwargs):
+        super().__init__(*pins, **kwargs)
+        self.half_steps = 0
+        self._last = self.phase
+        if self.endstop is not None and home_cycles is not None:
+            limit = home_cycles * 8
+            self.endstop.source = lambda: int(self.half_steps * self.end_stop_direction >= limit)
+
+    def set_step(self, step):
+        super().set_step(step)
+        index = self._index.get(tuple(step))
+        if index is not None:
+            # phases move by one (half) or two (full) entries either way
+            self.half_steps += (index - self._last + 4) % 8 - 4
+            self._last = index
+
+
+class _Stream:
+    """What the simulated streams share; subclasses say where writes go."""
+
+    name = 'USB'
+    rx_buffer = 128
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._send(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def set_raw(self, raw):
+        pass
+
+
+class ScheduledStream(_Stream):
+    """Input that arrives at set virtual times, for replaying sessions.
+
+    chunks is a sequence of (us, bytes). Reads that would block on the
+    device move the clock on to the next arrival instead.
+    """
+
+    def __init__(self, chunks):
+        self.output = []  # (us, bytes) for every write
+        self.chunks = collections.deque(chunks)
+        self.buffer = bytearray()
+
+    @property
+    def finished(self):
+        return not self.buffer and not self.chunks
+
+    def _arrive(self):
+        chunks = self.chunks
+        while chunks and chunks[0][0] <= clock.us:
+            self.buffer += chunks.popleft()[1]
+
+    def _wait(self):
+        if not self.chunks:
+            return False
+        clock.advance_to(self.chunks[0][0])
+        self._arrive()
+        return True
+
+    def any(self):
+        self._arrive()
+        if not self.buffer and self.chunks:
+            # an idle pass of the main loop
+            clock.advance_to(min(self.chunks[0][0], clock.us + IDLE_US))
+            self._arrive()
+        return len(self.buffer)
+
+    def _send(self, data):
+        self.output.append((clock.us, data))
+
+    def readinto(self, buf):
+        count = 0
+        while count < len(buf):
+            if not self.buffer and not self._wait():
+                raise EndOfSession()
+            take = min(len(buf) - count, len(self.buffer))
+            buf[count:count + take] = self.buffer[:take]
+            del self.buffer[:take]
+            count += take
+        return count
+
+
+class PtyStream(_Stream):
+    """The controller end of a pty, for the real time simulator."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = bytearray()
+
+    def _fill(self, timeout):
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                self.buffer += os.read(self.fd, 4096)
+            except OSError:  # the other end is not open yet
+                time.sleep(timeout)
+
+    def any(self):
+        if not self.buffer:
+            self._fill(IDLE_US / 1e6)
+        return len(self.buffer)
+
+    def readinto(self, buf):
+        while len(self.buffer) < len(buf):
+            self._fill(0.1)
+        buf[:] = self.buffer[:len(buf)]
+        del self.buffer[:len(buf)]
+        return len(buf)
+
+    def _send(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+class Simulator:
+    """The firmware as test_usb.py builds it, on simulated motors and a stream."""
+
+    def __init__(self, stream, steps_per_mm=11, home_cycles=HOME_CYCLES, dual_core=False):
+        self.stream = stream
+        self.motor_y = SimMotor(0, 1, 2, 3, endstop_pin=16, endstop_direction=1, home_cycles=home_cycles[1])
+        self.motor_x = SimMotor(4, 5, 6, 7, endstop_pin=15, endstop_direction=-1, home_cycles=home_cycles[0])
+        self.motor_z = SimMotor(8, 9, 10, 11)
+        self.gcode = GCodeInterpreter(self.motor_x, self.motor_y, self.motor_z)
+        self.gcode.steps_per_mm = steps_per_mm
+        self.controller = GrblController(self.gcode, stream, StepProfiler())
+        if dual_core:
+            # only on the real time clock, the virtual one is not shared safely
+            from motion import StepGenerator
+            self.gcode.stepper = StepGenerator(self.gcode)
+
+    def step(self):
+        """One pass of the main loop; stepper.py's prints go to the stream."""
+        stdout = sys.stdout
+        sys.stdout = self.stream
+        try:
+            return self.controller.step()
+        finally:
+            sys.stdout = stdout
+
+    def run(self):
+        if self.gcode.stepper:
+            self.gcode.stepper.start()
+        self.controller.ready()
+        while True:
+            self.step()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a simulated MicroPlotter on a pty")
+    parser.add_argument('--link', help="also make a symlink to the pty here")
+    parser.add_argument('--steps-per-mm', type=float, default=11)
+    parser.add_argument('--dual-core', action='store_true',
+                        help="make the moves on a second thread with motion.StepGenerator")
+    args = parser.parse_args(argv)
+
+    import pty
+    import tty
+    clock.realtime = True
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(path, args.link)
+    print("simulated plotter on", args.link or path, file=sys.stderr)
+    sys.stderr.flush()
+    try:
+        Simulator(PtyStream(master), args.steps_per_mm, dual_core=args.dual_core).run()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
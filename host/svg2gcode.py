@@ -0,0 +1,647 @@
+#!/usr/bin/env python3
+# SVG to G-code converter for the MicroPlotter
+# Runs on the host, not the Pico. Paths are flattened into polylines with
+# NumPy, clipped to the work area, snapped to whole motor steps and written
+# as G-code that GCodeInterpreter understands (G90, Z1 pen up, Z0 pen down).
+# The work area is where the firmware's soft limits put it: each axis runs
+# away from its endstop (--endstops), so with the Y endstop at the +Y end
+# the drawing is moved down to negative Y.
+#
+#   python host/svg2gcode.py drawing.svg -o drawing.gcode
+#
+# Requires numpy.
+
+import argparse
+import math
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import plotter
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)  # a, b, c, d, e, f as in SVG matrix()
+
+_UNITS_MM = {'mm': 1.0, 'cm': 10.0, 'in': 25.4, 'pt': 25.4 / 72, 'pc': 25.4 / 6,
+             'px': 25.4 / 96, '': 25.4 / 96}
+
+_number = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_path_token = re.compile(r'([MmZzLlHhVvCcSsQqTtAa])|(' + _number + r')')
+_number_re = re.compile(_number)
+_transform_re = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+_length_re = re.compile(r'\s*(' + _number + r')\s*([a-z%]*)')
+_fill_re = re.compile(r'(?:^|;)\s*fill\s*:\s*([^;]*)')
+
+
+# --- transforms -------------------------------------------------------------
+
+def multiply(m, n):
+    """Return the affine transform applying n first, then m."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + c * B, b * A + d * B,
+            a * C + c * D, b * C + d * D,
+            a * E + c * F + e, b * E + d * F + f)
+
+
+def parse_transform(text):
+    m = IDENTITY
+    for name, args in _transform_re.findall(text or ''):
+        v = [float(x) for x in _number_re.findall(args)]
+        if name == 'matrix' and len(v) == 6:
+            t = tuple(v)
+        elif name == 'translate':
+            t = (1, 0, 0, 1, v[0], v[1] if len(v) > 1 else 0)
+        elif name == 'scale':
+            t = (v[0], 0, 0, v[1] if len(v) > 1 else v[0], 0, 0)
+        elif name == 'rotate':
+            r = math.radians(v[0])
+            t = (math.cos(r), math.sin(r), -math.sin(r), math.cos(r), 0, 0)
+            if len(v) == 3:
+                t = multiply(multiply((1, 0, 0, 1, v[1], v[2]), t), (1, 0, 0, 1, -v[1], -v[2]))
+        elif name == 'skewX':
+            t = (1, 0, math.tan(math.radians(v[0])), 1, 0, 0)
+        elif name == 'skewY':
+            t = (1, math.tan(math.radians(v[0])), 0, 1, 0, 0)
+        else:
+            continue
+        m = multiply(m, t)
+    return m
+
+
+def parse_length(text, default=None):
+    """Return an SVG length in millimetres, or default if it has no usable unit."""
+    match = _length_re.match(text or '')
+    if not match or match.group(2) not in _UNITS_MM:
+        return default
+    return float(match.group(1)) * _UNITS_MM[match.group(2)]
+
+
+# --- path geometry ----------------------------------------------------------
+
+class PathBuilder:
+    """Collects every segment of a document as a cubic bezier.
+
+    Lines are stored as cubics flagged so they are sampled once; quadratics
+    are degree elevated and arcs split into cubics of at most 90 degrees,
+    so the whole document can be flattened with one vectorised evaluation.
+    """
+
+    def __init__(self):
+        self.cubics = []     # x0 y0 x1 y1 x2 y2 x3 y3, flattened
+        self.is_line = []
+        self.subpath = []    # subpath index of each cubic
+        self.matrices = []   # transform of each subpath
+        self.closed = []
+        self.elements = []   # element each subpath came from, by document order
+        self.element = -1
+        self.filled = []     # whether each subpath's element is painted with a fill
+        self.fill = True
+        self._current = -1
+
+    def start(self, matrix):
+        self._current = len(self.matrices)
+        self.matrices.append(matrix)
+        self.closed.append(False)
+        self.elements.append(self.element)
+        self.filled.append(self.fill)
+
+    def line(self, x0, y0, x1, y1):
+        self.cubics.extend((x0, y0, x0, y0, x1, y1, x1, y1))
+        self.is_line.append(True)
+        self.subpath.append(self._current)
+
+    def cubic(self, x0, y0, x1, y1, x2, y2, x3, y3):
+        self.cubics.extend((x0, y0, x1, y1, x2, y2, x3, y3))
+        self.is_line.append(False)
+        self.subpath.append(self._current)
+
+    def quadratic(self, x0, y0, x1, y1, x2, y2):
+        self.cubic(x0, y0, x0 + 2 / 3 * (x1 - x0), y0 + 2 / 3 * (y1 - y0),
+                   x2 + 2 / 3 * (x1 - x2), y2 + 2 / 3 * (y1 - y2), x2, y2)
+
+    def arc(self, x0, y0, rx, ry, rotation, large, sweep, x, y):
+        # endpoint to centre parameterisation, SVG 1.1 appendix F.6
+        if (x0, y0) == (x, y):
+            return
+        rx, ry = abs(rx), abs(ry)
+        if not rx or not ry:
+            self.line(x0, y0, x, y)
+            return
+        phi = math.radians(rotation)
+        cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+        dx, dy = (x0 - x) / 2, (y0 - y) / 2
+        x1p = cos_phi * dx + sin_phi * dy
+        y1p = -sin_phi * dx + cos_phi * dy
+        scale = x1p * x1p / (rx * rx) + y1p * y1p / (ry * ry)
+        if scale > 1:
+            rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+        num = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+        den = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+        coef = math.sqrt(max(num / den, 0)) * (-1 if large == sweep else 1)
+        cxp, cyp = coef * rx * y1p / ry, -coef * ry * x1p / rx
+        cx = cos_phi * cxp - sin_phi * cyp + (x0 + x) / 2
+        cy = sin_phi * cxp + cos_phi * cyp + (y0 + y) / 2
+        theta = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+        delta = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx) - theta
+        if sweep and delta < 0:
+            delta += 2 * math.pi
+        elif not sweep and delta > 0:
+            delta -= 2 * math.pi
+
+        pieces = max(1, math.ceil(abs(delta) / (math.pi / 2)))
+        step = delta / pieces
+        k = 4 / 3 * math.tan(step / 4)
+
+        def point(angle):
+            ca, sa = math.cos(angle), math.sin(angle)
+            return (cx + rx * ca * cos_phi - ry * sa * sin_phi,
+                    cy + rx * ca * sin_phi + ry * sa * cos_phi,
+                    -rx * sa * cos_phi - ry * ca * sin_phi,
+                    -rx * sa * sin_phi + ry * ca * cos_phi)
+
+        px, py, tx, ty = x0, y0, *point(theta)[2:]
+        for i in range(1, pieces + 1):
+            angle = theta + step * i
+            qx, qy, ux, uy = point(angle)
+            if i == pieces:
+                qx, qy = x, y
+            self.cubic(px, py, px + k * tx, py + k * ty, qx - k * ux, qy - k * uy, qx, qy)
+            px, py, tx, ty = qx, qy, ux, uy
+
+    def close(self, x0, y0, x1, y1):
+        if (x0, y0) != (x1, y1):
+            self.line(x0, y0, x1, y1)
+        self.closed[self._current] = True
+
+
+class _Tokens:
+    def __init__(self, d):
+        self.items = [cmd or float(num) for cmd, num in _path_token.findall(d)]
+        self.pos = 0
+
+    def number(self):
+        value = self.items[self.pos]
+        self.pos += 1
+        return value
+
+    def flag(self):
+        value = self.number()
+        if value not in (0.0, 1.0):
+            raise ValueError("bad arc flag {}".format(value))
+        return int(value)
+
+
+def _split_flags(d):
+    # arc flags may be packed against the next number, "a5 5 0 0150 20" is
+    # rx 5, ry 5, rotation 0, flags 0 and 1 then 50 20, which the tokenizer
+    # would read as the single number 150
+    def fix(match):
+        numbers = _number_re.findall(match.group(2))
+        out = []
+        i = 0
+        while i < len(numbers):
+            n = numbers[i]
+            if len(out) % 7 in (3, 4) and len(n) > 1 and n[0] in '01' and n[1] != '.':
+                out.append(n[0])
+                numbers[i] = n[1:]
+            else:
+                out.append(n)
+                i += 1
+        return match.group(1) + ' '.join(out) + ' '
+    return re.sub(r'([Aa])([^MmZzLlHhVvCcSsQqTtAa]*)', fix, d)
+
+
+def add_path(builder, d, matrix):
+    tokens = _Tokens(_split_flags(d) if 'a' in d or 'A' in d else d)
+    x = y = sx = sy = 0.0
+    last_control = None  # for S/T reflections
+    command = None
+    started = False
+    while tokens.pos < len(tokens.items):
+        item = tokens.items[tokens.pos]
+        if isinstance(item, str):
+            command = item
+            tokens.pos += 1
+        elif command is None:
+            raise ValueError("path data must start with a command")
+        relative = command.islower()
+        c = command.upper()
+        ox, oy = (x, y) if relative else (0.0, 0.0)
+
+        if c == 'Z':
+            if started:
+                builder.close(x, y, sx, sy)
+            x, y = sx, sy
+            last_control = None
+            command = None
+            started = False
+            continue
+        if c != 'M' and not started:
+            builder.start(matrix)  # drawing straight after a closepath
+            sx, sy = x, y
+            started = True
+
+        if c == 'M':
+            x, y = ox + tokens.number(), oy + tokens.number()
+            sx, sy = x, y
+            builder.start(matrix)
+            started = True
+            command = 'l' if relative else 'L'  # implicit lineto
+            last_control = None
+        elif c == 'L':
+            nx, ny = ox + tokens.number(), oy + tokens.number()
+            builder.line(x, y, nx, ny)
+            x, y, last_control = nx, ny, None
+        elif c == 'H':
+            nx = ox + tokens.number()
+            builder.line(x, y, nx, y)
+            x, last_control = nx, None
+        elif c == 'V':
+            ny = oy + tokens.number()
+            builder.line(x, y, x, ny)
+            y, last_control = ny, None
+        elif c in 'CS':
+            if c == 'C':
+                x1, y1 = ox + tokens.number(), oy + tokens.number()
+            elif last_control and last_control[0] == 'C':
+                x1, y1 = 2 * x - last_control[1], 2 * y - last_control[2]
+            else:
+                x1, y1 = x, y
+            x2, y2 = ox + tokens.number(), oy + tokens.number()
+            nx, ny = ox + tokens.number(), oy + tokens.number()
+            builder.cubic(x, y, x1, y1, x2, y2, nx, ny)
+            x, y, last_control = nx, ny, ('C', x2, y2)
+        elif c in 'QT':
+            if c == 'Q':
+                x1, y1 = ox + tokens.number(), oy + tokens.number()
+            elif last_control and last_control[0] == 'Q':
+                x1, y1 = 2 * x - last_control[1], 2 * y - last_control[2]
+            else:
+                x1, y1 = x, y
+            nx, ny = ox + tokens.number(), oy + tokens.number()
+            builder.quadratic(x, y, x1, y1, nx, ny)
+            x, y, last_control = nx, ny, ('Q', x1, y1)
+        elif c == 'A':
+            rx, ry, rotation = tokens.number(), tokens.number(), tokens.number()
+            large, sweep = tokens.flag(), tokens.flag()
+            nx, ny = ox + tokens.number(), oy + tokens.number()
+            builder.arc(x, y, rx, ry, rotation, large, sweep, nx, ny)
+            x, y, last_control = nx, ny, None
+        else:
+            raise ValueError("unknown path command {}".format(command))
+
+
+def _points(text):
+    return [float(v) for v in _number_re.findall(text or '')]
+
+
+def _attr(element, name, default=0.0):
+    value = element.get(name)
+    if value is None:
+        return default
+    match = _number_re.match(value.strip())
+    return float(match.group(0)) if match else default
+
+
+def add_element(builder, element, matrix):
+    tag = element.tag.rsplit('}', 1)[-1]
+    if tag == 'path':
+        add_path(builder, element.get('d', ''), matrix)
+    elif tag == 'line':
+        builder.start(matrix)
+        builder.line(_attr(element, 'x1'), _attr(element, 'y1'), _attr(element, 'x2'), _attr(element, 'y2'))
+    elif tag in ('polyline', 'polygon'):
+        v = _points(element.get('points'))
+        v = v[:len(v) // 2 * 2]
+        if len(v) < 4:
+            return
+        builder.start(matrix)
+        for i in range(2, len(v), 2):
+            builder.line(v[i - 2], v[i - 1], v[i], v[i + 1])
+        if tag == 'polygon':
+            builder.close(v[-2], v[-1], v[0], v[1])
+    elif tag == 'rect':
+        x, y = _attr(element, 'x'), _attr(element, 'y')
+        w, h = _attr(element, 'width'), _attr(element, 'height')
+        if w <= 0 or h <= 0:
+            return
+        rx, ry = element.get('rx'), element.get('ry')
+        rx = _attr(element, 'rx') if rx is not None else (_attr(element, 'ry') if ry is not None else 0)
+        ry = _attr(element, 'ry') if ry is not None else rx
+        rx, ry = min(rx, w / 2), min(ry, h / 2)
+        if rx and ry:
+            d = ("M{x0},{y} H{x1} A{rx},{ry} 0 0 1 {x2},{y0} V{y1} A{rx},{ry} 0 0 1 {x1},{y2} "
+                 "H{x0} A{rx},{ry} 0 0 1 {x},{y1} V{y0} A{rx},{ry} 0 0 1 {x0},{y} Z").format(
+                x=x, y=y, rx=rx, ry=ry, x0=x + rx, x1=x + w - rx, x2=x + w,
+                y0=y + ry, y1=y + h - ry, y2=y + h)
+            add_path(builder, d, matrix)
+        else:
+            add_path(builder, "M{},{} h{} v{} h{} Z".format(x, y, w, h, -w), matrix)
+    elif tag in ('circle', 'ellipse'):
+        cx, cy = _attr(element, 'cx'), _attr(element, 'cy')
+        if tag == 'circle':
+            rx = ry = _attr(element, 'r')
+        else:
+            rx, ry = _attr(element, 'rx'), _attr(element, 'ry')
+        if rx <= 0 or ry <= 0:
+            return
+        d = "M{},{} A{},{} 0 1 0 {},{} A{},{} 0 1 0 {},{} Z".format(
+            cx + rx, cy, rx, ry, cx - rx, cy, rx, ry, cx + rx, cy)
+        add_path(builder, d, matrix)
+
+
+def _fill(element, inherited):
+    """Whether element is filled: fill is inherited and style overrides the attribute."""
+    match = _fill_re.search(element.get('style') or '')
+    value = match.group(1) if match else element.get('fill')
+    if value is None or value.strip() == 'inherit':
+        return inherited
+    return value.strip() != 'none'
+
+
+def _walk(builder, element, matrix, fill=True):
+    tag = element.tag.rsplit('}', 1)[-1]
+    if tag in ('defs', 'clipPath', 'mask', 'symbol', 'marker', 'pattern', 'title', 'desc', 'metadata', 'style'):
+        return
+    if element.get('display') == 'none':
+        return
+    matrix = multiply(matrix, parse_transform(element.get('transform')))
+    fill = _fill(element, fill)
+    builder.element += 1
+    builder.fill = fill
+    add_element(builder, element, matrix)
+    for child in element:
+        _walk(builder, child, matrix, fill)
+
+
+def document_matrix(root):
+    """Map the SVG user space to millimetres using width, height and viewBox."""
+    box = _points(root.get('viewBox'))
+    width = parse_length(root.get('width'))
+    height = parse_length(root.get('height'))
+    if len(box) == 4 and box[2] > 0 and box[3] > 0:
+        sx = width / box[2] if width else _UNITS_MM['px']
+        sy = height / box[3] if height else sx
+        s = min(sx, sy)
+        return (s, 0, 0, s, -box[0] * s, -box[1] * s), (box[2] * s, box[3] * s)
+    s = _UNITS_MM['px']
+    return (s, 0, 0, s, 0, 0), (width, height)
+
+
+# --- vectorised flattening --------------------------------------------------
+
+def flatten(builder, tolerance=0.05):
+    """Sample every cubic in one pass.
+
+    Returns (points, starts): an (N, 2) array of points in millimetres and
+    a boolean array marking the first point of each polyline.
+    """
+    if not builder.cubics:
+        return np.zeros((0, 2)), np.zeros(0, dtype=bool)
+
+    ctrl = np.asarray(builder.cubics, dtype=np.float64).reshape(-1, 4, 2)
+    subpath = np.asarray(builder.subpath, dtype=np.int64)
+    m = np.asarray(builder.matrices, dtype=np.float64)[subpath]  # (n, 6)
+
+    # transform the control points, beziers are affine invariant
+    x, y = ctrl[..., 0].copy(), ctrl[..., 1].copy()
+    ctrl[..., 0] = m[:, 0, None] * x + m[:, 2, None] * y + m[:, 4, None]
+    ctrl[..., 1] = m[:, 1, None] * x + m[:, 3, None] * y + m[:, 5, None]
+
+    # flatness bound: a cubic split into n chords deviates by at most
+    # max|B''| / (8 n^2) and |B''| <= 6 max(|p0 - 2p1 + p2|, |p1 - 2p2 + p3|)
+    dd = np.maximum(np.hypot(*(ctrl[:, 0] - 2 * ctrl[:, 1] + ctrl[:, 2]).T),
+                    np.hypot(*(ctrl[:, 1] - 2 * ctrl[:, 2] + ctrl[:, 3]).T))
+    n = np.ceil(np.sqrt(6 * dd / (8 * tolerance))).astype(np.int64)
+    n = np.clip(n, 1, 1000)
+    n[np.asarray(builder.is_line)] = 1
+
+    # t = 1/n .. n/n for every cubic, all at once
+    total = int(n.sum())
+    owner = np.repeat(np.arange(len(n)), n)
+    offsets = np.cumsum(n) - n
+    t = (np.arange(total) - offsets[owner] + 1) / n[owner]
+    mt = 1 - t
+    p = ctrl[owner]
+    samples = ((mt ** 3)[:, None] * p[:, 0] + (3 * mt * mt * t)[:, None] * p[:, 1]
+               + (3 * mt * t * t)[:, None] * p[:, 2] + (t ** 3)[:, None] * p[:, 3])
+
+    # each subpath starts with the first control point of its first cubic
+    first = np.ones(len(n), dtype=bool)
+    first[1:] = subpath[1:] != subpath[:-1]
+    insert_at = offsets[first]
+    points = np.insert(samples, insert_at, ctrl[first, 0], axis=0)
+    starts = np.zeros(len(points), dtype=bool)
+    starts[insert_at + np.arange(len(insert_at))] = True
+    return points, starts
+
+
+def clip(points, starts, x_min, x_max, y_min, y_max):
+    """Clip polylines to the rectangle x_min..x_max, y_min..y_max (Liang-Barsky).
+
+    Segments leaving the rectangle end the polyline, segments entering it
+    start a new one.
+    """
+    if len(points) < 2:
+        return points[:0], starts[:0]
+    a, b = points[:-1], points[1:]
+    valid = ~starts[1:]  # segment i joins point i to i + 1 of the same polyline
+    d = b - a
+    t0 = np.zeros(len(a))
+    t1 = np.ones(len(a))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-d[:, 0], a[:, 0] - x_min), (d[:, 0], x_max - a[:, 0]),
+                     (-d[:, 1], a[:, 1] - y_min), (d[:, 1], y_max - a[:, 1])):
+            r = q / p
+            parallel = p == 0
+            valid &= ~(parallel & (q < 0))
+            entering = (p < 0) & ~parallel
+            leaving = (p > 0) & ~parallel
+            t0 = np.where(entering, np.maximum(t0, r), t0)
+            t1 = np.where(leaving, np.minimum(t1, r), t1)
+    valid &= t0 <= t1
+    ca = a + t0[:, None] * d
+    cb = a + t1[:, None] * d
+
+    prev_continues = np.zeros(len(a), dtype=bool)
+    prev_continues[1:] = valid[:-1] & (t1[:-1] >= 1)
+    new = valid & (~prev_continues | (t0 > 0) | starts[:-1])
+
+    index = np.nonzero(valid)[0]
+    pairs = np.stack((ca[index], cb[index]), axis=1)           # (k, 2, 2)
+    keep = np.stack((new[index], np.ones(len(index), dtype=bool)), axis=1)
+    out = pairs[keep]
+    out_starts = np.stack((new[index], np.zeros(len(index), dtype=bool)), axis=1)[keep]
+    return out, out_starts
+
+
+def quantise(points, starts, steps_per_mm):
+    """Snap to whole motor steps and drop repeated points and lone dots."""
+    steps = np.rint(points * steps_per_mm).astype(np.int64)
+    keep = starts.copy()
+    keep[1:] |= np.any(steps[1:] != steps[:-1], axis=1)
+    steps, starts = steps[keep], starts[keep]
+    # a polyline needs at least two points to draw anything
+    ids = np.cumsum(starts) - 1
+    lengths = np.bincount(ids, minlength=int(starts.sum()))
+    keep = lengths[ids] > 1
+    return steps[keep], starts[keep]
+
+
+def split(points, starts):
+    return np.split(points, np.nonzero(starts)[0][1:])
+
+
+def order(polylines, start=(0, 0), limit=20000):
+    """Greedy nearest-neighbour ordering, reversing polylines where it helps.
+
+    Cuts pen-up travel considerably; skipped above limit polylines where the
+    quadratic search stops paying for itself.
+    """
+    if len(polylines) < 2 or len(polylines) > limit:
+        return polylines
+    heads = np.array([p[0] for p in polylines], dtype=np.float64)
+    tails = np.array([p[-1] for p in polylines], dtype=np.float64)
+    sequence, flipped = nearest(heads, tails, start)
+    return [polylines[i][::-1] if flip else polylines[i] for i, flip in zip(sequence, flipped)]
+
+
+def nearest(heads, tails, start=(0, 0)):
+    """Greedy nearest-neighbour tour over paths given by their end points.
+
+    Returns (sequence, flipped): the path indices in drawing order and
+    whether each is drawn from its tail.
+    """
+    remaining = np.ones(len(heads), dtype=bool)
+    position = np.asarray(start, dtype=np.float64)
+    sequence = []
+    flipped = []
+    for _ in range(len(heads)):
+        dh = np.where(remaining, np.sum((heads - position) ** 2, axis=1), np.inf)
+        dt = np.where(remaining, np.sum((tails - position) ** 2, axis=1), np.inf)
+        i, j = int(np.argmin(dh)), int(np.argmin(dt))
+        if dt[j] < dh[i]:
+            sequence.append(j)
+            flipped.append(True)
+            remaining[j] = False
+            position = heads[j]
+        else:
+            sequence.append(i)
+            flipped.append(False)
+            remaining[i] = False
+            position = tails[i]
+    return sequence, flipped
+
+
+# --- output -----------------------------------------------------------------
+
+def to_gcode(polylines, steps_per_mm=plotter.STEPS_PER_MM, home=True):
+    """Yield G-code lines for polylines given in whole steps.
+
+    Uses absolute positioning, G0 with the pen up between polylines and G1
+    with the pen down along them; only axes that change are written.
+    """
+    fmt = plotter.steps_to_gcode
+    up = "G0 Z{}".format(plotter.PEN_UP_Z)
+    down = "G1 Z{}".format(plotter.PEN_DOWN_Z)
+    yield "G90"
+    yield up
+    x = y = None
+    for line in polylines:
+        sx, sy = int(line[0][0]), int(line[0][1])
+        yield "G0 X{} Y{}".format(fmt(sx, steps_per_mm), fmt(sy, steps_per_mm))
+        yield down
+        x, y = sx, sy
+        for nx, ny in line[1:].tolist():
+            words = "G1"
+            if nx != x:
+                words += " X" + fmt(nx, steps_per_mm)
+            if ny != y:
+                words += " Y" + fmt(ny, steps_per_mm)
+            yield words
+            x, y = nx, ny
+        yield up
+    if home:
+        yield "G0 X0 Y0"
+
+
+def load(svg_file, tolerance=0.05, scale=1.0, flip_y=True, offset=(0.0, 0.0), elements=False,
+         work_area=plotter.WORK_AREA_MM, home=plotter.HOME):
+    """Read an SVG file and return (points, starts) in millimetres.
+
+    The points are machine coordinates: the drawing's origin is moved to
+    the low corner of plotter.envelope(work_area, home), where home holds
+    the motors' endstop directions, so it lands inside the firmware's
+    soft limits the right way up. With
+    elements, also returns the document order index of the element each
+    polyline came from and whether that element is filled.
+    """
+    root = ET.parse(svg_file).getroot()
+    matrix, (width, height) = document_matrix(root)
+    builder = PathBuilder()
+    _walk(builder, root, matrix)
+    points, starts = flatten(builder, tolerance / scale)
+    if flip_y and len(points):
+        # SVG y grows down the page, the plotter's grows away from home
+        points[:, 1] = (height or points[:, 1].max()) - points[:, 1]
+    x_min, _, y_min, _ = plotter.envelope(work_area, home)
+    points = points * scale + np.asarray(offset, dtype=np.float64) + (x_min, y_min)
+    if not elements:
+        return points, starts
+    # flatten() makes one polyline per subpath with any segments
+    subpath = np.asarray(builder.subpath, dtype=np.int64)
+    first = np.ones(len(subpath), dtype=bool)
+    first[1:] = subpath[1:] != subpath[:-1]
+    return (points, starts, np.asarray(builder.elements, dtype=np.int64)[subpath[first]],
+            np.asarray(builder.filled, dtype=bool)[subpath[first]])
+
+
+def convert(svg_file, tolerance=0.05, scale=1.0, flip_y=True, offset=(0.0, 0.0),
+            work_area=plotter.WORK_AREA_MM, steps_per_mm=plotter.STEPS_PER_MM, optimise=True,
+            home=plotter.HOME):
+    """Convert an SVG file to a list of polylines in whole steps."""
+    points, starts = load(svg_file, tolerance, scale, flip_y, offset, work_area=work_area, home=home)
+    points, starts = clip(points, starts, *plotter.envelope(work_area, home))
+    steps, starts = quantise(points, starts, steps_per_mm)
+    polylines = split(steps, starts) if len(steps) else []
+    return order(polylines) if optimise else polylines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an SVG drawing to MicroPlotter G-code")
+    parser.add_argument('svg')
+    parser.add_argument('-o', '--output', help="output file, default stdout")
+    parser.add_argument('--tolerance', type=float, default=0.05, help="curve flattening tolerance, mm")
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--offset', type=float, nargs=2, default=(0.0, 0.0), metavar=('X', 'Y'), help="mm")
+    parser.add_argument('--no-flip-y', dest='flip_y', action='store_false')
+    parser.add_argument('--width', type=float, default=plotter.WORK_AREA_MM[0], help="work area, mm")
+    parser.add_argument('--height', type=float, default=plotter.WORK_AREA_MM[1], help="work area, mm")
+    parser.add_argument('--endstops', type=int, nargs=2, choices=(-1, 1), default=plotter.HOME, metavar=('X', 'Y'),
+                        help="endstop_direction of the X and Y motors, default %(default)s")
+    parser.add_argument('--steps-per-mm', type=float, default=plotter.STEPS_PER_MM)
+    parser.add_argument('--no-optimise', dest='optimise', action='store_false', help="keep document order")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    polylines = convert(args.svg, args.tolerance, args.scale, args.flip_y, args.offset,
+                        (args.width, args.height), args.steps_per_mm, args.optimise, args.endstops)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        lines = 0
+        for line in to_gcode(polylines, args.steps_per_mm):
+            out.write(line + '\n')
+            lines += 1
+    finally:
+        if args.output:
+            out.close()
+    print("{} polylines, {} lines of G-code in {:.2f}s".format(
+        len(polylines), lines, time.perf_counter() - started), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+# Background plot jobs
+# Uploaded G-code files are queued and executed one line at a time by a
+# uasyncio task, yielding to the event loop between lines so the web
+# server stays responsive while the plotter is drawing.
+#
+# With a checkpoint.Checkpoint the queue records the running job's
+# progress as it goes. After a power cut or watchdog reset, recover()
+# brings the job back as 'interrupted'; resuming it homes, travels pen
+# up to where the checkpoint was taken and carries on from that line.
+#
+# With a macros.MacroStore, a '$M name' line in a job runs that macro.
+# With a jog.JogQueue, a job waits for the control pad's moves to finish
+# before it starts.
+
+import os, time
+import uasyncio
+from gcode_interpreter import SoftLimitError
+
+JOB_DIR = "jobs"
+MAX_FINISHED_JOBS = 8  # finished jobs kept around for status queries
+CHECK_BATCH = 50  # lines checked between yields to the event loop
+BOM = b'\xef\xbb\xbf'  # some editors start a UTF-8 file with one
+
+
+def _command(line):
+    """The G-code in a line of a job file, read as bytes.
+
+    The check and the run both go through here, so the check passes
+    exactly what will be executed.
+    """
+    if line.startswith(BOM):
+        line = line[3:]
+    return line.split(b';', 1)[0].strip().decode()
+
+
+class Job:
+    def __init__(self, job_id, path, size):
+        self.id = job_id
+        self.path = path
+        self.size = size
+        self.state = 'queued'  # queued, checking, running, paused, interrupted, done, cancelled, failed
+        self.line = 0
+        self.offset = 0
+        self.elapsed_ms = 0  # time spent running, excluding pauses
+        self.error = None
+        self.bounds = None  # x_min, y_min, x_max, y_max in mm, once checked
+        self.restart = None  # the checkpoint to carry on from, for a recovered job
+        self._resumed_at = None
+
+    def percent(self):
+        if not self.size:
+            return 100 if self.state == 'done' else 0
+        return self.offset * 100 // self.size
+
+    def elapsed(self):
+        if self._resumed_at is None:
+            return self.elapsed_ms
+        return self.elapsed_ms + time.ticks_diff(time.ticks_ms(), self._resumed_at)
+
+    def eta_s(self):
+        # assume the rest of the file plots at the same rate as what's done
+        if not self.offset or self.state not in ('running', 'paused'):
+            return None
+        return self.elapsed() * (self.size - self.offset) // self.offset // 1000
+
+    def _start_clock(self):
+        self._resumed_at = time.ticks_ms()
+
+    def _stop_clock(self):
+        self.elapsed_ms = self.elapsed()
+        self._resumed_at = None
+
+    def progress(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'line': self.line,
+            'percent': self.percent(),
+            'elapsed_s': self.elapsed() // 1000,
+            'eta_s': self.eta_s(),
+            'error': self.error,
+            'bounds': self.bounds,
+        }
+
+
+class JobQueue:
+    def __init__(self, gcode, job_dir=JOB_DIR, checkpoint=None, macros=None, pad=None):
+        self.gcode = gcode
+        self.job_dir = job_dir
+        self.checkpoint = checkpoint
+        self.macros = macros
+        self.pad = pad
+        self.jobs = []
+        self.current = None
+        self._next_id = 1
+        try:
+            os.mkdir(job_dir)
+        except OSError:
+            pass  # already exists
+        # files left by a reset keep their ids
+        for name in os.listdir(job_dir):
+            stem = name.split('.')[0]
+            if stem.isdigit() and int(stem) >= self._next_id:
+                self._next_id = int(stem) + 1
+
+    def recover(self):
+        """Bring back the job a reset interrupted, if the checkpoint has one.
+
+        Returns the job, in state 'interrupted', or None.
+        """
+        record = self.checkpoint.load() if self.checkpoint else None
+        if record is None:
+            return None
+        path = "{}/{}.gcode".format(self.job_dir, record['job'])
+        try:
+            size = os.stat(path)[6]
+        except OSError:
+            self.checkpoint.clear()  # the file has gone, nothing to resume
+            return None
+        job = Job(record['job'], path, size)
+        job.state = 'interrupted'
+        job.line = record['line']
+        job.offset = record['offset']
+        job.restart = record
+        self.jobs.append(job)
+        return job
+
+    def add(self, upload_path):
+        """Queue an uploaded G-code file, taking ownership of it."""
+        job_id = self._next_id
+        self._next_id += 1
+        path = "{}/{}.gcode".format(self.job_dir, job_id)
+        os.rename(upload_path, path)
+        job = Job(job_id, path, os.stat(path)[6])
+        self.jobs.append(job)
+        self._forget_finished()
+        return job
+
+    def get(self, job_id):
+        for job in self.jobs:
+            if job.id == job_id:
+                return job
+        return None
+
+    def pause(self, job):
+        if job.state == 'running':
+            job.state = 'paused'
+            return True
+        return False
+
+    def resume(self, job):
+        if job.state == 'paused':
+            job.state = 'running'
+            return True
+        if job.state == 'interrupted':
+            job.state = 'queued'  # run() restarts it from job.restart
+            return True
+        return False
+
+    def cancel(self, job):
+        if job.state in ('queued', 'checking', 'running', 'paused', 'interrupted'):
+            # a running job notices this between lines
+            if job.state in ('queued', 'interrupted'):
+                self._remove_file(job)
+                if job.restart and self.checkpoint:
+                    self.checkpoint.clear()
+            job.state = 'cancelled'
+            return True
+        return False
+
+    def busy(self):
+        """Whether a job is running or waiting to start, so the plotter is spoken for."""
+        if self.current is not None:
+            return True
+        for job in self.jobs:
+            if job.state in ('queued', 'checking'):
+                return True
+        return False
+
+    def _next_job(self):
+        for job in self.jobs:
+            if job.state == 'queued':
+                return job
+        return None
+
+    def _forget_finished(self):
+        finished = [job for job in self.jobs if job.state in ('done', 'cancelled', 'failed')]
+        while len(finished) > MAX_FINISHED_JOBS:
+            self.jobs.remove(finished.pop(0))
+
+    def _remove_file(self, job):
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+    async def run(self):
+        """Background task, start it once with loop.create_task()."""
+        while True:
+            job = self._next_job()
+            if job is None or (self.pad and self.pad.busy()):
+                await uasyncio.sleep_ms(200)
+                continue
+            self.current = job
+            try:
+                await self._execute(job)
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+            finally:
+                job._stop_clock()
+                self.current = None
+                self._remove_file(job)
+                if self.checkpoint:
+                    self.checkpoint.clear()
+
+    async def _check(self, job):
+        """Dry run the whole file before anything moves.
+
+        Replays every line on a motorless copy of the interpreter, so the
+        job starts from the real position and positioning mode, recording
+        the bounding box and failing the job at the first line that would
+        break the soft limits.
+        """
+        job.state = 'checking'
+        shadow = self.gcode.copy()
+        spm = shadow.steps_per_mm
+        position = shadow.position
+        x_min = x_max = position['X']
+        y_min = y_max = position['Y']
+        number = 0
+        with open(job.path, "rb") as f:
+            for line in f:
+                number += 1
+                try:
+                    command = _command(line)
+                except UnicodeError:
+                    raise ValueError("line {}: not UTF-8".format(number))
+                if not command:
+                    continue
+                try:
+                    for move in self._moves(shadow, command):
+                        if move[0] == '$H':
+                            position['X'] = position['Y'] = 0
+                        else:
+                            position['X'] += move[1]
+                            position['Y'] += move[2]
+                            position['Z'] += move[3]
+                        x, y = position['X'], position['Y']
+                        if x < x_min:
+                            x_min = x
+                        elif x > x_max:
+                            x_max = x
+                        if y < y_min:
+                            y_min = y
+                        elif y > y_max:
+                            y_max = y
+                except SoftLimitError as e:
+                    raise SoftLimitError("line {}: {}".format(number, e))
+                if number % CHECK_BATCH == 0:
+                    await uasyncio.sleep_ms(0)
+                    if job.state == 'cancelled':
+                        return False
+        job.bounds = (x_min / spm, y_min / spm, x_max / spm, y_max / spm)
+        return True
+
+    def _moves(self, gcode, command):
+        """The moves a line makes, as plan() returns them.
+
+        A macro's are worked out one at a time, so apply each before
+        asking for the next.
+        """
+        if command.startswith('$M ') and self.macros:
+            return self.macros.plan(command[3:].strip(), gcode)
+        move = gcode.plan(command)
+        return (move,) if move else ()
+
+    def _restore(self, job):
+        """Put the plotter back where a recovered job's checkpoint was taken.
+
+        Lifts the pen if it was down, homes, travels to the checkpoint
+        position and sets the pen and positioning mode as they were.
+        """
+        gcode = self.gcode
+        record = job.restart
+        pen_down = record['position']['Z'] != 1
+        if pen_down:
+            gcode.set_position(Z=0)
+            gcode.execute('G0', 0, 0, 1)
+        else:
+            gcode.set_position(Z=1)
+        gcode.home()
+        x, y = record['position']['X'], record['position']['Y']
+        if gcode.soft_limits:
+            gcode.check_limits(x, y)
+        gcode.execute('G0', x, y, 0)
+        if pen_down:
+            gcode.execute('G1', 0, 0, -1)
+        gcode.set_position(Z=record['position']['Z'])
+        gcode.relative_mode = record['relative']
+
+    async def _execute(self, job):
+        checkpoint = self.checkpoint
+        if job.restart:
+            # checked before the reset, and the check would start from
+            # the wrong place now
+            self._restore(job)
+        elif not await self._check(job):
+            return
+        job.state = 'running'
+        job._start_clock()
+        # bytes, so the offset counts what seek() and os.stat() count
+        with open(job.path, "rb") as f:
+            if job.offset:
+                f.seek(job.offset)
+            for line in f:
+                if job.state == 'paused':
+                    if checkpoint:
+                        # the power may well go off while it is paused
+                        checkpoint.save(job.id, job.offset, job.line, self.gcode, force=True)
+                    job._stop_clock()
+                    while job.state == 'paused':
+                        await uasyncio.sleep_ms(100)
+                    job._start_clock()
+                if job.state == 'cancelled':
+                    return
+
+                job.line += 1
+                job.offset += len(line)
+                command = _command(line)
+                if command.startswith('$M ') and self.macros:
+                    self.macros.run(command[3:].strip(), self.gcode)
+                elif command:
+                    self.gcode.parse_line(command)
+                if checkpoint:
+                    checkpoint.save(job.id, job.offset, job.line, self.gcode)
+
+                # let the web server in between segments
+                await uasyncio.sleep_ms(0)
+        job.offset = job.size
+        job.state = 'done'
@@ -0,0 +1,180 @@
+# Batched, coalescing control commands for the web control pad
+# The pad posts batches of commands: relative jogs, pen up/down, homing,
+# G92, stored macros and G-code lines. A batch is checked on a motorless copy of the
+# interpreter and queued, so the request is answered straight away with
+# the position the plotter will end up at (or an error, with nothing
+# queued). A uasyncio task makes the moves in order. Jogs that arrive
+# within window_ms of each other, in one batch or across several, are
+# added together into a single move while it waits to start, so rapid
+# clicks make one move instead of many short ones. A move that fails
+# empties the queue, the rest of it was planned to follow on from it,
+# and the task carries on with the next batch.
+
+import time
+import uasyncio
+from gcode_interpreter import SoftLimitError
+
+WINDOW_MS = 150      # a jog waits this long for more to merge into it
+MAX_WAIT_MS = 600    # but starts after this long however many keep coming
+MAX_QUEUED = 32      # commands waiting, beyond this batches are refused
+
+JOG = 'jog'
+PEN = 'pen'
+HOME = 'home'
+ZERO = 'zero'
+LINE = 'line'
+MACRO = 'macro'
+
+
+class JogQueue:
+    def __init__(self, gcode, window_ms=WINDOW_MS, max_wait_ms=MAX_WAIT_MS, macros=None):
+        self.gcode = gcode
+        self.macros = macros  # a macros.MacroStore, for {"macro": name}
+        self.window_ms = window_ms
+        self.max_wait_ms = max_wait_ms
+        self.queue = []  # [kind, arg...], the jog at the end may still grow
+        self.moving = False
+        self.merged = 0  # jogs folded into an earlier one, for the curious
+        self.error = None  # the last move that failed, other than a soft limit
+        self._shadow = None
+        self._jog_started = 0  # when the last queued jog was first queued
+        self._jog_touched = 0  # and when it last grew
+
+    def busy(self):
+        return self.moving or bool(self.queue)
+
+    def submit(self, commands):
+        """Check and queue a batch of commands; returns the position after them.
+
+        Each command is one of:
+          {"jog": {"X": mm, "Y": mm}}   relative travel move
+          {"pen": "up"} or {"pen": "down"}
+          {"macro": name}               a stored macro
+          "$H"                          home
+          "G92 X0 Y0"                   set the position
+          any other G-code line, as parse_line takes it
+        Raises ValueError for a command it does not understand and
+        SoftLimitError for one that would leave the envelope; in either
+        case none of the batch is queued.
+        """
+        if not isinstance(commands, list):
+            raise ValueError("expected a list of commands")
+        if len(self.queue) + len(commands) > MAX_QUEUED:
+            raise ValueError("too many commands waiting")
+        if not self.busy() or self._shadow is None:
+            self._shadow = self.gcode.copy()  # the position may have changed since
+        shadow = self._shadow.copy()
+        planned = [self._plan(shadow, command) for command in commands]
+
+        now = time.ticks_ms()
+        for entry in planned:
+            if entry is None:
+                continue
+            tail = self.queue[-1] if self.queue else None
+            if entry[0] == JOG and tail and tail[0] == JOG:
+                tail[1] += entry[1]
+                tail[2] += entry[2]
+                self._jog_touched = now
+                self.merged += 1
+                continue
+            if entry[0] == JOG:
+                self._jog_started = self._jog_touched = now
+            self.queue.append(entry)
+        self._shadow = shadow
+        return dict(shadow.position)
+
+    def _plan(self, shadow, command):
+        """Apply a command to the shadow interpreter; returns the queue entry."""
+        position = shadow.position
+        spm = shadow.steps_per_mm
+        if isinstance(command, dict) and 'jog' in command:
+            jog = command['jog']
+            if not isinstance(jog, dict):
+                raise ValueError("jog is {\"X\": mm, \"Y\": mm}")
+            dx = int(float(jog.get('X', 0)) * spm)
+            dy = int(float(jog.get('Y', 0)) * spm)
+            if shadow.soft_limits:
+                shadow.check_limits(position['X'] + dx, position['Y'] + dy)
+            position['X'] += dx
+            position['Y'] += dy
+            return [JOG, dx, dy] if dx or dy else None
+        if isinstance(command, dict) and 'pen' in command:
+            if command['pen'] not in ('up', 'down'):
+                raise ValueError("pen is 'up' or 'down'")
+            position['Z'] = 1 if command['pen'] == 'up' else 0
+            return [PEN, 1 if command['pen'] == 'up' else 2]
+        if isinstance(command, dict) and 'macro' in command and self.macros:
+            name = command['macro']
+            for move in self.macros.plan(name, shadow):
+                if move[0] == '$H':
+                    position['X'] = position['Y'] = 0
+                else:
+                    position['X'] += move[1]
+                    position['Y'] += move[2]
+                    position['Z'] += move[3]
+            return [MACRO, name]
+        if not isinstance(command, str):
+            raise ValueError("unknown command {}".format(command))
+        line = command.strip().upper()
+        if line == '$H':
+            position['X'] = position['Y'] = 0
+            return [HOME]
+        if line.startswith('G92'):
+            axes = {}
+            for word in line.split()[1:]:
+                if word[0] in 'XYZ':
+                    axes[word[0]] = float(word[1:])
+            shadow.set_position(**axes)
+            return [ZERO, axes]
+        if not line.startswith(('G0', 'G1', 'G90', 'G91')):
+            raise ValueError("unsupported command {}".format(command))
+        move = shadow.plan(line)
+        if move:
+            position['X'] += move[1]
+            position['Y'] += move[2]
+            position['Z'] += move[3]
+        return [LINE, line]
+
+    def _ready(self, now):
+        # a jog at the end of the queue waits in case more arrive
+        if len(self.queue) > 1 or self.queue[0][0] != JOG:
+            return True
+        return (time.ticks_diff(now, self._jog_touched) >= self.window_ms
+                or time.ticks_diff(now, self._jog_started) >= self.max_wait_ms)
+
+    async def run(self):
+        """Background task, start it once with loop.create_task()."""
+        gcode = self.gcode
+        while True:
+            if not self.queue or not self._ready(time.ticks_ms()):
+                await uasyncio.sleep_ms(20)
+                continue
+            entry = self.queue.pop(0)
+            self.moving = True
+            try:
+                kind = entry[0]
+                if kind == JOG:
+                    gcode.move_steps(entry[1], entry[2], travel=True)
+                elif kind == PEN:
+                    gcode.move_steps(0, 0, pen=entry[1])
+                elif kind == HOME:
+                    gcode.home()
+                elif kind == ZERO:
+                    gcode.set_position(**entry[1])
+                elif kind == MACRO:
+                    self.macros.run(entry[1], gcode)
+                else:
+                    gcode.parse_line(entry[1])
+            except SoftLimitError:
+                # the position changed under the queue, e.g. a job ran;
+                # what was planned from the old one no longer applies
+                self.queue = []
+            except Exception as e:
+                # a motor fault or a command that got past submit(); an
+                # ended task would leave busy() true and block jobs for good
+                self.error = "{} failed: {}".format(kind, e)
+                print("control pad:", self.error)
+                self.queue = []
+            finally:
+                self.moving = False
+            await uasyncio.sleep_ms(0)
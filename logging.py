@@ -4,7 +4,7 @@
 # 20 June 2025
 # Kevin McAleer
 
-import machine, os, gc
+import machine, os, gc, time
 
 log_file = "log.txt"
 
@@ -17,14 +17,40 @@ LOG_ALL = LOG_INFO | LOG_WARNING | LOG_ERROR | LOG_DEBUG | LOG_EXCEPTION
 
 _logging_types = LOG_INFO | LOG_WARNING | LOG_ERROR | LOG_EXCEPTION
 
-# the log file will be truncated if it exceeds _log_truncate_at bytes in
-# size. the defaults values are designed to limit the log to at most
-# three blocks on the Pico
-_log_truncate_at = 11 * 1024
-_log_truncate_to =  8 * 1024
+# the log is kept as up to _log_segments files. log_file is the segment
+# being written, log_file.1 is the one before it and so on. once log_file
+# would grow past _log_segment_size the segments are renamed along by one
+# and the oldest is deleted, so a rollover never copies any data. the
+# defaults keep the log to at most three blocks on the Pico
+_log_segment_size = 4 * 1024
+_log_segments = 3
+
+# entries are formatted into a RAM ring buffer and written to flash in
+# batches: once _log_flush_at bytes are waiting, once _log_flush_interval_ms
+# has passed since the last write or straight away for errors. the interval
+# is checked by log() and by the flusher() task, so the last entries before
+# a quiet spell still reach flash. in ram only mode the buffer just wraps
+# around and flash is never touched
+_log_buffer_size = 2 * 1024
+_log_flush_at = 1536
+_log_flush_interval_ms = 5000
+_log_ram_only = False
+
+_buffer = bytearray(_log_buffer_size)
+_buffer_head = 0    # where the next entry is written
+_buffer_length = 0  # bytes waiting in the buffer
+_last_flush = time.ticks_ms()
+
+# size of the log file on flash, read once and then tracked in memory
+_log_size = None
+
+# the timestamp and free memory figure are refreshed at most once a second
+_rtc = machine.RTC()
+_stamp = None
+_stamp_time = 0
 
 def datetime_string():
-  dt = machine.RTC().datetime()
+  dt = _rtc.datetime()
   return "{0:04d}-{1:02d}-{2:02d} {4:02d}:{5:02d}:{6:02d}".format(*dt)
 
 def file_size(file):
@@ -33,11 +59,36 @@ def file_size(file):
   except OSError:
     return None
 
+def set_rotation(segment_size, segments):
+  global _log_segment_size
+  global _log_segments
+  _log_segment_size = segment_size
+  _log_segments = max(segments, 1)
+
+# kept for older callers, the log now holds between roughly truncate_to and
+# truncate_at bytes spread over segments of truncate_at - truncate_to bytes
 def set_truncate_thresholds(truncate_at, truncate_to):
-  global _log_truncate_at
-  global _log_truncate_to
-  _log_truncate_at = truncate_at
-  _log_truncate_to = truncate_to
+  segment_size = max(truncate_at - truncate_to, 1024)
+  set_rotation(segment_size, max(truncate_at // segment_size, 2))
+
+def set_buffering(buffer_size, flush_at, flush_interval_ms):
+  global _buffer, _buffer_head, _buffer_length
+  global _log_buffer_size, _log_flush_at, _log_flush_interval_ms
+  flush()
+  _log_buffer_size = buffer_size
+  _log_flush_at = min(flush_at, buffer_size)
+  _log_flush_interval_ms = flush_interval_ms
+  _buffer = bytearray(buffer_size)
+  _buffer_head = 0
+  _buffer_length = 0
+
+# in ram only mode nothing is written to flash, read_buffer() returns the
+# most recent entries that still fit in the buffer
+def set_ram_only(ram_only):
+  global _log_ram_only
+  if ram_only:
+    flush()
+  _log_ram_only = ram_only
 
 def enable_logging_types(types):
   global _logging_types
@@ -47,54 +98,115 @@ def disable_logging_types(types):
   global _logging_types
   _logging_types = _logging_types & ~types
 
-# truncates the log file down to a target size while maintaining
-# clean line breaks
-def truncate(file, target_size):
-  # get the current size of the log file
-  size = file_size(file)
+def _segment_name(index):
+  return log_file if index == 0 else "{}.{}".format(log_file, index)
 
-  # calculate how many bytes we're aiming to discard
-  discard = size - target_size
-  if discard <= 0:
+# starts a new segment, dropping the oldest one
+def rotate():
+  global _log_size
+  try:
+    os.remove(_segment_name(_log_segments - 1))
+  except OSError:
+    pass
+  for index in range(_log_segments - 2, -1, -1):
+    try:
+      os.rename(_segment_name(index), _segment_name(index + 1))
+    except OSError:
+      pass
+  _log_size = 0
+
+# yields the whole log oldest first: each segment on flash in turn
+# followed by whatever is still waiting in the ram buffer
+def read_log(chunk_size=512):
+  for index in range(_log_segments - 1, -1, -1):
+    try:
+      with open(_segment_name(index), "rb") as f:
+        while True:
+          chunk = f.read(chunk_size)
+          if not chunk:
+            break
+          yield chunk
+    except OSError:
+      pass
+  yield read_buffer()
+
+# copies data into the ring buffer, in ram only mode the oldest bytes are
+# overwritten once it is full
+def _buffer_write(data):
+  global _buffer_head, _buffer_length
+  size = _log_buffer_size
+  if len(data) > size:
+    data = data[-size:]
+  first = min(len(data), size - _buffer_head)
+  _buffer[_buffer_head:_buffer_head + first] = data[:first]
+  if first < len(data):
+    _buffer[0:len(data) - first] = data[first:]
+  _buffer_head = (_buffer_head + len(data)) % size
+  _buffer_length = min(_buffer_length + len(data), size)
+
+# returns the buffered entries, oldest first
+def read_buffer():
+  start = (_buffer_head - _buffer_length) % _log_buffer_size
+  if start + _buffer_length <= _log_buffer_size:
+    return bytes(_buffer[start:start + _buffer_length])
+  return bytes(_buffer[start:]) + bytes(_buffer[:_buffer_head])
+
+# writes everything waiting in the ring buffer to the log file
+def flush():
+  global _buffer_length, _last_flush, _log_size
+  _last_flush = time.ticks_ms()
+  if _log_ram_only or not _buffer_length:
     return
 
-  with open(file, "rb") as infile:
-    with open(file + ".tmp", "wb") as outfile:
-      # skip a bunch of the input file until we've discarded
-      # at least enough
-      while discard > 0:
-        chunk = infile.read(1024)
-        discard -= len(chunk)
-
-      # try to find a line break nearby to split first chunk on
-      break_position = max(
-        chunk.find (b"\n", -discard), # search forward
-        chunk.rfind(b"\n", -discard) # search backwards
-      )
-      if break_position != -1: # if we found a line break..
-        outfile.write(chunk[break_position + 1:])
-
-      # now copy the rest of the file
-      while True:
-        chunk = infile.read(1024)
-        if not chunk: 
-          break
-        outfile.write(chunk)
-
-  # delete the old file and replace with the new
-  os.remove(file)
-  os.rename(file + ".tmp", file)
-
+  if _log_size is None:
+    _log_size = file_size(log_file) or 0
+  if _log_segment_size and _log_size and _log_size + _buffer_length > _log_segment_size:
+    rotate()
+
+  start = (_buffer_head - _buffer_length) % _log_buffer_size
+  view = memoryview(_buffer)
+  with open(log_file, "ab") as logfile:
+    if start + _buffer_length <= _log_buffer_size:
+      logfile.write(view[start:start + _buffer_length])
+    else:
+      logfile.write(view[start:])
+      logfile.write(view[:_buffer_head])
+  _log_size += _buffer_length
+  _buffer_length = 0
+
+# flushes if entries have waited _log_flush_interval_ms, cheap enough to
+# call from any idle loop
+def flush_if_due():
+  if _buffer_length and time.ticks_diff(time.ticks_ms(), _last_flush) >= _log_flush_interval_ms:
+    flush()
+
+# task that writes out entries left waiting when nothing else is logged,
+# server.run() starts one
+async def flusher():
+  import uasyncio
+  while True:
+    await uasyncio.sleep_ms(_log_flush_interval_ms)
+    flush_if_due()
 
 def log(level, text):
-  datetime = datetime_string()
-  log_entry = "{0} [{1:8} /{2:>4}kB] {3}".format(datetime, level, round(gc.mem_free() / 1024), text)
+  global _stamp, _stamp_time
+  now = time.ticks_ms()
+  if _stamp is None or time.ticks_diff(now, _stamp_time) >= 1000:
+    _stamp = "{0} [{{0:8}} /{1:>4}kB] ".format(datetime_string(), round(gc.mem_free() / 1024))
+    _stamp_time = now
+  log_entry = _stamp.format(level) + text
   print(log_entry)
-  with open(log_file, "a") as logfile:
-    logfile.write(log_entry + '\n')
 
-  if _log_truncate_at and file_size(log_file) > _log_truncate_at:
-    truncate(log_file, _log_truncate_to)
+  entry = (log_entry + "\n").encode()
+  if not _log_ram_only and _buffer_length + len(entry) > _log_buffer_size:
+    flush()
+  _buffer_write(entry)
+
+  if _log_ram_only:
+    return
+  if (_buffer_length >= _log_flush_at or level in ("error", "exception")
+      or time.ticks_diff(now, _last_flush) >= _log_flush_interval_ms):
+    flush()
 
 def info(*items):
   if _logging_types & LOG_INFO:
@@ -0,0 +1,220 @@
+# Stored G-code macros
+# Short sequences that get replayed over and over (pen up and down,
+# calibration squares, test patterns) are saved once under a name and
+# run by name from serial ('$M name'), HTTP (jog.JogQueue) or a job.
+#
+# A macro is compiled when it is defined: every line is parsed once into
+# a segment of five int32s, [op, axes, x, y, z], with X and Y already in
+# steps, and the segments are written to macros/<name>.seg after a
+# two word header (MAGIC, steps per mm x 1000). Running one is integer
+# arithmetic only. The source is kept in macros/<name>.gcode, so a macro
+# is recompiled if steps per mm changes. The most recently used macros
+# stay in RAM.
+#
+# Lines mean what they mean to GCodeInterpreter.parse_line, run at the
+# position and positioning mode the macro starts in, and '$H' homes.
+# Lines parse_line ignores are dropped.
+
+import os
+import array
+
+MACRO_DIR = "macros"
+CACHE_SIZE = 4      # compiled macros kept in RAM
+MAX_NAME = 16
+MAGIC = 0x4D43524F  # 'MCRO'
+
+# segment ops
+TRAVEL = 0    # G0 / G00
+DRAW = 1      # any other G0x, G1x word
+ABSOLUTE = 2  # G90
+RELATIVE = 3  # G91
+HOME = 4      # $H
+
+# axes given, bits of the segment's second word
+X = 1
+Y = 2
+Z = 4
+
+HOME_CMD = '$H'  # what plan() yields for a home
+
+
+def valid_name(name):
+    if not 0 < len(name) <= MAX_NAME:
+        return False
+    for c in name:
+        if not (c.isalpha() or c.isdigit() or c in '_-'):
+            return False
+    return True
+
+
+def compile_lines(lines, steps_per_mm):
+    """Compile G-code lines into an array of segments."""
+    segments = array.array('i')
+    for line in lines:
+        line = line.split(';', 1)[0].strip().upper()
+        if line == '$H':
+            segments.extend((HOME, 0, 0, 0, 0))
+            continue
+        if not line.startswith(('G0', 'G1', 'G90', 'G91')):
+            continue
+        if line == 'G90':
+            segments.extend((ABSOLUTE, 0, 0, 0, 0))
+            continue
+        if line == 'G91':
+            segments.extend((RELATIVE, 0, 0, 0, 0))
+            continue
+        parts = line.split()
+        axes = 0
+        values = [0, 0, 0]
+        for part in parts[1:]:
+            axis = part[0]
+            if axis in 'XYZ':
+                try:
+                    value = float(part[1:])
+                except ValueError:
+                    continue  # parse_line skips it too
+                i = 'XYZ'.index(axis)
+                values[i] = int(value * steps_per_mm) if i < 2 else int(value)
+                axes |= 1 << i
+        if axes:
+            segments.extend((TRAVEL if parts[0] in ('G0', 'G00') else DRAW, axes,
+                             values[0], values[1], values[2]))
+    return segments
+
+
+class MacroStore:
+    def __init__(self, macro_dir=MACRO_DIR, cache_size=CACHE_SIZE):
+        self.macro_dir = macro_dir
+        self.cache_size = cache_size
+        self._cache = {}  # name: (steps per mm, segments)
+        self._order = []  # names in the cache, least recently used first
+        try:
+            os.mkdir(macro_dir)
+        except OSError:
+            pass  # already exists
+
+    def _path(self, name, ext):
+        return "{}/{}.{}".format(self.macro_dir, name, ext)
+
+    def names(self):
+        return sorted(name[:-6] for name in os.listdir(self.macro_dir) if name.endswith('.gcode'))
+
+    def define(self, name, lines, steps_per_mm):
+        """Save and compile a macro, replacing any of the same name.
+
+        Returns the number of segments.
+        """
+        if not valid_name(name):
+            raise ValueError("macro names are 1-{} letters, digits, _ or -".format(MAX_NAME))
+        lines = list(lines)
+        with open(self._path(name, 'gcode'), 'w') as f:
+            for line in lines:
+                f.write(line.rstrip('\r\n') + '\n')
+        segments = compile_lines(lines, steps_per_mm)
+        self._save(name, segments, steps_per_mm)
+        self._remember(name, steps_per_mm, segments)
+        return len(segments) // 5
+
+    def delete(self, name):
+        """Forget a macro; returns False if there was no such macro."""
+        if name in self._cache:
+            del self._cache[name]
+            self._order.remove(name)
+        found = False
+        for ext in ('gcode', 'seg'):
+            try:
+                os.remove(self._path(name, ext))
+                found = True
+            except OSError:
+                pass
+        return found
+
+    def _save(self, name, segments, steps_per_mm):
+        with open(self._path(name, 'seg'), 'wb') as f:
+            f.write(array.array('i', (MAGIC, int(steps_per_mm * 1000))))
+            f.write(segments)
+
+    def _load(self, name, steps_per_mm):
+        """The compiled segments from flash, recompiling if they are stale."""
+        spm = int(steps_per_mm * 1000)
+        try:
+            size = os.stat(self._path(name, 'seg'))[6]
+            with open(self._path(name, 'seg'), 'rb') as f:
+                header = array.array('i', (0, 0))
+                f.readinto(header)
+                if header[0] == MAGIC and header[1] == spm:
+                    segments = array.array('i', [0] * ((size - 8) // 4))
+                    f.readinto(segments)
+                    return segments
+        except OSError:
+            pass
+        try:
+            with open(self._path(name, 'gcode')) as f:
+                segments = compile_lines(f, steps_per_mm)
+        except OSError:
+            raise ValueError("no macro {}".format(name))
+        self._save(name, segments, steps_per_mm)
+        return segments
+
+    def _remember(self, name, steps_per_mm, segments):
+        if name in self._cache:
+            self._order.remove(name)
+        elif len(self._order) >= self.cache_size:
+            del self._cache[self._order.pop(0)]
+        self._cache[name] = (steps_per_mm, segments)
+        self._order.append(name)
+
+    def get(self, name, steps_per_mm):
+        """A macro's segments, from RAM if it was used recently."""
+        cached = self._cache.get(name)
+        if cached and cached[0] == steps_per_mm:
+            if self._order[-1] != name:
+                self._order.remove(name)
+                self._order.append(name)
+            return cached[1]
+        segments = self._load(name, steps_per_mm)
+        self._remember(name, steps_per_mm, segments)
+        return segments
+
+    def plan(self, name, gcode):
+        """Yield a macro's moves for gcode, as plan() returns them.
+
+        G90 and G91 take effect as they are reached. Each move is worked
+        out from gcode.position when it is reached, so apply each one
+        (execute() does) before asking for the next. A home is yielded
+        as (HOME_CMD, 0, 0, 0). Raises SoftLimitError as plan() does.
+        """
+        segments = self.get(name, gcode.steps_per_mm)
+        position = gcode.position
+        for i in range(0, len(segments), 5):
+            op = segments[i]
+            if op == ABSOLUTE:
+                gcode.relative_mode = False
+            elif op == RELATIVE:
+                gcode.relative_mode = True
+            elif op == HOME:
+                yield HOME_CMD, 0, 0, 0
+            else:
+                axes = segments[i + 1]
+                relative = gcode.relative_mode
+                x = position['X']
+                y = position['Y']
+                z = position['Z']
+                if axes & X:
+                    x = x + segments[i + 2] if relative else segments[i + 2]
+                if axes & Y:
+                    y = y + segments[i + 3] if relative else segments[i + 3]
+                if axes & Z:
+                    z = z + segments[i + 4] if relative else segments[i + 4]
+                if gcode.soft_limits:
+                    gcode.check_limits(x, y)
+                yield ('G0' if op == TRAVEL else 'G1',
+                       x - position['X'], y - position['Y'], z - position['Z'])
+
+    def run(self, name, gcode):
+        """Run a macro on gcode's motors."""
+        for move in self.plan(name, gcode):
+            if move[0] == HOME_CMD:
+                gcode.home()
+            else:
+                gcode.execute(*move)
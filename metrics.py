@@ -0,0 +1,109 @@
+# metrics
+# request counters and latency histograms for the web server, kept in
+# fixed size arrays allocated once at import so recording a request
+# never touches the heap
+
+import array
+
+# routes registered after the table is full share the last slot, slot 0
+# collects requests that did not match any route
+MAX_ROUTES = 16
+UNMATCHED = 0
+
+# upper bounds of the latency histogram buckets, a final +Inf bucket
+# catches everything slower
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# status codes counted individually, anything else is counted as "other"
+STATUS_CODES = (200, 201, 301, 400, 404, 408, 409, 413, 414, 431, 500, 503)
+
+_bucket_count = len(LATENCY_BUCKETS_MS) + 1
+
+_route_names = ["other"] + [None] * (MAX_ROUTES - 1)
+_route_requests = array.array("L", [0] * MAX_ROUTES)
+_route_latency_sum = array.array("L", [0] * MAX_ROUTES)
+_route_buckets = array.array("L", [0] * (MAX_ROUTES * _bucket_count))
+_status_counts = array.array("L", [0] * (len(STATUS_CODES) + 1))
+
+# bytes received, bytes sent
+_bytes = array.array("L", [0, 0])
+
+_next_route = 1
+
+
+# returns the slot used to record requests for the route at path
+def register_route(path):
+  global _next_route
+  for index in range(1, _next_route):
+    if _route_names[index] == path:
+      return index
+  if _next_route == MAX_ROUTES:
+    _route_names[MAX_ROUTES - 1] = "overflow"
+    return MAX_ROUTES - 1
+  index = _next_route
+  _route_names[index] = path
+  _next_route += 1
+  return index
+
+
+def record(route_index, status, latency_ms, bytes_in, bytes_out):
+  _route_requests[route_index] += 1
+  _route_latency_sum[route_index] += latency_ms
+
+  bucket = 0
+  while bucket < _bucket_count - 1 and latency_ms > LATENCY_BUCKETS_MS[bucket]:
+    bucket += 1
+  _route_buckets[route_index * _bucket_count + bucket] += 1
+
+  code = 0
+  while code < len(STATUS_CODES) and STATUS_CODES[code] != status:
+    code += 1
+  _status_counts[code] += 1
+
+  _bytes[0] += bytes_in
+  _bytes[1] += bytes_out
+
+
+def reset():
+  for table in (_route_requests, _route_latency_sum, _route_buckets, _status_counts, _bytes):
+    for i in range(len(table)):
+      table[i] = 0
+
+
+# renders the metrics in the prometheus text exposition format as a
+# generator of lines. gauges and counters kept elsewhere (such as the
+# server's open connection count) can be passed in as dictionaries
+def render(gauges={}, counters={}):
+  yield "# TYPE http_requests_total counter\n"
+  for index in range(MAX_ROUTES):
+    if _route_names[index] is not None:
+      yield f'http_requests_total{{route="{_route_names[index]}"}} {_route_requests[index]}\n'
+
+  yield "# TYPE http_request_duration_ms histogram\n"
+  for index in range(MAX_ROUTES):
+    if _route_names[index] is None or not _route_requests[index]:
+      continue
+    name = _route_names[index]
+    cumulative = 0
+    for bucket in range(_bucket_count):
+      cumulative += _route_buckets[index * _bucket_count + bucket]
+      le = LATENCY_BUCKETS_MS[bucket] if bucket < _bucket_count - 1 else "+Inf"
+      yield f'http_request_duration_ms_bucket{{route="{name}",le="{le}"}} {cumulative}\n'
+    yield f'http_request_duration_ms_sum{{route="{name}"}} {_route_latency_sum[index]}\n'
+    yield f'http_request_duration_ms_count{{route="{name}"}} {_route_requests[index]}\n'
+
+  yield "# TYPE http_responses_total counter\n"
+  for code in range(len(STATUS_CODES) + 1):
+    if _status_counts[code]:
+      label = STATUS_CODES[code] if code < len(STATUS_CODES) else "other"
+      yield f'http_responses_total{{code="{label}"}} {_status_counts[code]}\n'
+
+  yield "# TYPE http_received_bytes_total counter\n"
+  yield f"http_received_bytes_total {_bytes[0]}\n"
+  yield "# TYPE http_sent_bytes_total counter\n"
+  yield f"http_sent_bytes_total {_bytes[1]}\n"
+
+  for name, value in gauges.items():
+    yield f"# TYPE {name} gauge\n{name} {value}\n"
+  for name, value in counters.items():
+    yield f"# TYPE {name} counter\n{name} {value}\n"
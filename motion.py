@@ -0,0 +1,225 @@
+# Step generation on the second core
+# GCodeInterpreter plans moves on the first core, where the serial
+# protocol and the web server run, and with a StepGenerator attached
+# queues them here instead of stepping the motors itself. The generator
+# runs in a _thread, which on the RP2040 is the second core, and makes
+# the moves one after another while the first core parses what comes
+# next.
+#
+# The two cores share no lock. Moves go through a SegmentRing: only the
+# first core writes its head and only the second core writes its tail,
+# each a single word store into an array, and a slot is filled before
+# the head moves past it, so neither core sees a half written segment.
+# The generator publishes where the motors are with a sequence count,
+# odd while it is writing; snapshot() copies the state and tries again
+# if the count was odd or changed, so a reader never mixes two moves.
+#
+# If a move raises on the second core, the generator stops and keeps the
+# exception; the next push() or wait() on the first core raises
+# StepGeneratorError with it, rather than waiting for moves that will
+# never be made, and start() runs it again.
+#
+# On a PC the same code runs on a CPython thread; test_motion.py checks
+# it there with host/sim.py's pins and on the Pico.
+
+import _thread
+import array
+from time import sleep_us, sleep_ms
+
+RING_SIZE = 32  # segments queued ahead of the motors
+IDLE_US = 200   # the generator's poll when there is nothing to do
+
+# a segment: travel (1) or draw (0), the move in steps and the position
+# it ends at
+SEGMENT = 7
+
+# snapshot fields
+SEQUENCE = 0
+X = 1
+Y = 2
+Z = 3
+DONE = 4   # segments finished since start()
+BUSY = 5   # 1 while a segment is being stepped
+FIELDS = 6
+
+
+class StepGeneratorError(Exception):
+    pass
+
+
+class SegmentRing:
+    """A single producer, single consumer ring of segments, without locks."""
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.slots = array.array('i', [0] * (size * SEGMENT))
+        # head: the next slot to fill, written by the producer only;
+        # tail: the next slot to take, written by the consumer only.
+        # One slot stays empty so that full and empty differ.
+        self.index = array.array('i', [0, 0])
+
+    def __len__(self):
+        return (self.index[0] - self.index[1]) % self.size
+
+    def push(self, travel, dx, dy, dz, x, y, z):
+        """Add a segment; returns False, adding nothing, if the ring is full."""
+        index = self.index
+        head = index[0]
+        following = head + 1
+        if following == self.size:
+            following = 0
+        if following == index[1]:
+            return False
+        slots = self.slots
+        i = head * SEGMENT
+        slots[i] = travel
+        slots[i + 1] = dx
+        slots[i + 2] = dy
+        slots[i + 3] = dz
+        slots[i + 4] = x
+        slots[i + 5] = y
+        slots[i + 6] = z
+        index[0] = following  # publish it
+        return True
+
+    def pop(self, segment):
+        """Copy the oldest segment into segment; returns False if there is none."""
+        index = self.index
+        tail = index[1]
+        if tail == index[0]:
+            return False
+        slots = self.slots
+        i = tail * SEGMENT
+        for j in range(SEGMENT):
+            segment[j] = slots[i + j]
+        tail += 1
+        index[1] = 0 if tail == self.size else tail  # hand the slot back
+        return True
+
+
+class StepGenerator:
+    """Makes gcode's queued moves on its motors, from a thread of its own."""
+
+    def __init__(self, gcode, ring_size=RING_SIZE):
+        self.gcode = gcode
+        self.ring = SegmentRing(ring_size)
+        self.pushed = 0  # segments queued, first core only
+        self.state = array.array('i', [0] * FIELDS)  # written by the generator only
+        self.control = array.array('i', [0, 0])  # running, stop asked for
+        self.error = None  # what stopped the generator, if a move raised
+        self._segment = array.array('i', [0] * SEGMENT)
+        self._copy = array.array('i', [0] * FIELDS)
+
+    def start(self):
+        """Start stepping on the second core, from the interpreter's position."""
+        position = self.gcode.position
+        state = self.state
+        state[X] = position['X']
+        state[Y] = position['Y']
+        state[Z] = position['Z']
+        state[DONE] = self.pushed = 0
+        index = self.ring.index
+        index[0] = index[1] = 0
+        self.error = None
+        self.control[1] = 0
+        self.control[0] = 1
+        _thread.start_new_thread(self.run, ())
+
+    def stop(self):
+        """Finish the queued moves and end the thread."""
+        if not self.control[0]:
+            return  # stopped already, or a move raised
+        self.wait()
+        self.control[1] = 1
+        while self.control[0]:
+            sleep_ms(1)
+
+    def running(self):
+        return bool(self.control[0])
+
+    def _check(self):
+        """Raise StepGeneratorError if the generator has stopped.
+
+        The moves still queued are dropped and the interpreter's position
+        put back to the end of the last one made, so a status report and
+        a start() after this begin from where the motors are.
+        """
+        if self.control[0]:
+            return
+        state = self.state
+        position = self.gcode.position
+        position['X'] = state[X]
+        position['Y'] = state[Y]
+        position['Z'] = state[Z]
+        self.pushed = state[DONE]
+        index = self.ring.index
+        index[0] = index[1] = 0  # nothing takes from the ring now
+        raise StepGeneratorError("motion stopped: {}".format(self.error or "not started"))
+
+    def push(self, travel, dx, dy, dz, x, y, z):
+        """Queue a move, waiting for room if the ring is full."""
+        ring = self.ring
+        self._check()
+        while not ring.push(travel, dx, dy, dz, x, y, z):
+            self._check()
+            sleep_ms(1)
+        self.pushed += 1
+
+    def idle(self):
+        return self.state[DONE] == self.pushed
+
+    def wait(self):
+        """Wait for the motors to finish every queued move."""
+        while self.state[DONE] != self.pushed:
+            self._check()
+            sleep_ms(1)
+
+    def snapshot(self, out=None):
+        """Where the motors are, as [sequence, X, Y, Z, done, busy].
+
+        X, Y and Z are in the interpreter's units at the end of the last
+        finished move. Fills out, an array('i') of FIELDS, if given.
+        """
+        if out is None:
+            out = array.array('i', [0] * FIELDS)
+        state = self.state
+        while True:
+            sequence = state[SEQUENCE]
+            if sequence & 1:
+                continue  # being written
+            for i in range(1, FIELDS):
+                out[i] = state[i]
+            if state[SEQUENCE] == sequence:
+                out[SEQUENCE] = sequence
+                return out
+
+    def _publish(self, x, y, z, done, busy):
+        state = self.state
+        state[SEQUENCE] += 1
+        state[X] = x
+        state[Y] = y
+        state[Z] = z
+        state[DONE] = done
+        state[BUSY] = busy
+        state[SEQUENCE] += 1
+
+    def run(self):
+        """The generator's loop, what start() runs on the second core."""
+        gcode = self.gcode
+        ring = self.ring
+        segment = self._segment
+        state = self.state
+        control = self.control
+        try:
+            while not control[1]:
+                if not ring.pop(segment):
+                    sleep_us(IDLE_US)
+                    continue
+                done = state[DONE]
+                self._publish(state[X], state[Y], state[Z], done, 1)
+                gcode.move_motors(segment[0], segment[1], segment[2], segment[3])
+                self._publish(segment[4], segment[5], segment[6], done + 1, 0)
+        except Exception as e:
+            self.error = e
+        finally:
+            control[0] = 0
@@ -0,0 +1,70 @@
+# Step timing profiler
+# Opt-in hook for StepperMotor.move: the ticks_us timestamp of every phase
+# change in a segment is stored in a preallocated array, and interval
+# statistics are folded into running totals once the segment finishes.
+# Attach one profiler to all the motors with motor.profiler = profiler.
+
+import array
+from time import ticks_diff
+
+
+class StepProfiler:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.stamps = array.array('L', [0] * capacity)
+        self.reset()
+
+    def reset(self):
+        self.segments = 0
+        self.intervals = 0
+        self.total_us = 0
+        self.expected_us = 0
+        self.max_us = 0
+        self.jitter_us = 0  # sum of |interval - segment mean|
+        self.last_delay_us = 0
+
+    def begin(self, delay_us):
+        """Called by the motor at the start of a segment, returns the array to fill."""
+        self.last_delay_us = delay_us
+        return self.stamps
+
+    def end(self, count):
+        """Called by the motor with the number of timestamps it recorded."""
+        if count < 2:
+            return
+        stamps = self.stamps
+        total = ticks_diff(stamps[count - 1], stamps[0])
+        mean = total // (count - 1)
+        longest = 0
+        jitter = 0
+        for i in range(1, count):
+            interval = ticks_diff(stamps[i], stamps[i - 1])
+            if interval > longest:
+                longest = interval
+            jitter += interval - mean if interval > mean else mean - interval
+
+        self.segments += 1
+        self.intervals += count - 1
+        self.total_us += total
+        self.expected_us += self.last_delay_us * (count - 1)
+        self.jitter_us += jitter
+        if longest > self.max_us:
+            self.max_us = longest
+
+    def summary(self):
+        intervals = self.intervals or 1
+        mean = self.total_us / intervals
+        overhead = (self.total_us - self.expected_us) * 100 / self.total_us if self.total_us else 0
+        return {
+            'segments': self.segments,
+            'intervals': self.intervals,
+            'mean_us': round(mean, 1),
+            'max_us': self.max_us,
+            'jitter_us': round(self.jitter_us / intervals, 1),
+            'overhead_pct': round(overhead, 1),
+        }
+
+    def format_summary(self):
+        s = self.summary()
+        return "[PRF:segments={},intervals={},mean={}us,max={}us,jitter={}us,overhead={}%]".format(
+            s['segments'], s['intervals'], s['mean_us'], s['max_us'], s['jitter_us'], s['overhead_pct'])
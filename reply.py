@@ -0,0 +1,61 @@
+# Allocation-free replies
+# Lines like status reports and [MSG] move descriptions are built in a
+# preallocated buffer and written through a memoryview made for each
+# length up front, so sending one does not touch the heap. Numbers that
+# are not ints fall back to str formatting.
+
+
+class Reply:
+    def __init__(self, size=96):
+        self.buf = bytearray(size)
+        view = memoryview(self.buf)
+        self._views = [view[:i] for i in range(size + 1)]
+        self.length = 0
+
+    def text(self, data):
+        """Append a bytes constant."""
+        buf = self.buf
+        n = self.length
+        i = 0
+        count = len(data)
+        while i < count:
+            buf[n] = data[i]
+            n += 1
+            i += 1
+        self.length = n
+        return self
+
+    def number(self, value):
+        """Append a number as '{}' formats it."""
+        if type(value) is not int:
+            return self.text("{}".format(value).encode())
+        buf = self.buf
+        n = self.length
+        if value < 0:
+            buf[n] = 45  # '-'
+            n += 1
+            value = -value
+        # count the digits, then fill them in from the right
+        end = n + 1
+        rest = value // 10
+        while rest:
+            end += 1
+            rest //= 10
+        self.length = end
+        while True:
+            end -= 1
+            buf[end] = 48 + value % 10
+            value //= 10
+            if not value:
+                return self
+
+    def fixed3(self, value):
+        """Append a number as '{:.3f}' formats it."""
+        if type(value) is not int:
+            return self.text("{:.3f}".format(value).encode())
+        return self.number(value).text(b".000")
+
+    def send(self, out):
+        """Write what has been built to out and start again."""
+        out.write(self._views[self.length])
+        self.length = 0
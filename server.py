@@ -4,7 +4,7 @@
 # Kevin McAleer
 
 import uasyncio, os, time
-from . import logging
+from . import logging, metrics
 
 _routes = []
 catchall_handler = None
@@ -18,29 +18,129 @@ def file_exists(filename):
     return False
 
 
+# values of ascii hex digits indexed by byte, -1 for anything else
+_hex_values = bytearray(b"\xff" * 256)
+for _i, _c in enumerate(b"0123456789abcdef"):
+  _hex_values[_c] = _i
+  _hex_values[b"0123456789ABCDEF"[_i]] = _i
+
+# limits applied to query strings and urlencoded form bodies
+_max_body_size = 4 * 1024
+_max_query_params = 32
+
+# raw bodies sent to upload routes are spooled to flash rather than memory,
+# each request to a file of its own so overlapping uploads stay apart
+_upload_file = "upload{}.tmp"
+_uploads = 0
+_max_upload_size = 256 * 1024
+
+# connections beyond _max_connections are turned away with a 503 rather
+# than queued, each request must deliver its request line and headers
+# within _header_timeout_ms and its body within _body_timeout_ms
+_max_connections = 4
+_header_timeout_ms = 5000
+_body_timeout_ms = 10000
+_max_header_size = 2 * 1024
+
+_open_connections = 0
+
+# running totals to help size the limits above
+counters = {
+  "rejected": 0,
+  "timed_out": 0,
+  "too_large": 0,
+  "malformed": 0,
+}
+
+
+def set_connection_limits(max_connections, header_timeout_ms, body_timeout_ms, max_header_size):
+  global _max_connections
+  global _header_timeout_ms
+  global _body_timeout_ms
+  global _max_header_size
+  _max_connections = max_connections
+  _header_timeout_ms = header_timeout_ms
+  _body_timeout_ms = body_timeout_ms
+  _max_header_size = max_header_size
+
+
+def set_body_limits(max_body_size, max_query_params, max_upload_size=None):
+  global _max_body_size
+  global _max_query_params
+  global _max_upload_size
+  _max_body_size = max_body_size
+  _max_query_params = max_query_params
+  if max_upload_size is not None:
+    _max_upload_size = max_upload_size
+
+
+# decodes src[start:end] into out (which must be at least end - start bytes
+# long) and returns the number of bytes written. malformed % escapes are
+# copied through untouched
+def _urldecode_into(src, start, end, out):
+  i = start
+  j = 0
+  while i < end:
+    c = src[i]
+    if c == 0x2b: # "+"
+      c = 0x20
+    elif c == 0x25 and i + 2 < end: # "%"
+      hi = _hex_values[src[i + 1]]
+      lo = _hex_values[src[i + 2]]
+      if hi != 0xff and lo != 0xff:
+        c = (hi << 4) | lo
+        i += 2
+    out[j] = c
+    i += 1
+    j += 1
+  return j
+
+
+# decodes src[start:end] through out and returns it as str
+def _urldecode_str(src, start, end, out):
+  return str(out[:_urldecode_into(src, start, end, out)], "utf-8")
+
+
 def urldecode(text):
-  text = text.replace("+", " ")
-  result = ""
-  token_caret = 0
-  # decode any % encoded characters
-  while True:
-    start = text.find("%", token_caret)
-    if start == -1:
-      result += text[token_caret:]
-      break
-    result += text[token_caret:start]
-    code = int(text[start + 1:start + 3], 16)
-    result += chr(code)
-    token_caret = start + 3
-  return result
+  if isinstance(text, str):
+    text = text.encode()
+  return _urldecode_str(text, 0, len(text), bytearray(len(text)))
 
+
+# parses a query string (or urlencoded form body) supplied as str, bytes,
+# bytearray or memoryview, decoding each key and value with
+# _urldecode_into through one preallocated buffer. parameters without a
+# value map to "", empty parameters and ones that are not utf-8 are
+# skipped and anything past _max_query_params is dropped
 def _parse_query_string(query_string):
+  if isinstance(query_string, str):
+    query_string = query_string.encode()
   result = {}
-  for parameter in query_string.split("&"):
-    key, value = parameter.split("=", 1)
-    key = urldecode(key)
-    value = urldecode(value)
-    result[key] = value
+  length = len(query_string)
+  out = bytearray(length)
+  start = 0
+  while start < length and len(result) < _max_query_params:
+    # the parameter runs to the next "&", its key to the first "=" in it
+    end = start
+    equals = -1
+    while end < length:
+      c = query_string[end]
+      if c == 0x26: # "&"
+        break
+      if c == 0x3d and equals < 0: # "="
+        equals = end
+      end += 1
+    try:
+      if equals < 0:
+        key, value = _urldecode_str(query_string, start, end, out), ""
+      else:
+        key = _urldecode_str(query_string, start, equals, out)
+        value = _urldecode_str(query_string, equals + 1, end, out)
+      if key:
+        result[key] = value
+    except UnicodeError:
+      pass
+    start = end + 1
   return result
 
 
@@ -52,6 +152,7 @@ class Request:
     self.form = {}
     self.data = {}
     self.query = {}
+    self.file = None
     query_string_start = uri.find("?") if uri.find("?") != -1 else len(uri)
     self.path = uri[:query_string_start]
     self.query_string = uri[query_string_start + 1:]
@@ -67,9 +168,9 @@ data: {self.data}"""
 
 
 class Response:
-  def __init__(self, body, status=200, headers={}):
+  def __init__(self, body, status=200, headers=None):
     self.status = status
-    self.headers = headers
+    self.headers = headers if headers is not None else {}
     self.body = body
 
   def add_header(self, name, value):
@@ -96,9 +197,9 @@ content_type_map = {
 
 
 class FileResponse(Response):
-  def __init__(self, file, status=200, headers={}):
+  def __init__(self, file, status=200, headers=None):
     self.status = 404
-    self.headers = headers
+    self.headers = headers = headers if headers is not None else {}
     self.file = file
 
     try:
@@ -115,11 +216,99 @@ class FileResponse(Response):
       return False
 
 
+# a server-sent events channel. one producer task samples the supplied
+# callable every interval_ms and writes the same encoded message to every
+# subscribed client, so the cost of building a status update does not
+# grow with the number of open browsers. the task only runs while there
+# is at least one subscriber
+class EventStream:
+  def __init__(self, producer, interval_ms=500, keepalive_ms=15000, max_subscribers=4):
+    self.producer = producer
+    self.interval_ms = interval_ms
+    self.keepalive_ms = keepalive_ms
+    self.max_subscribers = max_subscribers
+    self.subscribers = []
+    self._task = None
+
+  def set_interval(self, interval_ms):
+    self.interval_ms = interval_ms
+
+  # takes ownership of the client connection, returns False if the stream
+  # is already at its subscriber limit
+  async def subscribe(self, writer):
+    if len(self.subscribers) >= self.max_subscribers:
+      return False
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                 b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+    await writer.drain()
+    self.subscribers.append(writer)
+    if self._task is None:
+      self._task = loop.create_task(self._run())
+    return True
+
+  def _encode(self, payload):
+    if not isinstance(payload, str):
+      import json
+      payload = json.dumps(payload)
+    return b"data: " + payload.encode() + b"\n\n"
+
+  async def _broadcast(self, message):
+    for writer in self.subscribers[:]:
+      try:
+        writer.write(message)
+        await writer.drain()
+      except Exception:
+        self.subscribers.remove(writer)
+        try:
+          writer.close()
+        except Exception:
+          pass
+
+  # a producer that raises is logged (once until it recovers) and the
+  # stream carries on with keepalives, so subscribers are never left
+  # hanging on a dead task. if the task does end, they are closed
+  async def _run(self):
+    last_message = None
+    last_sent = time.ticks_ms()
+    failing = False
+    try:
+      while self.subscribers:
+        try:
+          message = self._encode(self.producer())
+          failing = False
+        except Exception as e:
+          if not failing:
+            logging.error(f"> event stream producer failed: {e}")
+            failing = True
+          message = last_message
+        now = time.ticks_ms()
+        if message != last_message:
+          await self._broadcast(message)
+          last_message = message
+          last_sent = now
+        elif time.ticks_diff(now, last_sent) > self.keepalive_ms:
+          await self._broadcast(b": keepalive\n\n")
+          last_sent = now
+        await uasyncio.sleep_ms(self.interval_ms)
+    except Exception as e:
+      logging.error(f"> event stream stopped: {e}")
+    finally:
+      self._task = None
+      for writer in self.subscribers:
+        try:
+          writer.close()
+        except Exception:
+          pass
+      self.subscribers = []
+
+
 class Route:
-  def __init__(self, path, handler, methods=["GET"]):
+  def __init__(self, path, handler, methods=["GET"], upload=False):
     self.path = path
     self.methods = methods
     self.handler = handler
+    self.upload = upload
+    self.metrics_index = metrics.register_route(path)
     self.path_parts = path.split("/")
 
   # returns True if the supplied request matches this route
@@ -154,16 +343,52 @@ methods: {self.methods}
     return f"<Route object {self.path} ({', '.join(self.methods)})>"
 
 
+# raised while reading a request to answer it with an error status
+class _RequestError(Exception):
+  def __init__(self, status):
+    super().__init__(status)
+    self.status = status
+
+
+def _deadline(timeout_ms):
+  return time.ticks_add(time.ticks_ms(), timeout_ms)
+
+
+# reads a line, giving up with a TimeoutError once deadline has passed
+async def _readline(reader, deadline):
+  remaining = time.ticks_diff(deadline, time.ticks_ms())
+  if remaining <= 0:
+    raise uasyncio.TimeoutError()
+  return await uasyncio.wait_for_ms(reader.readline(), remaining)
+
+
+async def _readinto(reader, buffer, deadline):
+  remaining = time.ticks_diff(deadline, time.ticks_ms())
+  if remaining <= 0:
+    raise uasyncio.TimeoutError()
+  return await uasyncio.wait_for_ms(reader.readinto(buffer), remaining)
+
+
 # parses the headers for a http request (or the headers attached to
-# each field in a multipart/form-data)
-async def _parse_headers(reader):
+# each field in a multipart/form-data). lines without a ":" are skipped
+async def _parse_headers(reader, deadline, tally=None):
   headers = {}
+  size = 0
   while True:
-    header_line = await reader.readline()
-    if header_line == b"\r\n": # crlf denotes body start
+    header_line = await _readline(reader, deadline)
+    if tally:
+      tally[1] += len(header_line)
+    if header_line == b"\r\n" or not header_line: # crlf denotes body start
       break
-    name, value = header_line.decode().strip().split(": ", 1)
-    headers[name.lower()] = value
+    size += len(header_line)
+    if size > _max_header_size:
+      counters["too_large"] += 1
+      raise _RequestError(431)
+    name, separator, value = header_line.decode().partition(":")
+    if not separator:
+      counters["malformed"] += 1
+      continue
+    headers[name.strip().lower()] = value.strip()
   return headers
 
 
@@ -176,22 +401,24 @@ def _match_route(request):
 
 
 # if the content type is multipart/form-data then parse the fields
-async def _parse_form_data(reader, headers):
+async def _parse_form_data(reader, headers, deadline):
   boundary = headers["content-type"].split("boundary=")[1]
   # discard first boundary line
-  dummy = await reader.readline()
+  dummy = await _readline(reader, deadline)
 
   form = {}
   while True:
     # get the field name
-    field_headers = await _parse_headers(reader)
+    field_headers = await _parse_headers(reader, deadline)
     if len(field_headers) == 0:
       break
     name = field_headers["content-disposition"].split("name=\"")[1][:-1]
     # get the field value
     value = ""
     while True:
-      line = await reader.readline()
+      line = await _readline(reader, deadline)
+      if not line:
+        return form
       line = line.decode().strip()
       # if we hit a boundary then save the value and move to next field
       if line == "--" + boundary:
@@ -206,11 +433,57 @@ async def _parse_form_data(reader, headers):
 
 
 # if the content type is application/json then parse the body
-async def _parse_json_body(reader, headers):
+async def _parse_json_body(reader, content_length, deadline):
   import json
-  content_length_bytes = int(headers["content-length"])
-  body = await reader.readexactly(content_length_bytes)
-  return json.loads(body.decode())
+  body = await _read_body(reader, content_length, deadline)
+  return json.loads(bytes(body).decode())
+
+
+# reads up to content_length bytes of body into a preallocated buffer and
+# returns a memoryview over the bytes actually received
+async def _read_body(reader, content_length, deadline):
+  buffer = bytearray(content_length)
+  view = memoryview(buffer)
+  received = 0
+  while received < content_length:
+    count = await _readinto(reader, view[received:], deadline)
+    if not count:
+      break
+    received += count
+  return view[:received]
+
+
+def _discard(filename):
+  try:
+    os.remove(filename)
+  except OSError:
+    pass
+
+
+# streams a raw request body to a new spool file through a small fixed
+# buffer and returns the filename, or None if the client went away early
+async def _spool_body(reader, content_length, deadline):
+  global _uploads
+  _uploads += 1
+  filename = _upload_file.format(_uploads)
+  buffer = bytearray(512)
+  view = memoryview(buffer)
+  remaining = content_length
+  try:
+    with open(filename, "wb") as f:
+      while remaining > 0:
+        count = await _readinto(reader, view[:min(remaining, len(buffer))], deadline)
+        if not count:
+          break
+        f.write(view[:count])
+        remaining -= count
+  except BaseException:
+    _discard(filename)
+    raise
+  if remaining:
+    _discard(filename)
+    return None
+  return filename
 
 
 status_message_map = {
@@ -222,49 +495,96 @@ status_message_map = {
   307: "Temporary Redirect", 308: "Permanent Redirect",
   400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
   404: "Not Found", 405: "Method Not Allowed", 406: "Not Acceptable",
-  408: "Request Timeout", 409: "Conflict", 410: "Gone",
-  414: "URI Too Long", 415: "Unsupported Media Type", 
+  408: "Request Timeout", 409: "Conflict", 410: "Gone", 411: "Length Required",
+  413: "Payload Too Large", 414: "URI Too Long", 415: "Unsupported Media Type", 
   416: "Range Not Satisfiable", 418: "I'm a teapot",
-  500: "Internal Server Error", 501: "Not Implemented"
+  431: "Request Header Fields Too Large",
+  500: "Internal Server Error", 501: "Not Implemented",
+  503: "Service Unavailable"
 }
 
 
-# handle an incoming request to the web server
-async def _handle_request(reader, writer):
+def _send(writer, data, tally):
+  writer.write(data)
+  tally[2] += len(data)
+
+
+# handle an incoming request to the web server, tally collects the
+# metrics route slot, bytes received and bytes sent for the exchange.
+# returns True if the connection was handed over to an event stream
+async def _handle_request(reader, writer, tally):
   response = None
 
   request_start_time = time.ticks_ms()
+  deadline = _deadline(_header_timeout_ms)
 
-  request_line = await reader.readline()
+  request_line = await _readline(reader, deadline)
+  tally[1] += len(request_line)
+  if len(request_line) > _max_header_size:
+    counters["too_large"] += 1
+    raise _RequestError(414)
   try:
     method, uri, protocol = request_line.decode().split()
   except Exception as e:
+    counters["malformed"] += 1
     logging.error(e)
-    return
+    return False
 
   request = Request(method, uri, protocol)
-  request.headers = await _parse_headers(reader)
-  if "content-length" in request.headers and "content-type" in request.headers:
-    if request.headers["content-type"].startswith("multipart/form-data"):
-      request.form = await _parse_form_data(reader, request.headers)
-    if request.headers["content-type"].startswith("application/json"):
-      request.data = await _parse_json_body(reader, request.headers)
-    if request.headers["content-type"].startswith("application/x-www-form-urlencoded"):
-      form_data = b""
-      content_length = int(request.headers["content-length"])
-      while content_length > 0:
-        data = await reader.read(content_length)
-        if len(data) == 0:
-          break
-        content_length -= len(data)
-        form_data += data
-      request.form = _parse_query_string(form_data.decode()) 
+  request.headers = await _parse_headers(reader, deadline, tally)
 
+  deadline = _deadline(_body_timeout_ms)
   route = _match_route(request)
   if route:
-    response = route.call_handler(request)
-  elif catchall_handler:
-    response = catchall_handler(request)
+    tally[0] = route.metrics_index
+  # the length drives the body reads, so only plain digits will do. an
+  # upload cannot be spooled without one
+  length = request.headers.get("content-length")
+  if length is None:
+    if route and route.upload:
+      raise _RequestError(411)
+    length = "0"
+  if not length.isdigit():
+    counters["malformed"] += 1
+    raise _RequestError(400)
+  content_length = int(length)
+  tally[1] += content_length
+  content_type = request.headers.get("content-type", "")
+  if content_length > (_max_upload_size if route and route.upload else _max_body_size):
+    counters["too_large"] += 1
+    raise _RequestError(413)
+
+  if route and route.upload and content_length:
+    request.file = await _spool_body(reader, content_length, deadline)
+  elif content_length and content_type:
+    if content_type.startswith("multipart/form-data"):
+      request.form = await _parse_form_data(reader, request.headers, deadline)
+    if content_type.startswith("application/json"):
+      request.data = await _parse_json_body(reader, content_length, deadline)
+    if content_type.startswith("application/x-www-form-urlencoded"):
+      form_data = await _read_body(reader, content_length, deadline)
+      request.form = _parse_query_string(form_data)
+
+  try:
+    if route:
+      response = route.call_handler(request)
+    elif catchall_handler:
+      response = catchall_handler(request)
+    else:
+      response = ("Not Found", 404)
+  finally:
+    # a handler keeps an upload by moving it, whatever is left is this
+    # request's alone
+    if request.file:
+      _discard(request.file)
+
+  # event streams keep the connection open and manage it from now on
+  if isinstance(response, EventStream):
+    if await response.subscribe(writer):
+      logging.debug(f"> {request.method} {request.path} (event stream)")
+      metrics.record(tally[0], 200, time.ticks_diff(time.ticks_ms(), request_start_time), tally[1], 0)
+      return True
+    response = ("Too many subscribers", 503)
 
   # if shorthand body generator only notation used then convert to tuple
   if type(response).__name__ == "generator":
@@ -286,14 +606,14 @@ async def _handle_request(reader, writer):
   
   # write status line
   status_message = status_message_map.get(response.status, "Unknown")
-  writer.write(f"HTTP/1.1 {response.status} {status_message}\r\n".encode("ascii"))
+  _send(writer, f"HTTP/1.1 {response.status} {status_message}\r\n".encode("ascii"), tally)
 
   # write headers
   for key, value in response.headers.items():
-    writer.write(f"{key}: {value}\r\n".encode("ascii"))
+    _send(writer, f"{key}: {value}\r\n".encode("ascii"), tally)
 
   # blank line to denote end of headers
-  writer.write("\r\n".encode("ascii"))
+  _send(writer, b"\r\n", tally)
  
   if isinstance(response, FileResponse):
     # file
@@ -302,29 +622,84 @@ async def _handle_request(reader, writer):
         chunk = f.read(1024)
         if not chunk:
           break
-        writer.write(chunk)
+        _send(writer, chunk, tally)
         await writer.drain()
   elif type(response.body).__name__ == "generator":
     # generator
     for chunk in response.body:
-      writer.write(chunk)
+      _send(writer, chunk, tally)
       await writer.drain()
   else:
     # string/bytes
-    writer.write(response.body)
+    _send(writer, response.body, tally)
     await writer.drain()
   
-  writer.close()
-  await writer.wait_closed()
-  
-  processing_time = time.ticks_ms() - request_start_time
-  logging.info(f"> {request.method} {request.path} ({response.status} {status_message}) [{processing_time}ms]")
+  processing_time = time.ticks_diff(time.ticks_ms(), request_start_time)
+  metrics.record(tally[0], response.status, processing_time, tally[1], tally[2])
+  logging.debug(f"> {request.method} {request.path} ({response.status} {status_message}) [{processing_time}ms]")
+  return False
+
 
+async def _write_error(writer, status):
+  try:
+    status_message = status_message_map.get(status, "Unknown")
+    writer.write(f"HTTP/1.1 {status} {status_message}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("ascii"))
+    await writer.drain()
+  except Exception:
+    pass
+
+
+async def _close(writer):
+  try:
+    writer.close()
+    await writer.wait_closed()
+  except Exception:
+    pass
+
+
+# accepts a connection, enforcing the connection limit and timeouts and
+# making sure the socket is always closed (unless an event stream took it)
+async def _handle_connection(reader, writer):
+  global _open_connections
+  if _open_connections >= _max_connections:
+    counters["rejected"] += 1
+    await _write_error(writer, 503)
+    await _close(writer)
+    return
 
-# adds a new route to the routing table
-def add_route(path, handler, methods=["GET"]):
+  _open_connections += 1
+  handed_over = False
+  start_time = time.ticks_ms()
+  tally = [metrics.UNMATCHED, 0, 0]
+  status = None
+  # the slot is given back however the request ends, even cancelled,
+  # otherwise every failure would shrink the limit for good
+  try:
+    try:
+      handed_over = await _handle_request(reader, writer, tally)
+    except uasyncio.TimeoutError:
+      counters["timed_out"] += 1
+      status = 408
+    except _RequestError as e:
+      status = e.status
+    except Exception as e:
+      logging.error(f"> request failed: {e}")
+      status = 500
+    if status:
+      await _write_error(writer, status)
+      metrics.record(tally[0], status, time.ticks_diff(time.ticks_ms(), start_time), tally[1], tally[2])
+  finally:
+    _open_connections -= 1
+    if not handed_over:
+      await _close(writer)
+
+
+# adds a new route to the routing table. the raw body of requests to
+# upload routes is written to a spool file named in request.file, which
+# is deleted once the handler returns unless the handler renamed it
+def add_route(path, handler, methods=["GET"], upload=False):
   global _routes
-  _routes.append(Route(path, handler, methods))
+  _routes.append(Route(path, handler, methods, upload))
   # descending complexity order so most complex routes matched first
   _routes = sorted(_routes, key=lambda route: len(route.path_parts), reverse=True)
 
@@ -335,9 +710,9 @@ def set_callback(handler):
 
 
 # decorator shorthand for adding a route
-def route(path, methods=["GET"]):
+def route(path, methods=["GET"], upload=False):
   def _route(f):
-    add_route(path, f, methods=methods)
+    add_route(path, f, methods=methods, upload=upload)
     return f
   return _route
 
@@ -350,6 +725,23 @@ def catchall():
   return _catchall
   
 
+# adds a route serving the request metrics in the prometheus text format
+def enable_metrics(path="/metrics"):
+  def _metrics(request):
+    gauges = {"http_open_connections": _open_connections}
+    totals = {f"http_{name}_total": value for name, value in counters.items()}
+    return metrics.render(gauges, totals), 200, "text/plain; version=0.0.4"
+  add_route(path, _metrics)
+
+
+# adds a server-sent events endpoint that streams whatever producer()
+# returns (a str or anything json serialisable) to all subscribers
+def add_event_stream(path, producer, interval_ms=500, max_subscribers=4):
+  stream = EventStream(producer, interval_ms=interval_ms, max_subscribers=max_subscribers)
+  add_route(path, lambda request: stream)
+  return stream
+
+
 def redirect(url, status = 301):
   return Response("", status, {"Location": url})
 
@@ -360,7 +752,8 @@ def serve_file(file):
 
 def run(host = "0.0.0.0", port = 80):
   logging.info("> starting web server on port {}".format(port))
-  loop.create_task(uasyncio.start_server(_handle_request, host, port))
+  loop.create_task(uasyncio.start_server(_handle_connection, host, port, backlog=_max_connections))
+  loop.create_task(logging.flusher())
   loop.run_forever()
 
 def stop():
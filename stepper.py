@@ -1,5 +1,5 @@
 # In stepper.py
-from time import sleep_us
+from time import sleep_us, ticks_us
 class StepperMotor:
     
     full_sequence = [
@@ -25,25 +25,40 @@ class StepperMotor:
         self.coils = [Pin(in1, Pin.OUT), Pin(in2, Pin.OUT), Pin(in3, Pin.OUT), Pin(in4, Pin.OUT)]
         self.delay_us = delay_us
         self.endstop = Pin(endstop_pin, Pin.IN, Pin.PULL_UP) if endstop_pin is not None else None
+        # Index into half_sequence of the last coil pattern driven. Full steps
+        # are the odd (two coil) entries of half_sequence and every move is a
+        # whole number of coil cycles, so the phase always stays odd and the
+        # mode can change between moves without losing alignment.
+        self.phase = 7
         self.set_step_mode(mode)
         self.delay_us = delay_us
         self.end_stop_direction = endstop_direction
         self.invert_direction = False 
+        self.profiler = None  # optional profiler.StepProfiler
 
     def set_step_mode(self, mode):
-        if mode == "full":
-            self.step_sequence = self.full_sequence
-            print("Setting mode to Full Sequence")
-        else:
-            self.step_sequence = self.half_sequence
-            print("Setting mode to Half Sequence")
-        print(f"Mode: {self.step_sequence}")
+        self.mode = 'full' if mode == 'full' else 'half'
+        self.step_sequence = self.full_sequence if self.mode == 'full' else self.half_sequence
 
-    def move(self, steps, direction=1):
+    def move(self, steps, direction=1, mode=None):
+        # A step here is one coil cycle: 4 full steps or 8 half steps, so the
+        # distance is the same in either mode. mode overrides the motor's own
+        # step mode for this move only.
         if self.invert_direction:
             direction *= -1
-        
-        seq = self.step_sequence if direction > 0 else self.step_sequence[::-1]
+
+        if (mode or self.mode) == 'full':
+            stride, phases = 2 * direction, 4
+        else:
+            stride, phases = direction, 8
+        sequence = self.half_sequence
+        phase = self.phase
+
+        profiler = self.profiler
+        if profiler:
+            stamps = profiler.begin(self.delay_us)
+            capacity = profiler.capacity
+            count = 0
 
         for _ in range(int(steps)):
             # Only stop if moving in the end_stop_direction AND the endstop is triggered
@@ -52,21 +67,84 @@ class StepperMotor:
                 self.stop()
                 break
 
-            for step in seq:
+            for _ in range(phases):
+                phase = (phase + stride) & 7
                 try:
-                    self.set_step(step)
+                    self.set_step(sequence[phase])
+                    if profiler and count < capacity:
+                        stamps[count] = ticks_us()
+                        count += 1
                     sleep_us(self.delay_us)
                 except Exception as e:
                     print(f"Error during sleep: {e}")
+        self.phase = phase
         self.stop()
+        if profiler:
+            profiler.end(count)
 
 
     def stop(self):
         self.set_step((0, 0, 0, 0))
 
     def set_step(self, step):
-        for i, coil in enumerate(self.coils):
-            coil.value(step[i])
+        # indexed rather than enumerate(), which allocates on every phase
+        coils = self.coils
+        for i in range(4):
+            coils[i].value(step[i])
+
+    def is_endstop_triggered(self):
+        return self.endstop.value() if self.endstop else False
+
+class StepDirMotor:
+    """A stepper on a step/direction driver (A4988, DRV8825 and the like).
+
+    Has StepperMotor's interface, so GCodeInterpreter drives either. A
+    step here is one pulse, held high and then low for delay_us each;
+    mode is accepted and ignored, microstepping is set on the driver.
+    """
+
+    def __init__(self, step_pin, dir_pin, delay_us=500, endstop_pin=None, endstop_direction=1):
+        from machine import Pin
+
+        self.step_pin = Pin(step_pin, Pin.OUT)
+        self.dir_pin = Pin(dir_pin, Pin.OUT)
+        self.delay_us = delay_us
+        self.endstop = Pin(endstop_pin, Pin.IN, Pin.PULL_UP) if endstop_pin is not None else None
+        self.end_stop_direction = endstop_direction
+        self.invert_direction = False
+        self.mode = 'full'
+        self.profiler = None  # optional profiler.StepProfiler
+
+    def move(self, steps, direction=1, mode=None):
+        if self.invert_direction:
+            direction *= -1
+        self.dir_pin.value(1 if direction > 0 else 0)
+        pin = self.step_pin
+        delay = self.delay_us
+
+        profiler = self.profiler
+        if profiler:
+            stamps = profiler.begin(2 * delay)  # a pulse is high then low
+            capacity = profiler.capacity
+            count = 0
+
+        for _ in range(int(steps)):
+            if self.endstop and self.end_stop_direction == direction and self.endstop.value():
+                print("Endstop triggered — stopping movement")
+                break
+            pin.value(1)
+            if profiler and count < capacity:
+                stamps[count] = ticks_us()
+                count += 1
+            sleep_us(delay)
+            pin.value(0)
+            sleep_us(delay)
+        self.stop()
+        if profiler:
+            profiler.end(count)
+
+    def stop(self):
+        self.step_pin.value(0)
 
     def is_endstop_triggered(self):
-        return self.endstop.value() if self.endstop else False
\ No newline at end of file
+        return self.endstop.value() if self.endstop else False
@@ -0,0 +1,108 @@
+# template
+# from Pimoroni Phew!
+# https://www.github.com/pimoroni/phew
+# 20 June 2025
+# Kevin McAleer
+
+import os, time
+from . import logging
+
+# compiled templates keyed by filename, each entry is (mtime, chunks)
+_cache = {}
+
+# not every MicroPython port is built with compile(), fall back to
+# evaluating the expression source on each render when it is missing
+try:
+  _compile = compile
+except NameError:
+  _compile = None
+
+
+def _is_name(expression):
+  if not expression or expression[0].isdigit():
+    return False
+  for c in expression:
+    if not (c.isalpha() or c.isdigit() or c == "_"):
+      return False
+  return True
+
+
+def _mtime(template):
+  try:
+    return os.stat(template)[8]
+  except OSError:
+    return None
+
+
+# splits a template into a list of chunks. literal text is kept as bytes,
+# plain {{name}} tags become the name as a str so they can be looked up
+# without calling eval and anything more complex is compiled once up front
+def compile_template(data):
+  chunks = []
+  token_caret = 0
+  while True:
+    # find the next tag that needs evaluating
+    start = data.find(b"{{", token_caret)
+    end = data.find(b"}}", start)
+    if start == -1 or end == -1:
+      if token_caret < len(data):
+        chunks.append(data[token_caret:])
+      break
+
+    if start > token_caret:
+      chunks.append(data[token_caret:start])
+
+    expression = data[start + 2:end].strip().decode()
+    if _is_name(expression):
+      chunks.append(expression)
+    elif _compile:
+      chunks.append(_compile(expression, "<template>", "eval"))
+    else:
+      chunks.append((expression,))
+    token_caret = end + 2
+  return chunks
+
+
+# returns the compiled chunks for a template, only reading and compiling
+# the file again if its modification time has changed
+def load_template(template):
+  mtime = _mtime(template)
+  cached = _cache.get(template)
+  if cached and cached[0] == mtime:
+    return cached[1]
+
+  with open(template, "rb") as f:
+    chunks = compile_template(f.read())
+  _cache[template] = (mtime, chunks)
+  return chunks
+
+
+def clear_cache():
+  _cache.clear()
+
+
+# renders a template as a generator of chunks so the page can be streamed
+# straight to the client without building the whole response in memory
+def render_template(template, **kwargs):
+  start_time = time.ticks_ms()
+
+  for chunk in load_template(template):
+    if isinstance(chunk, bytes):
+      yield chunk
+      continue
+
+    if isinstance(chunk, str):
+      result = kwargs[chunk] if chunk in kwargs else eval(chunk, globals(), kwargs)
+    elif isinstance(chunk, tuple):
+      result = eval(chunk[0], globals(), kwargs)
+    else:
+      result = eval(chunk, globals(), kwargs)
+
+    if type(result).__name__ == "generator":
+      for part in result:
+        yield part
+    else:
+      yield str(result)
+
+  render_time = time.ticks_ms() - start_time
+  logging.debug(f"> rendered template: {template} ({render_time}ms)")
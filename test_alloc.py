@@ -0,0 +1,96 @@
+# Check that the serial main loop does not allocate for motion lines
+# Feeds G-code through GrblController.step() from a buffer, with motors
+# whose coils are not connected, and counts heap allocations. Motion
+# lines, '?' status reports and idle passes must not allocate at all:
+# the heap is locked while they run, so the first allocation raises
+# MemoryError and the line that did it is reported.
+
+import gc, micropython
+from time import ticks_us, ticks_diff
+from stepper import StepperMotor
+from gcode_interpreter import GCodeInterpreter
+from controller import GrblController
+
+LINES = [
+    b"G90", b"G0 X10 Y10", b"G1 Z0", b"G1 X10.5 Y12.2727", b"G1 X12.0455", b"g1 y20.5 x5",
+    b"G91", b"G1 X-0.5 Y0.25", b"G0 Z1", b"G01 X1 Y-1", b"?", b"G1 X0.1", b"G90", b"G0 X0 Y0",
+]
+ROUNDS = 20
+
+
+class NoPin:
+    def value(self, level=None):
+        return 0
+
+
+class ScriptStream:
+    """Serves bytes from a buffer one at a time and throws replies away."""
+
+    name = 'TEST'
+    rx_buffer = 128
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def any(self):
+        return len(self.data) - self.pos
+
+    def readinto(self, buf):
+        buf[0] = self.data[self.pos]
+        self.pos += 1
+        return 1
+
+    def write(self, data):
+        return len(data)
+
+    def set_raw(self, raw):
+        pass
+
+
+def motor(*pins):
+    m = StepperMotor(*pins, delay_us=0)
+    m.coils = [NoPin(), NoPin(), NoPin(), NoPin()]
+    return m
+
+
+gcode = GCodeInterpreter(motor(4, 5, 6, 7), motor(0, 1, 2, 3), motor(8, 9, 10, 11))
+gcode.steps_per_mm = 11
+stream = ScriptStream(b"\n".join(LINES * ROUNDS) + b"\n")
+controller = GrblController(gcode, stream)
+controller.banner_sent = True  # so '?' is answered with a status report
+
+gc.collect()
+gc.disable()
+before = gc.mem_alloc()
+handled = 0
+start = ticks_us()
+micropython.heap_lock()
+try:
+    while stream.any():
+        if controller.step():
+            handled += 1
+    controller.step()  # an idle pass
+    micropython.heap_unlock()
+    elapsed = ticks_diff(ticks_us(), start)
+    allocated = gc.mem_alloc() - before
+    print("{} lines, {} bytes allocated, {} us/line".format(handled, allocated, elapsed // handled))
+    print("PASS" if allocated == 0 else "FAIL")
+except MemoryError:
+    micropython.heap_unlock()
+    print("FAIL: line {} allocated: {}".format(handled + 1, LINES[handled % len(LINES)]))
+gc.enable()
+
+# the same lines through parse_line, for comparison
+gcode.verbose = False
+lines = [line.decode() for line in LINES]
+gc.collect()
+before = gc.mem_alloc()
+start = ticks_us()
+for _ in range(ROUNDS):
+    for line in lines:
+        if line != '?':
+            gcode.parse_line(line)
+elapsed = ticks_diff(ticks_us(), start)
+print("parse_line: {} bytes/line, {} us/line".format(
+    (gc.mem_alloc() - before) // (ROUNDS * len(lines)), elapsed // (ROUNDS * len(lines))))
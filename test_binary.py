@@ -0,0 +1,63 @@
+# Compare the per-segment cost of ASCII G-code and binary records on the Pico
+# Both paths run the real interpreter with motors that do not move, so
+# only parsing, checking and bookkeeping are timed. Also checks that a
+# record's delay is dropped when the stream ends.
+
+import gc, io
+from time import ticks_us, ticks_diff
+from gcode_interpreter import GCodeInterpreter
+from binary_protocol import BinaryReceiver, encode_record, RECORD_SIZE, TRAVEL, END
+
+SEGMENTS = 500
+
+
+class StillMotor:
+    delay_us = 1500
+
+    def move(self, steps, direction=1, mode=None):
+        pass
+
+
+class NullWriter:
+    def write(self, data):
+        return len(data)
+
+
+gcode = GCodeInterpreter(StillMotor(), StillMotor(), StillMotor())
+gcode.steps_per_mm = 11
+gcode.verbose = False
+out = NullWriter()
+
+# ASCII: the line as test_usb.py receives it, parsed and answered
+lines = ["G1 X{:.4f} Y{:.4f}".format((i % 7) * 0.1 + 0.05, -(i % 7) * 0.1 - 0.05) for i in range(SEGMENTS)]
+gc.collect()
+free = gc.mem_free()
+start = ticks_us()
+for line in lines:
+    gcode.parse_line(line.strip())
+    out.write("ok\r\n")
+ascii_us = ticks_diff(ticks_us(), start)
+ascii_bytes = free - gc.mem_free()
+
+# binary: the same moves as records read from a buffer
+data = bytearray(RECORD_SIZE * (SEGMENTS + 1))
+view = memoryview(data)
+for i in range(SEGMENTS):
+    step = (i % 7) + 1
+    encode_record(view[i * RECORD_SIZE:(i + 1) * RECORD_SIZE], i, step, -step, TRAVEL if i % 2 else 0,
+                  700 if i == SEGMENTS - 1 else 0)
+encode_record(view[SEGMENTS * RECORD_SIZE:], SEGMENTS, flags=END)
+receiver = BinaryReceiver(gcode, io.BytesIO(data), out, lambda: True)
+gc.collect()
+free = gc.mem_free()
+start = ticks_us()
+receiver.run()
+binary_us = ticks_diff(ticks_us(), start)
+binary_bytes = free - gc.mem_free()
+
+print("ASCII:  {} us/segment, {} bytes allocated/segment".format(ascii_us // SEGMENTS, ascii_bytes // SEGMENTS))
+print("binary: {} us/segment, {} bytes allocated/segment".format(binary_us // SEGMENTS, binary_bytes // SEGMENTS))
+print("records executed:", receiver.records, "errors:", receiver.errors)
+# a record's delay must not outlast the stream, ASCII moves go back to theirs
+print("delay restored:", "PASS" if gcode.motor_x.delay_us == gcode.motor_y.delay_us == 1500 else "FAIL",
+      gcode.motor_x.delay_us, gcode.motor_y.delay_us)
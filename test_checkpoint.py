@@ -0,0 +1,149 @@
+# Check job checkpoints on the Pico's flash
+# Runs a job on motors that do not move, "resets" partway through by
+# abandoning the queue, then recovers and resumes the job with a new queue
+# as test_wifi2.py would after a reboot. The resumed job must finish at
+# the same position as an uninterrupted run. The file has comments with
+# non-ASCII characters in, so the checkpoint must count bytes to land on
+# the start of a line. Also checks that a job with a BOM and a comment
+# that is not UTF-8 is checked as it is run, that a record cut short is
+# skipped, and times a checkpoint write.
+
+import os
+import uasyncio
+from time import ticks_us, ticks_diff
+from gcode_interpreter import GCodeInterpreter
+from checkpoint import Checkpoint, RECORD_SIZE
+from jobs import JobQueue
+
+PATH = "test_checkpoint.bin"
+JOB_DIR = "test_jobs"
+
+
+class StillMotor:
+    """Moves nowhere; its endstop closes after a few cycles towards it."""
+
+    delay_us = 1500
+
+    def __init__(self):
+        self.cycles = 0
+
+    def move(self, steps, direction=1, mode=None):
+        self.cycles += 1
+
+    def stop(self):
+        pass
+
+    def is_endstop_triggered(self):
+        return self.cycles % 5 == 0
+
+
+def interpreter():
+    gcode = GCodeInterpreter(StillMotor(), StillMotor(), StillMotor())
+    gcode.steps_per_mm = 11
+    gcode.verbose = False
+    return gcode
+
+
+def upload(text):
+    with open("upload.tmp", "w") as f:
+        f.write(text)
+    return "upload.tmp"
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def finish(queue, job):
+    task = uasyncio.create_task(queue.run())
+    while job.state not in ('done', 'failed'):
+        await uasyncio.sleep_ms(0)
+    task.cancel()
+
+
+async def interrupt(queue, job, line):
+    # stop the job where it is, without the clean up a finished or
+    # failed job gets, as a reset would
+    task = uasyncio.create_task(queue._execute(job))
+    while job.line < line:
+        await uasyncio.sleep_ms(0)
+    task.cancel()
+    await uasyncio.sleep_ms(0)
+
+
+lines = ["G90", "G0 X5 Y5", "G1 Z0 ; pen down, 0.3 mm ±0.1"]
+for i in range(60):
+    lines.append("G1 X{} Y{}".format(5 + i % 10, 5 + i // 10))
+    if i % 10 == 0:
+        lines.append("; row {} — 10 × 1 mm".format(i // 10))
+lines += ["G0 Z1", "G91", "G0 X-2 Y3"]
+text = "\n".join(lines) + "\n"
+
+remove(PATH)
+for name in os.listdir(JOB_DIR) if JOB_DIR in os.listdir() else ():
+    remove(JOB_DIR + "/" + name)
+
+# uninterrupted
+gcode = interpreter()
+queue = JobQueue(gcode, JOB_DIR)
+job = queue.add(upload(text))
+uasyncio.run(finish(queue, job))
+expected = dict(gcode.position)
+print("uninterrupted", "PASS" if job.state == 'done' else "FAIL", job.state, job.error)
+
+# interrupted after 30 lines, checkpointing every line
+gcode = interpreter()
+queue = JobQueue(gcode, JOB_DIR, Checkpoint(PATH, interval_ms=0))
+job = queue.add(upload(text))
+uasyncio.run(interrupt(queue, job, 30))
+print("interrupted at line", job.line, "position", gcode.position)
+
+# after the "reset": a new interpreter at 0, 0 and a new queue
+gcode = interpreter()
+queue = JobQueue(gcode, JOB_DIR, Checkpoint(PATH, interval_ms=0))
+recovered = queue.recover()
+print("recovered:", recovered and recovered.progress())
+with open(recovered.path, "rb") as f:
+    data = f.read()
+at_line = data[recovered.offset - 1] == 10 and data[:recovered.offset].count(b"\n") == recovered.line
+print("checkpoint at a line start:", "PASS" if at_line else "FAIL", recovered.offset)
+queue.resume(recovered)
+uasyncio.run(finish(queue, recovered))
+print("resumed:", recovered.state, gcode.position, "expected", expected)
+resumed_ok = recovered.state == 'done' and gcode.position == expected
+print("resume", "PASS" if resumed_ok else "FAIL")
+print("cleared after the job:", Checkpoint(PATH).load() is None)
+
+# the check and the run read the same bytes: a BOM, and a comment that
+# is not UTF-8 (a Latin-1 plus-minus sign)
+gcode = interpreter()
+queue = JobQueue(gcode, JOB_DIR)
+with open("upload.tmp", "wb") as f:
+    f.write(b"\xef\xbb\xbfG90\nG0 X3 Y4\nG1 Y5 ; \xb10.1 mm\n")
+job = queue.add("upload.tmp")
+uasyncio.run(finish(queue, job))
+bytes_ok = job.state == 'done' and (gcode.position['X'], gcode.position['Y']) == (33, 55)
+print("checked as run", "PASS" if bytes_ok else "FAIL", job.state, job.error, gcode.position)
+
+# a torn write leaves the record before it
+checkpoint = Checkpoint(PATH, interval_ms=0)
+gcode.position = {'X': 1, 'Y': 2, 'Z': 1}
+checkpoint.save(7, 100, 10, gcode)
+gcode.position = {'X': 3, 'Y': 4, 'Z': 0}
+checkpoint.save(7, 200, 20, gcode)
+slot = (checkpoint._slot - 1) % checkpoint.slots
+with open(PATH, "r+b") as f:
+    f.seek(slot * RECORD_SIZE + 8)
+    f.write(b"\xff\xff")
+record = Checkpoint(PATH).load()
+print("torn record", "PASS" if record and record['line'] == 10 else "FAIL", record)
+
+# cost of a write
+start = ticks_us()
+for i in range(16):
+    checkpoint.save(7, 300 + i, 30 + i, gcode)
+print("checkpoint write: {} us".format(ticks_diff(ticks_us(), start) // 16))
+remove(PATH)
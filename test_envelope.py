@@ -0,0 +1,94 @@
+# Check that host/svg2gcode.py and host/fill.py write inside the soft limits
+# Converts drawings that fill the page and run off it, and feeds the
+# G-code to an interpreter homed as test_usb.py homes the plotter (X
+# endstop at the -X end, Y at the +Y end) with soft limits on, as
+# test_wifi2.py runs jobs. No line may be refused. Also checks that
+# plotter.envelope() agrees with GCodeInterpreter.limits() for either
+# endstop wiring. Runs on a PC, the host tools need numpy:
+#
+#   python test_envelope.py
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, "host")
+import fill  # noqa: E402
+import plotter  # noqa: E402
+import svg2gcode  # noqa: E402
+from gcode_interpreter import GCodeInterpreter, SoftLimitError  # noqa: E402
+
+HOME_CYCLES = 30
+
+DRAWINGS = {
+    # the whole page, edge to edge
+    'page': '<rect x="0" y="0" width="80" height="80"/>',
+    # a square in the top left and a circle past the bottom right corner
+    'off the page': '<rect x="10" y="10" width="30" height="30"/><circle cx="75" cy="75" r="15"/>',
+}
+
+
+class CountMotor:
+    delay_us = 1500
+
+    def __init__(self, endstop_direction=1):
+        self.end_stop_direction = endstop_direction
+        self.steps = 0
+
+    def move(self, steps, direction=1, mode=None):
+        self.steps += steps * direction
+
+    def stop(self):
+        pass
+
+    def is_endstop_triggered(self):
+        return self.steps * self.end_stop_direction >= HOME_CYCLES
+
+
+def interpreter(home=plotter.HOME):
+    gcode = GCodeInterpreter(CountMotor(home[0]), CountMotor(home[1]), CountMotor())
+    gcode.steps_per_mm = plotter.STEPS_PER_MM
+    gcode.verbose = False
+    gcode.soft_limits = True
+    gcode.set_travel(*plotter.WORK_AREA_MM)
+    gcode.home()
+    return gcode
+
+
+def svg(body):
+    f = tempfile.NamedTemporaryFile('w', suffix='.svg', delete=False)
+    with f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="80mm" height="80mm" '
+                'viewBox="0 0 80 80">{}</svg>'.format(body))
+    return f.name
+
+
+def refused(lines, home=plotter.HOME):
+    """The first line the interpreter refuses, or None."""
+    gcode = interpreter(home)
+    for number, line in enumerate(lines, 1):
+        try:
+            gcode.parse_line(line)
+        except SoftLimitError as e:
+            return "line {} {}: {}".format(number, line, e)
+    return None
+
+
+for home in ((-1, 1), (1, -1)):
+    limits = interpreter(home).limits()
+    print("envelope {}:".format(home), "PASS" if plotter.envelope(plotter.WORK_AREA_MM, home) == limits
+          else "FAIL", plotter.envelope(plotter.WORK_AREA_MM, home), limits)
+
+for name, body in DRAWINGS.items():
+    path = svg(body)
+    try:
+        for home in ((-1, 1), (1, -1)):
+            outline = list(svg2gcode.to_gcode(svg2gcode.convert(path, home=home)))
+            strokes = fill.fill(fill.load_svg(path, home=home), 'hatch', outline=True)
+            filled = list(svg2gcode.to_gcode(fill.to_polylines(strokes, home=home)))
+            for tool, lines in (('svg2gcode', outline), ('fill', filled)):
+                error = refused(lines, home)
+                print("{} {} {}:".format(tool, name, home), "PASS" if not error and len(lines) > 4 else "FAIL",
+                      error or "{} lines".format(len(lines)))
+    finally:
+        os.remove(path)
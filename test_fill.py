@@ -0,0 +1,87 @@
+# Check host/fill.py's concentric fill on curved, concave outlines
+# Fills closed paths made of a cubic, an arc and lines, one of them
+# crossing itself, drawn both ways round, and checks that the fill ends,
+# that every ring point is inside the outline and at least half the pen
+# width in from it, and that the direction a path is drawn in makes no
+# difference. Also checks that shapes with fill none are not filled.
+# Runs on a PC, fill.py needs numpy:
+#
+#   python test_fill.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, "host")
+import numpy as np  # noqa: E402
+import fill  # noqa: E402
+
+PEN = 0.5
+SHAPES = {
+    # a kidney: concave between the cubic and the arc
+    'concave': "M 20 45 C 30 30 50 60 60 45 A 10 10 0 0 1 55 70 L 40 60 L 25 70 Z",
+    # the same, backwards
+    'reversed': "M 20 45 L 25 70 L 40 60 L 55 70 A 10 10 0 0 0 60 45 C 50 60 30 30 20 45 Z",
+    # the cubic crosses the closing line, so the lobes wind opposite ways
+    'crossing': "M 60.8 55.8 C 20.4 39.6 36.0 52.1 57.3 15.6 A 5.4 17.5 0 1 0 51.7 26.0 L 58.1 45.5 Z",
+}
+
+
+def load(d, extra=''):
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" width="80mm" height="80mm" viewBox="0 0 80 80">'
+           '<path transform="rotate(20 40 55)" d="{}"/>{}</svg>'.format(d, extra))
+    f = tempfile.NamedTemporaryFile('w', suffix='.svg', delete=False)
+    with f:
+        f.write(svg)
+    try:
+        return fill.load_svg(f.name, flip_y=False)
+    finally:
+        os.remove(f.name)
+
+
+def inside(outlines, points):
+    """Nonzero winding of every point, along rays towards +x."""
+    a, b = outlines.a, outlines.b
+    p = points[:, None, :]
+    up = (a[:, 1] <= p[..., 1]) & (b[:, 1] > p[..., 1])
+    down = (b[:, 1] <= p[..., 1]) & (a[:, 1] > p[..., 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = a[:, 0] + (p[..., 1] - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    ahead = (up | down) & (x > p[..., 0])
+    return np.sum(np.where(ahead, np.where(up, 1, -1), 0), axis=1) != 0
+
+
+def distance(outlines, points):
+    a, b = outlines.a, outlines.b
+    d = b - a
+    p = points[:, None, :]
+    t = np.clip(np.sum((p - a) * d, axis=2) / np.sum(d * d, axis=1), 0, 1)
+    gap = a + t[..., None] * d - p
+    return np.sqrt(np.min(np.sum(gap * gap, axis=2), axis=1))
+
+
+strokes = {}
+for name, d in SHAPES.items():
+    outlines = load(d)
+    start = time.time()
+    result = fill.concentric(outlines, 1.0, PEN)
+    took = time.time() - start
+    strokes[name] = len(result)
+    points = result.points
+    outside = int(np.sum(~inside(outlines, points)))
+    close = int(np.sum(distance(outlines, points) < PEN / 2 * 0.97))
+    print("{}:".format(name), "PASS" if len(result) and not outside and not close else "FAIL",
+          "{} strokes, {} points outside, {} too close, {:.2f}s".format(len(result), outside, close, took))
+
+print("either way round:", "PASS" if strokes['concave'] == strokes['reversed'] else "FAIL",
+      strokes['concave'], strokes['reversed'])
+
+# the same kidney with unfilled shapes around it, by attribute, inherited and by style
+unfilled = ('<circle cx="10" cy="10" r="5" fill="none"/>'
+            '<g fill="none"><rect x="60" y="5" width="10" height="10"/></g>'
+            '<rect x="5" y="60" width="10" height="10" style="stroke:black;fill:none"/>')
+outlines = load(SHAPES['concave'], unfilled)
+result = fill.concentric(outlines, 1.0, PEN)
+print("fill none:", "PASS" if outlines.rings == 1 and len(result) == strokes['concave'] else "FAIL",
+      outlines.rings, len(result))
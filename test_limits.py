@@ -0,0 +1,69 @@
+# Check the soft limit envelope against where home() puts the origin
+# Homes on motors that only count their steps, with the endstops where
+# test_usb.py has them: X at the -X end and Y at the +Y end, so the bed
+# is at positive X and negative Y. Moves into the bed must be accepted
+# and moves past the endstops refused, for live lines and for a job's
+# dry run on copy().
+
+from gcode_interpreter import GCodeInterpreter, SoftLimitError
+
+HOME_CYCLES = 30  # coil cycles from the start to each endstop
+
+
+class CountMotor:
+    delay_us = 1500
+
+    def __init__(self, endstop_direction=1):
+        self.end_stop_direction = endstop_direction
+        self.steps = 0
+
+    def move(self, steps, direction=1, mode=None):
+        self.steps += steps * direction
+
+    def stop(self):
+        pass
+
+    def is_endstop_triggered(self):
+        return self.steps * self.end_stop_direction >= HOME_CYCLES
+
+
+def interpreter(x_direction, y_direction):
+    gcode = GCodeInterpreter(CountMotor(x_direction), CountMotor(y_direction), CountMotor())
+    gcode.steps_per_mm = 11
+    gcode.verbose = False
+    gcode.soft_limits = True
+    gcode.set_travel(80, 80)
+    gcode.home()
+    gcode.parse_line("G90")
+    return gcode
+
+
+def refused(gcode, line):
+    try:
+        gcode.plan(line)
+    except SoftLimitError:
+        return True
+    return False
+
+
+gcode = interpreter(-1, 1)
+home = (gcode.motor_x.steps, gcode.motor_y.steps)
+gcode.parse_line("G1 X5 Y-5")
+moved = (gcode.motor_x.steps - home[0], gcode.motor_y.steps - home[1])
+print("into the bed:", "PASS" if moved == (55, -55) else "FAIL", moved)
+
+gcode.parse_line("G1 X80 Y-80")
+print("far corner:", "PASS" if gcode.position['X'] == 880 and gcode.position['Y'] == -880 else "FAIL",
+      gcode.position)
+
+past = [line for line in ("G1 Y5", "G1 X-5", "G1 Y-81", "G1 X81") if not refused(gcode, line)]
+print("past the envelope refused:", "PASS" if not past else "FAIL", past)
+
+shadow = gcode.copy()
+print("dry run:", "PASS" if not refused(shadow, "G1 X10 Y-10") and refused(shadow, "G1 Y10")
+      else "FAIL", shadow.limits())
+
+# endstops at the other ends put the bed the other way round
+other = interpreter(1, -1)
+ok = not refused(other, "G1 X-5 Y5") and refused(other, "G1 X5") and refused(other, "G1 Y-5")
+print("other endstops:", "PASS" if ok else "FAIL", other.limits())
@@ -0,0 +1,91 @@
+# Check stored macros against parsing the same G-code, and time both
+# Defines square.gcode as a macro, runs it and the file's lines through
+# parse_line on motors that only record their moves, and compares the
+# moves and final positions. Then times a run from RAM, from flash and
+# as text.
+
+from time import ticks_us, ticks_diff
+from gcode_interpreter import GCodeInterpreter
+from macros import MacroStore
+
+ROUNDS = 20
+
+
+class LogMotor:
+    delay_us = 1500
+
+    def __init__(self, log):
+        self.log = log
+        self.cycles = 0
+
+    def move(self, steps, direction=1, mode=None):
+        self.log.append((id(self), steps, direction, mode))
+        self.cycles += 1
+
+    def stop(self):
+        pass
+
+    def is_endstop_triggered(self):
+        return self.cycles % 3 == 0
+
+
+def interpreter():
+    log = []
+    gcode = GCodeInterpreter(LogMotor(log), LogMotor(log), LogMotor(log))
+    gcode.steps_per_mm = 11
+    gcode.verbose = False
+    return gcode, log
+
+
+def moves(log):
+    # motor ids differ between interpreters, keep their order of appearance
+    ids = []
+    for entry in log:
+        if entry[0] not in ids:
+            ids.append(entry[0])
+    return [(ids.index(entry[0]),) + entry[1:] for entry in log]
+
+
+with open("square.gcode") as f:
+    lines = [line.split(';', 1)[0].strip() for line in f]
+lines = [line for line in lines if line]
+
+macros = MacroStore("test_macros")
+print("segments:", macros.define("square", lines, 11))
+
+# as text, '$H' the way the controller does it
+text, text_log = interpreter()
+for line in lines:
+    if line == '$H':
+        text.home()
+    else:
+        text.parse_line(line)
+
+macro, macro_log = interpreter()
+macros.run("square", macro)
+same = moves(text_log) == moves(macro_log) and text.position == macro.position
+print("same moves:", "PASS" if same else "FAIL", macro.position)
+
+start = ticks_us()
+for _ in range(ROUNDS):
+    for line in lines:
+        if line == '$H':
+            text.home()
+        else:
+            text.parse_line(line)
+text_us = ticks_diff(ticks_us(), start) // ROUNDS
+
+start = ticks_us()
+for _ in range(ROUNDS):
+    macros.run("square", macro)
+ram_us = ticks_diff(ticks_us(), start) // ROUNDS
+
+start = ticks_us()
+for _ in range(ROUNDS):
+    macros._cache.clear()
+    macros._order.clear()
+    macros.run("square", macro)
+flash_us = ticks_diff(ticks_us(), start) // ROUNDS
+
+print("text: {} us, macro from RAM: {} us, from flash: {} us".format(text_us, ram_us, flash_us))
+macros.delete("square")
@@ -0,0 +1,164 @@
+# Check stepping on the second core against stepping on this one
+# Runs the same G-code through an interpreter that steps its own motors
+# and one with a motion.StepGenerator, on motors that count the coil
+# patterns they drive, and compares where the motors end up. While the
+# generator works, snapshots are read over and over: every move goes as
+# far in X as in Y, so a snapshot with X and Y apart would be half of
+# one move and half of another. Also reports how long this core
+# was busy queueing the lines against how long the motors took. Last, a
+# motor that raises partway through must stop the generator with an
+# error on this core, not leave it waiting.
+#
+# Runs on the Pico, where the coils are not connected, and on a PC with
+# CPython threads and host/sim.py's pins:
+#
+#   python test_motion.py
+
+import sys
+try:
+    import rp2  # noqa: F401
+    PICO = True
+except ImportError:
+    sys.path.insert(0, "host")
+    import sim
+    sim.clock.realtime = True  # sleeps on both threads are real sleeps
+    PICO = False
+
+from time import ticks_us, ticks_diff, sleep_us
+from stepper import StepperMotor
+from gcode_interpreter import GCodeInterpreter
+from motion import SegmentRing, StepGenerator, StepGeneratorError, X, Y, DONE
+
+MOVES = 120
+DELAY_US = 20
+
+
+class FailingMotor(StepperMotor):
+    """Raises on its fifth move."""
+
+    def __init__(self, *pins):
+        super().__init__(*pins, delay_us=DELAY_US)
+        if PICO:
+            self.coils = [NoPin(), NoPin(), NoPin(), NoPin()]
+        self.moves = 0
+
+    def move(self, steps, direction=1, mode=None):
+        self.moves += 1
+        if self.moves == 5:
+            raise OSError("driver fault")
+        super().move(steps, direction, mode)
+
+
+class NoPin:
+    def value(self, level=None):
+        return 0
+
+
+class CountingMotor(StepperMotor):
+    """Counts the half steps it drives, from the coil patterns."""
+
+    def __init__(self, *pins):
+        super().__init__(*pins, delay_us=DELAY_US)
+        if PICO:
+            self.coils = [NoPin(), NoPin(), NoPin(), NoPin()]
+        self.half_steps = 0
+        self._last = self.phase
+
+    def set_step(self, step):
+        super().set_step(step)
+        sequence = self.half_sequence
+        for i in range(8):
+            if sequence[i] == step:
+                # phases move by one (half) or two (full) entries either way
+                self.half_steps += (i - self._last + 4) % 8 - 4
+                self._last = i
+                break
+
+
+def interpreter():
+    gcode = GCodeInterpreter(CountingMotor(4, 5, 6, 7), CountingMotor(0, 1, 2, 3),
+                             CountingMotor(8, 9, 10, 11))
+    gcode.steps_per_mm = 11
+    gcode.verbose = False
+    return gcode
+
+
+def counts(gcode):
+    return (gcode.motor_x.half_steps, gcode.motor_y.half_steps, gcode.motor_z.half_steps)
+
+
+lines = ["G91", "G1 Z-1"]
+for i in range(MOVES):
+    d = (i * 7) % 13 - 6  # tenths of a mm, both ways
+    lines.append("G{} X{} Y{}".format(i % 2, d / 10, d / 10))
+lines.append("G0 Z1")
+
+# the ring on its own: in order, and full one short of its size
+ring = SegmentRing(4)
+pushed = [ring.push(0, i, 0, 0, 0, 0, 0) for i in range(4)]
+segment = [0] * 7
+popped = []
+while ring.pop(segment):
+    popped.append(segment[1])
+print("ring:", "PASS" if pushed == [True, True, True, False] and popped == [0, 1, 2] else "FAIL")
+
+# on this core
+single = interpreter()
+start = ticks_us()
+for line in lines:
+    single.parse_line(line)
+single_us = ticks_diff(ticks_us(), start)
+
+# on the second core
+dual = interpreter()
+stepper = dual.stepper = StepGenerator(dual)
+stepper.start()
+snapshot = stepper.snapshot()
+snapshots = torn = 0
+start = ticks_us()
+for line in lines:
+    dual.parse_line(line)
+    stepper.snapshot(snapshot)
+    snapshots += 1
+    if snapshot[X] != snapshot[Y]:
+        torn += 1
+queued_us = ticks_diff(ticks_us(), start)
+while not stepper.idle():
+    stepper.snapshot(snapshot)
+    snapshots += 1
+    if snapshot[X] != snapshot[Y]:
+        torn += 1
+    sleep_us(10)  # on a PC, let go of the GIL
+dual_us = ticks_diff(ticks_us(), start)
+stepper.snapshot(snapshot)
+stepper.stop()
+
+position = [snapshot[X], snapshot[Y]]
+same = counts(single) == counts(dual) and single.position == dual.position
+print("same steps:", "PASS" if same else "FAIL", counts(dual), counts(single))
+print("snapshot at the end:", "PASS" if position == [dual.position['X'], dual.position['Y']]
+      and snapshot[DONE] == stepper.pushed else "FAIL", position)
+print("torn snapshots:", "PASS" if not torn else "FAIL", torn, "of", snapshots)
+print("one core: {} us, two: {} us, this core busy queueing for {} us".format(
+    single_us, dual_us, queued_us))
+
+# a move that raises on the second core
+failing = interpreter()
+failing.motor_x = FailingMotor(4, 5, 6, 7)
+stepper = failing.stepper = StepGenerator(failing)
+stepper.start()
+error = None
+try:
+    for line in lines:
+        failing.parse_line(line)
+    failing.drain()
+except StepGeneratorError as e:
+    error = e
+position = [failing.position['X'], failing.position['Y']]
+print("move failure reported:", "PASS" if error and not stepper.running() and stepper.idle()
+      else "FAIL", error, position)
+stepper.start()
+failing.parse_line("G1 X1")
+failing.drain()
+print("restarted:", "PASS" if failing.position['X'] == position[0] + 11 else "FAIL")
+stepper.stop()
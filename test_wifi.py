@@ -8,6 +8,7 @@ from machine import WDT, Pin
 from wifi_config import WIFI_SSID, WIFI_PASSWORD
 from web import connect_to_wifi, is_connected_to_wifi, get_ip_address
 from time import sleep
+from phew.template import render_template
 
 connect_to_wifi(WIFI_SSID, WIFI_PASSWORD)
 
@@ -17,11 +18,6 @@ if not is_connected_to_wifi():
 
 print(f"connected to Wifi! - IP is {get_ip_address()}")
 
-# Read web page
-f = open("index.html","r")
-html = f.read()
-f.close()
-
 status = "IDLE"
 
 onboard = Pin("LED", Pin.OUT, value=0)
@@ -41,12 +37,10 @@ async def serve_client(reader, writer):
     if jog_up == 6: print("jog up")
     if jog_down == 6: print("jog down")
     
-    response = html % (status)
-    print(response)
     writer.write('HTTP/1.0 200 OK\r\nContent-type: text/html\r\n\r\n')
-    writer.write(response)
-    
-    await writer.drain()
+    for chunk in render_template("index.html", status=status):
+        writer.write(chunk)
+        await writer.drain()
     await writer.wait_closed()
     print('Client Disconnected')
 
@@ -8,31 +8,161 @@
 #
 # with your wifi details instead of <ssid> and <password>.
 
-from phew import server, connect_to_wifi
+from phew import server, logging, connect_to_wifi
 from phew.template import render_template
 
 from wifi_config import WIFI_SSID, WIFI_PASSWORD
+from stepper import StepperMotor
+from gcode_interpreter import GCodeInterpreter
+from jobs import JobQueue
+from checkpoint import Checkpoint
+from jog import JogQueue
+from macros import MacroStore
+from gcode_interpreter import SoftLimitError
+from profiler import StepProfiler
+import json
 
 connect_to_wifi(WIFI_SSID, WIFI_PASSWORD)
 
+motor_y = StepperMotor(0, 1, 2, 3, endstop_pin=16, endstop_direction=1)
+motor_x = StepperMotor(4, 5, 6, 7, endstop_pin=15, endstop_direction=-1)
+motor_z = StepperMotor(8, 9, 10, 11)
+gcode = GCodeInterpreter(motor_x, motor_y, motor_z)
+gcode.steps_per_mm = 11
+# refuse jobs that would run off the 80 x 80mm bed before they start
+gcode.soft_limits = True
+gcode.set_travel(80, 80)
+macros = MacroStore()
+# the control pad's jogs and commands, see POST /api/control
+pad = JogQueue(gcode, macros=macros)
+# a job cut short by a reset comes back as 'interrupted', resume it
+# with POST /api/jobs/<id>/resume or cancel it
+jobs = JobQueue(gcode, checkpoint=Checkpoint(), macros=macros, pad=pad)
+recovered = jobs.recover()
+if recovered:
+  logging.info("job {} interrupted at line {}".format(recovered.id, recovered.line))
+profiler = StepProfiler()
+
 message = "booted up"
+status = "IDLE"
+
+# live position and state pushed to the web page, see index.html
+def plotter_status():
+  job = jobs.current.progress() if jobs.current else None
+  state = "Run" if job and job["state"] == "running" else gcode.state
+  return {"state": state, "position": gcode.position, "status": status, "job": job}
+
+server.add_event_stream("/events", plotter_status, interval_ms=250)
+server.enable_metrics()
 
 # basic response with status code and content type
 @server.route("/", methods=["GET", "POST"])
 def basic(request):
 #   return "Gosh, a request", 200, "text/html"
-  return await render_template("index.html", status="IDLE")
+  return render_template("index.html", status="IDLE")
+
+@server.route("/log", methods=["GET"])
+def log(request):
+  return logging.read_log(), 200, "text/plain"
 
 @server.route("/messages", methods=["GET"])
 def messages(request):
     return messages, 200, "text/html"
 
 
+def json_response(data, status=200):
+  return json.dumps(data), status, "application/json"
+
+# background plot jobs, the raw request body is the G-code file. these
+# must be registered before /api/<command> so they take precedence
+@server.route("/api/jobs", methods=["POST"], upload=True)
+def add_job(request):
+  if not request.file:
+    return json_response({"error": "no G-code uploaded"}, 400)
+  if pad.busy():
+    return json_response({"error": "the control pad is moving"}, 409)
+  return json_response(jobs.add(request.file).progress(), 201)
+
+@server.route("/api/jobs", methods=["GET"])
+def list_jobs(request):
+  return json_response([job.progress() for job in jobs.jobs])
+
+@server.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(request, job_id):
+  job = jobs.get(int(job_id)) if job_id.isdigit() else None
+  if not job:
+    return json_response({"error": "no such job"}, 404)
+  return json_response(job.progress())
+
+@server.route("/api/jobs/<job_id>/<action>", methods=["POST"])
+def control_job(request, job_id, action):
+  job = jobs.get(int(job_id)) if job_id.isdigit() else None
+  if not job:
+    return json_response({"error": "no such job"}, 404)
+  if action not in ("pause", "resume", "cancel"):
+    return json_response({"error": "unknown action"}, 400)
+  if not getattr(jobs, action)(job):
+    return json_response({"error": f"cannot {action} a {job.state} job"}, 409)
+  return json_response(job.progress())
+
+# stored macros: the raw request body is the G-code, run one with
+# {"macro": name} through /api/control or '$M name' in a job
+@server.route("/api/macros", methods=["GET"])
+def list_macros(request):
+  return json_response(macros.names())
+
+@server.route("/api/macros/<name>", methods=["POST"], upload=True)
+def define_macro(request, name):
+  if not request.file:
+    return json_response({"error": "no G-code uploaded"}, 400)
+  try:
+    with open(request.file) as f:
+      count = macros.define(name, f, gcode.steps_per_mm)
+  except ValueError as e:
+    return json_response({"error": str(e)}, 400)
+  return json_response({"name": name, "segments": count}, 201)
+
+@server.route("/api/macros/<name>", methods=["DELETE"])
+def delete_macro(request, name):
+  if not macros.delete(name):
+    return json_response({"error": "no such macro"}, 404)
+  return json_response({"name": name})
+
+# control pad: POST a JSON list of commands (see jog.JogQueue.submit),
+# answered with the position they lead to while the moves are made
+@server.route("/api/control", methods=["POST"])
+def control(request):
+  if jobs.busy():
+    return json_response({"error": "a job is running or waiting to start"}, 409)
+  try:
+    position = pad.submit(request.data)
+  except SoftLimitError as e:
+    return json_response({"error": str(e)}, 409)
+  except (ValueError, KeyError, TypeError) as e:
+    return json_response({"error": str(e)}, 400)
+  return json_response({"position": position, "queued": len(pad.queue)})
+
+# step timing profiler, POST /api/profile/on|off|reset
+@server.route("/api/profile", methods=["GET"])
+def get_profile(request):
+  return json_response(profiler.summary())
+
+@server.route("/api/profile/<action>", methods=["POST"])
+def control_profile(request, action):
+  if action in ("on", "off"):
+    for motor in (motor_x, motor_y, motor_z):
+      motor.profiler = profiler if action == "on" else None
+  elif action == "reset":
+    profiler.reset()
+  else:
+    return json_response({"error": "unknown action"}, 400)
+  return json_response(profiler.summary())
+
 @server.route("/api/<command>", methods=["GET", "POST"])
 def api(request,command):
     global status
     status = f"{command}"
-    return await render_template("index.html", status=status)
+    return render_template("index.html", status=status)
 
 
 # catchall example
@@ -41,4 +171,6 @@ def catchall(request):
   return "Not found", 404
 
 # start the webserver
+server.loop.create_task(jobs.run())
+server.loop.create_task(pad.run())
 server.run()
\ No newline at end of file